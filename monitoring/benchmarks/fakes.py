@@ -0,0 +1,262 @@
+import os
+import random
+import threading
+from collections import namedtuple
+from types import SimpleNamespace
+
+# Stand-ins for the psutil functions used by 'monitoring.collect_metrics()',
+# for the cgroup v2 hierarchy read by 'cgroups.UnitResourceCollector' and for
+# the S3 client calls used by the agent and the dashboard. They return
+# plausible values instantly, so benchmarks measure the code of this
+# repository rather than the host or the network.
+
+VirtualMemory = namedtuple("VirtualMemory", ["total", "available", "percent"])
+SwapMemory = namedtuple("SwapMemory", ["total", "used", "percent"])
+DiskUsage = namedtuple("DiskUsage", ["total", "used", "percent"])
+DiskIoCounters = namedtuple(
+    "DiskIoCounters",
+    ["read_count", "write_count", "read_bytes", "write_bytes"],
+)
+NetIoCounters = namedtuple(
+    "NetIoCounters", ["bytes_sent", "bytes_recv", "errin", "errout"]
+)
+CpuTimes = namedtuple(
+    "CpuTimes", ["user", "system", "idle", "iowait", "guest"]
+)
+
+GIB = 1024 * 1024 * 1024
+
+
+class FakePsutil:
+    """
+    Implements the psutil functions read by the agent, with counters that
+    grow at each call.
+    """
+
+    def __init__(self, cpus=8, seed=0):
+        self.cpus = cpus
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.boot = 1_700_000_000.0
+
+    def boot_time(self):
+        return self.boot
+
+    def cpu_count(self):
+        return self.cpus
+
+    def cpu_percent(self):
+        return self.random.uniform(0, 100)
+
+    def cpu_times(self):
+        # 40% busy: guest time is part of user time, iowait is idle.
+        self.calls += 1
+        return CpuTimes(
+            self.calls * 3.0,
+            self.calls * 1.0,
+            self.calls * 5.0,
+            self.calls * 1.0,
+            self.calls * 1.0,
+        )
+
+    def getloadavg(self):
+        load = self.random.uniform(0, self.cpus)
+        return (load, load, load)
+
+    def virtual_memory(self):
+        available = self.random.uniform(1, 15) * GIB
+        return VirtualMemory(16 * GIB, available, 100 - available / GIB * 6.25)
+
+    def swap_memory(self):
+        return SwapMemory(2 * GIB, 0.1 * GIB, 5.0)
+
+    def disk_usage(self, path):
+        return DiskUsage(500 * GIB, 200 * GIB, 40.0)
+
+    def disk_io_counters(self, perdisk=False):
+        self.calls += 1
+        counters = DiskIoCounters(
+            self.calls * 10,
+            self.calls * 20,
+            self.calls * 40960,
+            self.calls * 81920,
+        )
+        return {"sda": counters} if perdisk else counters
+
+    def net_io_counters(self, pernic=False):
+        self.calls += 1
+        counters = NetIoCounters(self.calls * 1500, self.calls * 3000, 0, 0)
+        return {"eth0": counters} if pernic else counters
+
+
+class FakeCgroupTree:
+    """
+    Writes the files read from the cgroups of systemd services under 'root',
+    laid out like '/sys/fs/cgroup/system.slice', with counters that grow at
+    each call of 'advance()'.
+    """
+
+    def __init__(self, root, unit_names):
+        self.root = root
+        self.unit_names = unit_names
+        self.calls = 0
+        self.advance()
+
+    def unit_dir(self, unit_name):
+        return os.path.join(self.root, "system.slice", f"{unit_name}.service")
+
+    def advance(self):
+        self.calls += 1
+        n = self.calls
+        files = {
+            "cpu.stat": (
+                f"usage_usec {n * 300_000}\nuser_usec {n * 200_000}\n"
+                f"system_usec {n * 100_000}\nnr_periods 0\n"
+                "nr_throttled 0\nthrottled_usec 0\n"
+            ),
+            "memory.current": f"{100 * 1024**2 + n * 4096}\n",
+            "memory.peak": f"{200 * 1024**2}\n",
+            "pids.current": "12\n",
+            "io.stat": (
+                f"8:0 rbytes={n * 40960} wbytes={n * 81920} rios={n * 10} "
+                f"wios={n * 20} dbytes=0 dios=0\n"
+                f"8:16 rbytes={n * 4096} wbytes=0 rios={n} wios=0 dbytes=0 "
+                "dios=0\n"
+            ),
+        }
+        for unit_name in self.unit_names:
+            directory = self.unit_dir(unit_name)
+            os.makedirs(directory, exist_ok=True)
+            for name, content in files.items():
+                with open(os.path.join(directory, name), "w") as fo:
+                    fo.write(content)
+
+
+class ClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class NoSuchKey(ClientError):
+    def __init__(self):
+        super().__init__("NoSuchKey")
+
+
+class FakeS3:
+    """
+    In-memory S3 client implementing the calls made by the Uploader and the
+    S3Refresher.
+    """
+
+    exceptions = SimpleNamespace(NoSuchKey=NoSuchKey, ClientError=ClientError)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.requests = 0
+
+    def put(self, key, data, if_match=None, if_none_match=None):
+        with self.lock:
+            self.requests += 1
+            if (if_none_match == "*" and key in self.objects) or (
+                if_match is not None
+                and (key not in self.objects or self.etag(key) != if_match)
+            ):
+                raise ClientError("PreconditionFailed")
+            self.objects[key] = data
+
+    def upload_file(self, path, bucket, key, Config=None):
+        with open(path, "rb") as fi:
+            self.put(key, fi.read())
+
+    def put_object(
+        self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs
+    ):
+        self.put(Key, Body, IfMatch, IfNoneMatch)
+        return {"ETag": self.etag(Key)}
+
+    def delete_objects(self, Bucket, Delete):
+        with self.lock:
+            self.requests += 1
+            for obj in Delete["Objects"]:
+                self.objects.pop(obj["Key"], None)
+
+    def etag(self, key):
+        data = self.objects[key]
+        return f'"{len(data):x}-{hash(data) & 0xFFFFFFFF:08x}"'
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        with self.lock:
+            self.requests += 1
+            if Key not in self.objects:
+                raise NoSuchKey()
+            data = self.objects[Key]
+        if Range is not None:
+            start = int(Range.split("=")[1].split("-")[0])
+            data = data[start:]
+        return {"Body": _Body(data), "ETag": self.etag(Key)}
+
+    def download_file(self, Bucket, Key, Filename):
+        with self.lock:
+            self.requests += 1
+            data = self.objects[Key]
+        with open(Filename, "wb") as fo:
+            fo.write(data)
+
+    def get_paginator(self, operation):
+        return _Paginator(self)
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=None, **kwargs):
+        with self.lock:
+            self.requests += 1
+            keys = sorted(
+                key for key in self.objects if key.startswith(Prefix)
+            )
+        if Delimiter is None:
+            return {
+                "Contents": [
+                    {
+                        "Key": key,
+                        "Size": len(self.objects[key]),
+                        "ETag": self.etag(key),
+                    }
+                    for key in keys
+                ]
+            }
+        prefixes = sorted(
+            {
+                Prefix + key[len(Prefix) :].split(Delimiter)[0] + Delimiter
+                for key in keys
+                if Delimiter in key[len(Prefix) :]
+            }
+        )
+        return {"CommonPrefixes": [{"Prefix": p} for p in prefixes]}
+
+
+class _Body:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class _Paginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, **kwargs):
+        yield self.client.list_objects_v2(**kwargs)
+
+
+def fill_folder(folder, files, size, seed=0):
+    """
+    Write 'files' files of 'size' random printable bytes to 'folder'.
+    """
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    for i in range(files):
+        line = ",".join(str(rng.random()) for _ in range(8)).encode() + b"\n"
+        with open(os.path.join(folder, f"metrics_{i:04d}.csv"), "wb") as fo:
+            fo.write(line * (size // len(line)))
@@ -0,0 +1,137 @@
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import dashboard_data
+from hds_monitoring import models, rollup
+
+# Synthetic logs of a fleet of servers, laid out like the local copy of the
+# S3 bucket used by the dashboard: '<data_dir>/<server>/<kind>_<date>.csv'.
+#
+# Files of a day are generated once, for a template server, and copied for
+# every server with the server name replaced, names all having the same
+# length. Values are rounded to 2 decimals, like most real values.
+
+SERVER_NAME_FORMAT = "server-{:04d}"
+TEMPLATE_SERVER = SERVER_NAME_FORMAT.format(0)
+UNITS = ["nginx", "postgresql"]
+DEVICES = [
+    ("mount", "/", "used_percent"),
+    ("mount", "/data", "used_percent"),
+    ("disk", "sda", "read_bytes_per_sec"),
+    ("nic", "eth0", "bytes_sent_per_sec"),
+]
+INT_FIELDS = ("cpu_count", "memory_total", "memory_swap_total", "disk_total")
+
+
+def server_names(servers):
+    return [SERVER_NAME_FORMAT.format(i) for i in range(servers)]
+
+
+def timestamps(day, seconds, now):
+    start = datetime.combine(day, datetime.min.time())
+    end = min(start + timedelta(days=1), now)
+    return pd.date_range(start, end, freq=f"{seconds}s", inclusive="left")
+
+
+def metrics_frame(ts, rng):
+    df = pd.DataFrame({"server_name": TEMPLATE_SERVER, "timestamp": ts})
+    for name in models.METRICS_FIELD_NAMES[2:]:
+        if name in INT_FIELDS:
+            df[name] = 8 if name == "cpu_count" else 500 * 1024**3
+        else:
+            df[name] = rng.uniform(0, 100, len(ts)).round(2)
+    return df
+
+
+def rollup_frame(ts, rng):
+    df = pd.DataFrame(
+        {"server_name": TEMPLATE_SERVER, "timestamp": ts, "samples": 5}
+    )
+    for name in models.ROLLUP_FIELD_NAMES[3:]:
+        df[name] = rng.uniform(0, 100, len(ts)).round(2)
+    return df
+
+
+def services_frame(ts, rng):
+    frames = []
+    for unit in UNITS:
+        active = rng.random(len(ts)) > 0.01
+        frames.append(
+            pd.DataFrame(
+                {
+                    "server_name": TEMPLATE_SERVER,
+                    "timestamp": ts,
+                    "unit_name": unit,
+                    "active": active,
+                    "active_state": np.where(active, "active", "failed"),
+                    "sub_state": np.where(active, "running", "failed"),
+                    "state_changed_at": ts[0],
+                }
+            )
+        )
+    return pd.concat(frames).sort_values("timestamp", kind="stable")
+
+
+def devices_frame(ts, rng):
+    frames = [
+        pd.DataFrame(
+            {
+                "server_name": TEMPLATE_SERVER,
+                "timestamp": ts,
+                "kind": kind,
+                "device": device,
+                "metric": metric,
+                "value": rng.uniform(0, 100, len(ts)).round(2),
+            }
+        )
+        for kind, device, metric in DEVICES
+    ]
+    return pd.concat(frames).sort_values("timestamp", kind="stable")
+
+
+def day_files(day, now, rng):
+    """
+    Return a dictionary mapping the kinds of logs to the CSV bytes of the
+    template server for a day.
+    """
+    ts = timestamps(day, 60, now)
+    frames = {
+        "metrics": metrics_frame(ts, rng),
+        "services": services_frame(ts, rng),
+        "devices": devices_frame(ts, rng),
+    }
+    for tier, seconds in rollup.TIERS.items():
+        frames[f"metrics-{tier}"] = rollup_frame(
+            timestamps(day, seconds, now), rng
+        )
+    return {
+        kind: df.to_csv(index=False).encode() for kind, df in frames.items()
+    }
+
+
+def generate_fleet(data_dir, servers, days, seed=0, now=None):
+    """
+    Write the logs of 'servers' servers over the last 'days' days, today
+    included, and return the number of bytes written.
+    """
+    now = now or datetime.now()
+    rng = np.random.default_rng(seed)
+    names = server_names(servers)
+    for name in names:
+        os.makedirs(os.path.join(data_dir, name), exist_ok=True)
+    written = 0
+    for offset in range(days):
+        day = (now - timedelta(days=offset)).date()
+        date_str = day.strftime(dashboard_data.DATE_FORMAT)
+        for kind, data in day_files(day, now, rng).items():
+            for name in names:
+                path = os.path.join(data_dir, name, f"{kind}_{date_str}.csv")
+                with open(path, "wb") as fo:
+                    fo.write(
+                        data.replace(TEMPLATE_SERVER.encode(), name.encode())
+                    )
+                written += len(data)
+    return written
@@ -0,0 +1,176 @@
+"""
+Load test of the ingestion server with simulated agents.
+
+Run from the 'monitoring' directory:
+
+    python -m benchmarks.ingest                        # 300 agents, 30 s
+    python -m benchmarks.ingest --agents 1000 --interval 5
+
+The server runs in its own process, like 'python -m hds_monitoring.ingest',
+and agents are simulated by a thread pool, each agent pushing a Metrics row
+and the statuses of a few units every 'interval' seconds, with the Pusher
+used by real agents. The CPU time of the server process is read with psutil
+before and after the run, so the report shows how much of a core the server
+needs for that many agents, with the latency of pushes seen by the agents.
+"""
+
+import argparse
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import psutil
+
+from hds_monitoring import ingest, models
+
+MONITORING_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UNITS = ["nginx", "postgresql", "sshd"]
+STARTUP_TIMEOUT_SEC = 10
+
+
+def metrics_row(server_name, timestamp, rng):
+    values = {name: rng.uniform(0, 100) for name in models.METRICS_FIELD_NAMES}
+    values.update(
+        server_name=server_name,
+        timestamp=timestamp,
+        cpu_count=8,
+        memory_total=32 * 1024**3,
+        memory_swap_total=4 * 1024**3,
+        disk_total=500 * 1024**3,
+    )
+    return models.Metrics(**values)
+
+
+def unit_rows(server_name, timestamp):
+    return [
+        models.SystemdUnit(
+            server_name, timestamp, unit, True, "active", "running", timestamp
+        )
+        for unit in UNITS
+    ]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, token):
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "hds_monitoring.ingest",
+            "--port",
+            str(port),
+            "--token",
+            token,
+        ],
+        env=dict(os.environ, PYTHONPATH=MONITORING_DIR),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SEC
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("Ingestion server did not start")
+
+
+class Agent:
+    def __init__(self, index, url, token):
+        self.server_name = f"agent-{index:04d}"
+        self.pusher = ingest.Pusher(url, token)
+        self.rng = random.Random(index)
+        self.latencies = []
+
+    def push(self):
+        now = datetime.now()
+        start = time.perf_counter()
+        self.pusher.push(
+            (
+                metrics_row(self.server_name, now, self.rng),
+                unit_rows(self.server_name, now),
+            )
+        )
+        self.latencies.append(time.perf_counter() - start)
+
+
+def run(agents, interval, seconds):
+    """
+    Push batches from 'agents' simulated agents every 'interval' seconds for
+    'seconds' seconds, and return a dictionary describing the run.
+    """
+    port = free_port()
+    token = "benchmark"
+    url = f"http://127.0.0.1:{port}{ingest.INGEST_PATH}"
+    process = start_server(port, token)
+    server = psutil.Process(process.pid)
+    simulated = [Agent(i, url, token) for i in range(agents)]
+    try:
+        cpu_start = sum(server.cpu_times()[:2])
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(agents, 64)) as pool:
+            tick = start
+            while tick - start < seconds:
+                # Agents of a real fleet are not synchronized: spread their
+                # pushes over the interval.
+                for agent in simulated:
+                    pool.submit(agent.push)
+                    time.sleep(interval / agents / 2)
+                tick += interval
+                time.sleep(max(0, tick - time.monotonic()))
+        elapsed = time.monotonic() - start
+        cpu = sum(server.cpu_times()[:2]) - cpu_start
+        rss = server.memory_info().rss
+    finally:
+        process.terminate()
+        process.wait()
+
+    latencies = sorted(
+        latency for agent in simulated for latency in agent.latencies
+    )
+    pushes = len(latencies)
+    rows = pushes * (1 + len(UNITS))
+    return {
+        "agents": agents,
+        "pushes": pushes,
+        "failures": sum(agent.pusher.failures for agent in simulated),
+        "rows_per_sec": rows / elapsed,
+        "server_cpu_percent": 100 * cpu / elapsed,
+        "server_rss_mib": rss / 1024**2,
+        "latency_p50_ms": 1000 * statistics.median(latencies),
+        "latency_p99_ms": 1000 * latencies[int(0.99 * (pushes - 1))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the ingestion server with simulated agents."
+    )
+    parser.add_argument("--agents", type=int, default=300)
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="seconds between two pushes of an agent (default 1)",
+    )
+    parser.add_argument("--seconds", type=float, default=30.0)
+    args = parser.parse_args()
+    for name, value in run(args.agents, args.interval, args.seconds).items():
+        print(f"{name:<20} {value:.6g}")
+
+
+if __name__ == "__main__":
+    main()
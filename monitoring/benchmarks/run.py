@@ -0,0 +1,496 @@
+"""
+Benchmarks of the agent and of the dashboard.
+
+Run from the 'monitoring' directory:
+
+    python -m benchmarks.run                   # compare with the baselines
+    python -m benchmarks.run --save            # record new baselines
+    python -m benchmarks.run --fleets 500x90   # benchmark a larger fleet
+
+psutil and S3 are replaced by the fakes of 'benchmarks.fakes', and the
+dashboard callbacks run against fleets generated by 'benchmarks.fleet', so
+results only depend on the code and on the machine running them. Each
+benchmark reports its median latency, the peak memory allocated while it
+runs, measured in a separate run with tracemalloc, and its throughput when
+it processes a known amount of data. Cold start benchmarks run fresh agent
+processes instead, their peak memory is the maximum resident memory of the
+process, and they are checked against COLD_START_BUDGETS. Baselines are
+stored in 'baselines.json' and each run prints the change from them.
+"""
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+# The dashboard modules are imported from the 'monitoring' directory, which
+# must stay importable after the dashboard benchmarks change directory.
+MONITORING_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FLEETS = "10x1,10x7,100x1"
+# Relative increase of latency or peak memory reported as a regression.
+TOLERANCE = 0.25
+# Maximum wall time and resident memory of a fresh agent process, for each
+# cold start benchmark. Agents started by systemd timers pay this cost at
+# every run.
+COLD_START_BUDGETS = {
+    "import": (0.25, 64 * 1024**2),
+    "collect": (1.0, 80 * 1024**2),
+}
+# Runs the agent like its entry point does and prints its maximum resident
+# memory, in KiB on Linux.
+COLD_START_SCRIPT = """
+import resource, sys
+from hds_monitoring import main
+if sys.argv[1:]:
+    main.main(sys.argv[1:])
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+CONFIG = """[default]
+server_name = bench
+systemd_units =
+data_dir = {work_dir}/data
+log_dir = {work_dir}/log
+log_level = warning
+s3_bucket = bench
+state_dir = {work_dir}/state
+"""
+
+
+def setup_environment(work_dir):
+    """
+    Write an agent configuration to 'work_dir' and point the agent at it.
+    Must be called before the agent modules are imported.
+    """
+    for name in ("data", "log", "state"):
+        os.makedirs(os.path.join(work_dir, name), exist_ok=True)
+    with open(os.path.join(work_dir, "hds.conf"), "w") as fo:
+        fo.write(CONFIG.format(work_dir=work_dir))
+    os.environ["HDS_MONITORING_APP_DIR"] = work_dir
+    os.environ["HDS_MONITORING_CONFIG_FILE"] = "hds.conf"
+
+
+def measure(func, setup=None, repeat=5, items=None, unit=None):
+    """
+    Return the median latency of 'func' over 'repeat' runs, the peak memory
+    it allocates, and its throughput in 'items' 'unit' per second. 'setup'
+    is called before each run and is not measured.
+    """
+    latencies = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latency = statistics.median(latencies)
+    result = {"latency_sec": latency, "peak_bytes": peak}
+    if items is not None:
+        result["throughput"] = items / latency if latency > 0 else 0.0
+        result["unit"] = f"{unit}/s"
+    return result
+
+
+def bench_collect_metrics(results):
+    from benchmarks import fakes
+    from hds_monitoring import monitoring
+
+    monitoring.psu = fakes.FakePsutil()
+    monitoring.LAST_IO_COUNTERS = None
+    calls = 1000
+
+    def collect():
+        for _ in range(calls):
+            monitoring.collect_metrics(interval=0)
+
+    results["agent/collect_metrics"] = measure(
+        collect, items=calls, unit="calls"
+    )
+
+
+def bench_unit_resources(results, work_dir, units=50):
+    from benchmarks import fakes
+    from hds_monitoring import cgroups
+
+    unit_names = [f"unit-{i}" for i in range(units)]
+    tree = fakes.FakeCgroupTree(os.path.join(work_dir, "cgroup"), unit_names)
+    collector = cgroups.UnitResourceCollector(unit_names, root=tree.root)
+    collector.sample()
+    calls = 20
+
+    def collect():
+        for _ in range(calls):
+            collector.collect("bench", datetime(2024, 1, 1))
+
+    results["agent/unit_resources"] = measure(
+        collect, setup=tree.advance, items=calls * units, unit="units"
+    )
+
+
+def metrics_rows(count):
+    from benchmarks import fakes
+    from hds_monitoring import monitoring
+
+    monitoring.psu = fakes.FakePsutil()
+    monitoring.LAST_IO_COUNTERS = None
+    row = monitoring.collect_metrics(interval=0)
+    start = datetime(2024, 1, 1)
+    return [
+        row._replace(timestamp=start + timedelta(minutes=i))
+        for i in range(count)
+    ]
+
+
+def bench_appenders(results, work_dir):
+    from hds_monitoring import io, models
+
+    rows = metrics_rows(7 * 1440)
+    directory = os.path.join(work_dir, "appenders")
+
+    for storage_format, appender_class in io.APPENDER_CLASSES.items():
+
+        def setup():
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory)
+
+        def append():
+            appender = appender_class(
+                "metrics",
+                models.METRICS_FIELD_NAMES,
+                directory,
+                flush_rows=60,
+                field_types=models.METRICS_FIELD_TYPES,
+            )
+            for row in rows:
+                appender.append(row)
+            appender.close()
+
+        results[f"agent/appender/{storage_format}"] = measure(
+            append, setup=setup, items=len(rows), unit="rows"
+        )
+
+
+def bench_copy_folder_to_s3(results, work_dir, files=20, size=256 * 1024):
+    from benchmarks import fakes
+    from hds_monitoring import aws, spool
+
+    folder = os.path.join(work_dir, "sync", "data")
+    state_dir = os.path.join(work_dir, "sync", "state")
+    context = {}
+
+    def reset():
+        shutil.rmtree(os.path.join(work_dir, "sync"), ignore_errors=True)
+        fakes.fill_folder(folder, files, size)
+        context["uploader"] = aws.Uploader(
+            spool.Spool(os.path.join(state_dir, "spool")),
+            client=fakes.FakeS3(),
+        )
+
+    def sync():
+        aws.copy_folder_to_s3(
+            folder,
+            "bench",
+            "bench",
+            os.path.join(state_dir, "s3_manifest.json"),
+            context["uploader"],
+        )
+
+    def grow():
+        reset()
+        sync()
+        for name in os.listdir(folder):
+            with open(os.path.join(folder, name), "ab") as fo:
+                fo.write(b"0" * 4096)
+
+    results["agent/copy_folder_to_s3/full"] = measure(
+        sync, setup=reset, items=files * size, unit="bytes"
+    )
+    results["agent/copy_folder_to_s3/incremental"] = measure(
+        sync, setup=grow, items=files * 4096, unit="bytes"
+    )
+
+
+def bench_cold_start(results, repeat=5):
+    """
+    Measure the startup of fresh agent processes: importing the entry point
+    only, and collecting a single sample like a systemd timer does. Return
+    the benchmarks exceeding their COLD_START_BUDGETS.
+    """
+    over_budget = []
+    env = dict(os.environ, PYTHONPATH=MONITORING_DIR)
+    for name, args in (("import", []), ("collect", ["collect"])):
+        latencies = []
+        peak = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, "-c", COLD_START_SCRIPT, *args],
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            latencies.append(time.perf_counter() - start)
+            peak = max(peak, int(output.split()[-1]) * 1024)
+        key = f"agent/cold_start/{name}"
+        results[key] = {
+            "latency_sec": statistics.median(latencies),
+            "peak_bytes": peak,
+        }
+        max_latency, max_rss = COLD_START_BUDGETS[name]
+        if results[key]["latency_sec"] > max_latency:
+            over_budget.append(f"{key} (latency over {max_latency} s)")
+        if peak > max_rss:
+            over_budget.append(
+                f"{key} (resident memory over {max_rss / 1024**2:.0f} MiB)"
+            )
+    return over_budget
+
+
+def dashboard_callbacks(days):
+    """
+    Return (name, function) tuples calling each dashboard callback for all
+    servers, over the default time range and over the whole fleet history.
+    """
+    import dashboard
+
+    today = datetime.now().date()
+    ranges = {"24h": (None, None)}
+    if days > 1:
+        ranges[f"{days}d"] = (
+            (today - timedelta(days=days - 1)).isoformat(),
+            today.isoformat(),
+        )
+
+    callbacks = [
+        (
+            f"service_status_table/{window}d",
+            dashboard.update_service_status_table,
+            (window,),
+        )
+        for window in dashboard.SERVICE_WINDOWS
+        if window <= days
+    ]
+    callbacks.append(
+        ("system_parameters", dashboard.update_system_parameters_table, ())
+    )
+    relayouts = [None] * len(dashboard.METRICS_GRAPHS)
+    for name, (start_date, end_date) in ranges.items():
+        # Polls of the live interval extend the figures built at page load.
+        _, _, cursors = dashboard.metrics_graphs(
+            "*", start_date, end_date, relayouts, None, None
+        )
+        callbacks.extend(
+            [
+                (
+                    f"metrics_graphs/{name}",
+                    dashboard.metrics_graphs,
+                    (start_date, end_date, relayouts, None, None),
+                ),
+                (
+                    f"metrics_graphs/{name}/live",
+                    dashboard.metrics_graphs,
+                    (
+                        start_date,
+                        end_date,
+                        relayouts,
+                        "live-interval",
+                        cursors,
+                    ),
+                ),
+                (
+                    f"device_options/{name}",
+                    dashboard.update_device_options,
+                    (start_date, end_date, "mount:used_percent"),
+                ),
+                (
+                    f"device_metrics/{name}",
+                    dashboard.update_device_metrics,
+                    (
+                        start_date,
+                        end_date,
+                        None,
+                        "disk:read_bytes_per_sec",
+                        [],
+                    ),
+                ),
+            ]
+        )
+    return [
+        (name, lambda func=func, args=args: func("*", *args))
+        for name, func, args in callbacks
+    ]
+
+
+def bench_dashboard(results, work_dir, servers, days):
+    from benchmarks import fleet
+
+    fleet_name = f"{servers}x{days}"
+    root = os.path.join(work_dir, f"fleet-{fleet_name}")
+    start = time.perf_counter()
+    written = fleet.generate_fleet(
+        os.path.join(root, "dashboard_data"), servers, days
+    )
+    print(
+        f"Generated fleet {fleet_name}: {written / 1024**2:.0f} MiB in "
+        f"{time.perf_counter() - start:.1f} s",
+        file=sys.stderr,
+    )
+
+    # The dashboard lists servers from the relative directory
+    # 'dashboard_data'.
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        import dashboard
+        import dashboard_data
+
+        def cold():
+            dashboard.DATA = dashboard_data.LogCache()
+
+        cold()
+        for name, func in dashboard_callbacks(days):
+            key = f"dashboard/{fleet_name}/{name}"
+            results[f"{key}/cold"] = measure(func, setup=cold, repeat=3)
+            results[f"{key}/warm"] = measure(func, repeat=3)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def compare(results, baselines, tolerance):
+    """
+    Print the results and their change from the baselines, and return the
+    names of the benchmarks that regressed by more than 'tolerance'.
+    """
+    regressions = []
+    print(
+        f"{'benchmark':<58} {'latency':>11} {'change':>7} "
+        f"{'peak MiB':>9} {'change':>7} {'throughput':>16}"
+    )
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        changes = []
+        for metric in ("latency_sec", "peak_bytes"):
+            if baseline is None or not baseline[metric]:
+                changes.append("")
+                continue
+            change = result[metric] / baseline[metric] - 1
+            changes.append(f"{change:+.0%}")
+            if change > tolerance:
+                regressions.append(f"{name} ({metric} {change:+.0%})")
+        throughput = (
+            f"{result['throughput']:.3g} {result['unit']}"
+            if "throughput" in result
+            else ""
+        )
+        print(
+            f"{name:<58} {result['latency_sec'] * 1000:>8.2f} ms "
+            f"{changes[0]:>7} {result['peak_bytes'] / 1024**2:>9.2f} "
+            f"{changes[1]:>7} {throughput:>16}"
+        )
+    return regressions
+
+
+def parse_fleets(text):
+    return [
+        tuple(int(value) for value in fleet.split("x"))
+        for fleet in text.split(",")
+        if fleet
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the agent and the dashboard."
+    )
+    parser.add_argument(
+        "--fleets",
+        default=DEFAULT_FLEETS,
+        help="comma-separated <servers>x<days> fleets for the dashboard "
+        f"benchmarks (default {DEFAULT_FLEETS})",
+    )
+    parser.add_argument(
+        "--only",
+        choices=["agent", "dashboard"],
+        help="only run the benchmarks of the agent or of the dashboard",
+    )
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help="store the results as the new baselines",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="exit with status 1 if a benchmark regressed",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=TOLERANCE,
+        help=f"relative increase reported as a regression (default "
+        f"{TOLERANCE})",
+    )
+    args = parser.parse_args()
+
+    sys.path.insert(0, MONITORING_DIR)
+    work_dir = tempfile.mkdtemp(prefix="hds-bench-")
+    setup_environment(work_dir)
+    results = {}
+    over_budget = []
+    try:
+        if args.only != "dashboard":
+            over_budget = bench_cold_start(results)
+            bench_collect_metrics(results)
+            bench_unit_resources(results, work_dir)
+            bench_appenders(results, work_dir)
+            bench_copy_folder_to_s3(results, work_dir)
+        if args.only != "agent":
+            for servers, days in parse_fleets(args.fleets):
+                bench_dashboard(results, work_dir, servers, days)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as fi:
+            baselines = json.load(fi)
+    regressions = compare(results, baselines, args.tolerance)
+
+    if args.save:
+        baselines.update(results)
+        with open(BASELINES_PATH, "w") as fo:
+            json.dump(baselines, fo, indent=2, sort_keys=True)
+            fo.write("\n")
+    if over_budget:
+        print("Over budget:\n  " + "\n  ".join(over_budget))
+    if regressions:
+        print("Regressions:\n  " + "\n  ".join(regressions))
+    if args.check and (regressions or over_budget):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,4 @@
-import csv
 import os
-import re
-from collections import defaultdict, namedtuple
 from datetime import datetime, timedelta
 from typing import List
 
@@ -11,127 +8,99 @@ import pandas as pd
 import plotly.express as px
 from dash import dcc
 from dash import html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+
+import dashboard_data
+from hds_monitoring import ingest
 
 
 S3_BUCKET = "home-data-center-monitoring-jschnab"
 S3_CLIENT = boto3.client("s3")
-S3_DELIM = "/"
-DATA_DIR = "dashboard_data"
-LOG_DATE_REGEX = r"(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2}).csv$"
-METRICS_LOG_KEY_REGEX = re.compile(r"^.+metrics_" + LOG_DATE_REGEX)
-SERVICES_LOG_KEY_REGEX = re.compile(r"^.+services_" + LOG_DATE_REGEX)
-TS_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+DATA_DIR = dashboard_data.DATA_DIR
+REFRESHER = dashboard_data.S3Refresher(S3_CLIENT, S3_BUCKET, DATA_DIR)
+# Port the ingestion server listens on for rows pushed by agents, if any.
+INGEST_PORT = os.getenv("HDS_DASHBOARD_INGEST_PORT")
+INGEST_TOKEN = os.getenv("HDS_DASHBOARD_INGEST_TOKEN")
+LIVE = ingest.LiveStore() if INGEST_PORT else None
+DATA = dashboard_data.LogCache(DATA_DIR, fetcher=REFRESHER, live=LIVE)
 
 GIB = 1024 * 1024 * 1024
 
+# Graphs of the "metrics" logs, with the column they plot.
+METRICS_GRAPHS = [
+    ("cpu-percent", "cpu_percent"),
+    ("memory-used-percent", "memory_used_percent"),
+    ("disk-used-percent", "disk_used_percent"),
+]
+# Seconds between two polls of the browser for new metrics.
+LIVE_REFRESH_SEC = 30
+# Windows over which the availability of services is computed, in days.
+SERVICE_WINDOWS = [1, 7, 30]
+
 GRAPH_COLORS = ["blue", "red", "green", "yellow", "purple", "orange"]
 
-
-def get_server_names_from_s3(
-    s3_bucket: str = S3_BUCKET, s3_delimiter: str = S3_DELIM
-) -> List[str]:
-    response = S3_CLIENT.list_objects_v2(
-        Bucket=s3_bucket, Delimiter=s3_delimiter
-    )
-    return sorted(
-        [
-            item["Prefix"].rstrip(s3_delimiter)
-            for item in response["CommonPrefixes"]
-        ]
-    )
+# Metrics of the "devices" logs, by kind of device.
+DEVICE_METRICS = [
+    ("mount", "used_percent"),
+    ("mount", "used"),
+    ("disk", "read_ops_per_sec"),
+    ("disk", "write_ops_per_sec"),
+    ("disk", "read_bytes_per_sec"),
+    ("disk", "write_bytes_per_sec"),
+    ("nic", "bytes_sent_per_sec"),
+    ("nic", "bytes_received_per_sec"),
+    ("nic", "errors_receiving_per_sec"),
+    ("nic", "errors_sending_per_sec"),
+]
 
 
 def get_server_names_from_local(data_dir: str = DATA_DIR) -> List[str]:
+    os.makedirs(data_dir, exist_ok=True)
     return sorted([path.rstrip("/") for path in os.listdir(data_dir)])
 
 
-def make_data_dirs(server_names: List[str]) -> None:
-    for sn in server_names:
-        os.makedirs(os.path.join(DATA_DIR, sn), exist_ok=True)
-
-
-def get_last_logs(
-    server_names: List[str], s3_bucket: str = S3_BUCKET
-) -> List[dict]:
-    server_logs = {}
-    for sname in server_names:
-        metrics_keys = []
-        services_keys = []
-        response = S3_CLIENT.list_objects_v2(Bucket=s3_bucket, Prefix=sname)
-        for key in (cont["Key"] for cont in response["Contents"]):
-            if (match := METRICS_LOG_KEY_REGEX.match(key)) is not None:
-                metrics_keys.append(
-                    (
-                        key,
-                        datetime(
-                            int(match["year"]),
-                            int(match["month"]),
-                            int(match["day"]),
-                        ),
-                    )
-                )
-            elif (match := SERVICES_LOG_KEY_REGEX.match(key)) is not None:
-                services_keys.append(
-                    (
-                        key,
-                        datetime(
-                            int(match["year"]),
-                            int(match["month"]),
-                            int(match["day"]),
-                        ),
-                    )
-                )
-        server_logs[sname] = {
-            "metrics": sorted(metrics_keys, key=lambda x: x[1])[-1][0],
-            "services": sorted(services_keys, key=lambda x: x[1])[-1][0],
-        }
-    return server_logs
+def get_server_names() -> List[str]:
+    server_names = get_server_names_from_local()
+    if LIVE is not None:
+        server_names = sorted(set(server_names) | set(LIVE.server_names()))
+    return server_names
 
 
-def download_logs(logs: dict, s3_bucket=S3_BUCKET, data_dir=DATA_DIR) -> None:
-    """
-    Downloads logs from S3 to local disk.
-
-    The parameter logs is a dictionary formatted as:
-
-    {
-        "<server-name-1>: {
-            "metrics": "<metrics-logs-s3-key>",
-            "services": "<services-logs-s3-key>",
-        },
-        ...
-        "<server-name-n>: {
-            "metrics": "<metrics-logs-s3-key>",
-            "services": "<services-logs-s3-key>",
-        },
-    }
+def selected_server_names(server_name: str) -> List[str]:
+    if server_name == "*":
+        return get_server_names()
+    return [server_name]
+
 
-    S3 keys are prefixed with the server name, so no need to join with the
-    server name when building the local file path.
+def requested_range(start_date, end_date, relayout_data, graph_id):
     """
-    for server, logs in logs.items():
-        S3_CLIENT.download_file(
-            Bucket=s3_bucket,
-            Key=logs["metrics"],
-            Filename=os.path.join(data_dir, logs["metrics"]),
-        )
-        S3_CLIENT.download_file(
-            Bucket=s3_bucket,
-            Key=logs["services"],
-            Filename=os.path.join(data_dir, logs["services"]),
-        )
-
-
-def download_last_logs() -> None:
-    servers = get_server_names_from_s3()
-    make_data_dirs(servers)
-    last_logs = get_last_logs(servers)
-    download_logs(last_logs)
+    Returns the start and end of the time range to plot: the range the user
+    zoomed to if the graph triggered the callback, else the dates of the date
+    picker, the end date being included, else the last 24 hours.
+    """
+    if relayout_data and dash.ctx.triggered_id == graph_id:
+        if "xaxis.range[0]" in relayout_data:
+            bounds = (
+                relayout_data["xaxis.range[0]"],
+                relayout_data["xaxis.range[1]"],
+            )
+        else:
+            bounds = relayout_data.get("xaxis.range")
+        if bounds is not None:
+            return tuple(
+                pd.Timestamp(bound).to_pydatetime() for bound in bounds
+            )
+    if start_date and end_date:
+        start = datetime.fromisoformat(start_date[:10])
+        end = datetime.fromisoformat(end_date[:10]) + timedelta(days=1)
+        return start, end
+    end = datetime.now()
+    return end - timedelta(days=1), end
 
 
 def app_layout():
-    server_names = get_server_names_from_local()
+    server_names = get_server_names()
+    today = datetime.now().date()
 
     return [
         html.Title(["Home Data Center Monitoring"]),
@@ -141,64 +110,71 @@ def app_layout():
             value="*",
             id="server-name-drop-down",
         ),
+        html.Label("Dates:", htmlFor="date-range"),
+        dcc.DatePickerRange(
+            id="date-range",
+            start_date=today - timedelta(days=1),
+            end_date=today,
+            max_date_allowed=today,
+            display_format="YYYY-MM-DD",
+        ),
         html.H2("Service Statuses"),
+        html.Label("Availability over:", htmlFor="service-window-drop-down"),
+        dcc.Dropdown(
+            options=[
+                {
+                    "label": f"{days} day{'s' if days > 1 else ''}",
+                    "value": days,
+                }
+                for days in SERVICE_WINDOWS
+            ],
+            value=SERVICE_WINDOWS[0],
+            clearable=False,
+            id="service-window-drop-down",
+        ),
         html.Table(id="service-status-table"),
         html.H2("System parameters"),
         html.Table(id="system-parameters"),
         html.H2("Server Metrics"),
+        dcc.Interval(id="live-interval", interval=LIVE_REFRESH_SEC * 1000),
+        dcc.Store(id="metrics-cursors"),
         html.H3("CPU Utilization (%)"),
         dcc.Graph(id="cpu-percent"),
         html.H3("Memory Utilization (%)"),
         dcc.Graph(id="memory-used-percent"),
         html.H3("Disk Utilization (%)"),
         dcc.Graph(id="disk-used-percent"),
+        html.H2("Device Metrics"),
+        dcc.Dropdown(
+            options=[
+                {"label": f"{kind}: {metric}", "value": f"{kind}:{metric}"}
+                for kind, metric in DEVICE_METRICS
+            ],
+            value="mount:used_percent",
+            clearable=False,
+            id="device-metric-drop-down",
+        ),
+        dcc.Dropdown(
+            multi=True,
+            placeholder="All devices",
+            id="device-drop-down",
+        ),
+        dcc.Graph(id="device-metrics"),
     ]
 
 
 @dash.callback(
     Output(component_id="service-status-table", component_property="children"),
     Input(component_id="server-name-drop-down", component_property="value"),
+    Input(component_id="service-window-drop-down", component_property="value"),
 )
-def update_service_status_table(server_name):
-    if server_name == "*":
-        server_names = get_server_names_from_local()
-    else:
-        server_names = [server_name]
-
-    log_paths = []
-    for sname in server_names:
-        dir_name = os.path.join(DATA_DIR, sname)
-        log_paths.append(
-            [
-                os.path.join(dir_name, path)
-                for path in os.listdir(dir_name)
-                if "services" in path
-            ][0]
-        )
-
-    last_statuses = defaultdict(dict)
-
-    for lpath in log_paths:
-        with open(lpath) as fi:
-            reader = csv.reader(fi)
-            # Read column names from header.
-            Data = namedtuple("Data", next(reader))
-
-            for row in map(Data._make, reader):
-                if row.server_name == server_name or server_name == "*":
-                    timestamp = datetime.strptime(row.timestamp, TS_FORMAT)
-                    if (
-                        last := last_statuses.get(row.server_name, {}).get(
-                            row.unit_name
-                        )
-                    ) is not None:
-                        if (
-                            datetime.strptime(last.timestamp, TS_FORMAT)
-                            < timestamp
-                        ):
-                            last_statuses[row.server_name][row.unit_name] = row
-                    else:
-                        last_statuses[row.server_name][row.unit_name] = row
+def update_service_status_table(server_name, window_days):
+    end = datetime.now()
+    start = end - timedelta(days=window_days)
+    services_df = DATA.load(
+        selected_server_names(server_name), "services", start=start, end=end
+    )
+    statuses = dashboard_data.service_availability(services_df, start, end)
 
     return html.Table(
         [
@@ -207,6 +183,9 @@ def update_service_status_table(server_name):
                     html.Th("Server Name"),
                     html.Th("Service Name"),
                     html.Th("Status"),
+                    html.Th("Availability (%)"),
+                    html.Th("Flaps"),
+                    html.Th("Last Transition"),
                 ]
             )
         ]
@@ -215,13 +194,21 @@ def update_service_status_table(server_name):
                 [
                     html.Td(server_name),
                     html.Td(service_name),
+                    html.Td(row.active_state),
+                    html.Td(
+                        "n/a"
+                        if pd.isna(row.availability_percent)
+                        else f"{row.availability_percent:.2f}"
+                    ),
+                    html.Td(row.flaps),
                     html.Td(
-                        "active" if row.active.lower() == "true" else "failed"
+                        ""
+                        if pd.isna(row.last_transition)
+                        else f"{row.last_transition:%Y-%m-%d %H:%M}"
                     ),
                 ]
             )
-            for server_name, service in last_statuses.items()
-            for service_name, row in service.items()
+            for (server_name, service_name), row in statuses.iterrows()
         ]
     )
 
@@ -231,29 +218,16 @@ def update_service_status_table(server_name):
     Input(component_id="server-name-drop-down", component_property="value"),
 )
 def update_system_parameters_table(server_name):
-    if server_name == "*":
-        server_names = get_server_names_from_local()
-    else:
-        server_names = [server_name]
-
-    log_paths = []
-    for sname in server_names:
-        dir_name = os.path.join(DATA_DIR, sname)
-        log_paths.extend(
-            [
-                os.path.join(dir_name, path)
-                for path in os.listdir(dir_name)
-                if "metrics" in path
-            ]
-        )
-
-    dfs = []
-    for lpath in log_paths:
-        dfs.append(pd.read_csv(lpath))
-    concat_df = pd.concat(dfs)
-    concat_df["timestamp"] = pd.to_datetime(concat_df["timestamp"])
-
-    most_recent = concat_df.groupby("server_name").max("timestamp")
+    end = datetime.now()
+    metrics_df = DATA.load(
+        selected_server_names(server_name),
+        "metrics",
+        start=end - timedelta(days=1),
+        end=end,
+    )
+    most_recent = (
+        metrics_df.sort_values("timestamp").groupby("server_name").last()
+    )
 
     return html.Table(
         [
@@ -284,153 +258,275 @@ def update_system_parameters_table(server_name):
     )
 
 
-@dash.callback(
-    Output("cpu-percent", "figure"),
-    Input("server-name-drop-down", "value"),
-)
-def update_cpu_percent(server_name):
-    if server_name == "*":
-        server_names = get_server_names_from_local()
-    else:
-        server_names = [server_name]
-
-    log_paths = []
-    for sname in server_names:
-        dir_name = os.path.join(DATA_DIR, sname)
-        log_paths.extend(
-            [
-                os.path.join(dir_name, path)
-                for path in os.listdir(dir_name)
-                if "metrics" in path
-            ]
-        )
-
-    dfs = []
-    for lpath in log_paths:
-        dfs.append(pd.read_csv(lpath))
-    concat_df = pd.concat(dfs)
-    concat_df["timestamp"] = pd.to_datetime(concat_df["timestamp"])
-
-    ts_cut_df = concat_df[
-        concat_df["timestamp"] >= datetime.now() - timedelta(days=1)
-    ]
-
-    if server_name == "*":
-        final_df = ts_cut_df
-    else:
-        final_df = ts_cut_df[ts_cut_df["server_name"] == server_name]
-
-    final_df.sort_values(["server_name", "timestamp"], inplace=True)
-
-    return px.line(
+def metrics_figure(server_name, column, start, end):
+    """
+    Returns the figure of a column of the metrics of the selected servers
+    between 'start' and 'end', and the cursor that 'extend_metrics_figure()'
+    needs to add the rows that come next, or None if the figure only shows
+    the past.
+    """
+    now = datetime.now()
+    server_names = selected_server_names(server_name)
+    kind = dashboard_data.choose_metrics_tier(start, end)
+    metrics_df = DATA.load(server_names, kind, start=start, end=end)
+    if kind != "metrics" and metrics_df.empty:
+        # Agents that predate rollups only have raw metrics.
+        kind = "metrics"
+        metrics_df = DATA.load(server_names, kind, start=start, end=end)
+    if kind != "metrics":
+        column = f"{column}_mean"
+    final_df = metrics_df.reindex(
+        columns=["server_name", "timestamp", column]
+    ).sort_values(["server_name", "timestamp"])
+
+    figure = px.line(
         final_df,
         x="timestamp",
-        y="cpu_percent",
+        y=column,
         line_group="server_name",
         color="server_name",
     )
+    # A range ending now, such as the default one, slides as rows come in.
+    sliding = end <= now
+    if not sliding:
+        figure.update_xaxes(range=[start, end])
+    if end < now - timedelta(seconds=LIVE_REFRESH_SEC):
+        return figure, None
+
+    last = final_df.groupby("server_name")["timestamp"].max()
+    traces = [trace.name for trace in figure.data]
+    cursor = {
+        "server_names": server_names,
+        "kind": kind,
+        "column": column,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "sliding": sliding,
+        "traces": traces,
+        "last": [last[name].isoformat() for name in traces],
+    }
+    return figure, cursor
+
+
+def extend_metrics_figure(cursor):
+    """
+    Returns the 'extendData' property adding the rows newer than the last
+    ones of each trace of a figure built by 'metrics_figure()', or
+    dash.no_update if there are none, and the updated cursor. Returns None
+    instead when the figure needs to be built again because servers started
+    sending metrics.
+
+    When the time range of the figure slides, the rows that got out of it
+    are dropped from the figure.
+    """
+    now = datetime.now()
+    start = datetime.fromisoformat(cursor["start"])
+    end = datetime.fromisoformat(cursor["end"])
+    if cursor["sliding"]:
+        start, end = now - (end - start), now
+    elif now > end:
+        return dash.no_update, cursor
+    since = min(
+        (datetime.fromisoformat(last) for last in cursor["last"]),
+        default=start,
+    )
+    metrics_df = DATA.load(
+        cursor["server_names"], cursor["kind"], start=since, end=end
+    )
+    if not set(metrics_df["server_name"]) <= set(cursor["traces"]):
+        return None
+
+    column = cursor["column"]
+    groups = dict(list(metrics_df.groupby("server_name")))
+    xs, ys, last = [], [], []
+    for name, last_ts in zip(cursor["traces"], cursor["last"]):
+        rows = groups.get(name)
+        if rows is not None:
+            rows = rows[rows["timestamp"] > pd.Timestamp(last_ts)]
+        if rows is None or rows.empty:
+            xs.append([])
+            ys.append([])
+            last.append(last_ts)
+            continue
+        rows = rows.sort_values("timestamp")
+        xs.append([ts.isoformat() for ts in rows["timestamp"]])
+        ys.append(rows[column].tolist())
+        last.append(rows["timestamp"].iloc[-1].isoformat())
+    if not any(xs):
+        return dash.no_update, cursor
+
+    cursor = dict(cursor, last=last)
+    indices = list(range(len(cursor["traces"])))
+    if not cursor["sliding"]:
+        return [{"x": xs, "y": ys}, indices], cursor
+    cursor["start"], cursor["end"] = start.isoformat(), end.isoformat()
+    # Points of each trace within the range, the older ones being dropped.
+    counts = (
+        DATA.load(cursor["traces"], cursor["kind"], start=start, end=end)
+        .groupby("server_name")
+        .size()
+    )
+    max_points = [int(counts.get(name, 0)) for name in cursor["traces"]]
+    return [
+        {"x": xs, "y": ys},
+        indices,
+        {"x": max_points, "y": max_points},
+    ], cursor
+
+
+def metrics_graphs(
+    server_name, start_date, end_date, relayouts, triggered_id, cursors
+):
+    """
+    Returns the figures, 'extendData' properties and cursors of the metrics
+    graphs. Figures are only built again when the input they depend on
+    changed, the live interval only sending the rows that the browser does
+    not have yet.
+    """
+    previous = cursors
+    cursors = dict(cursors or {})
+    figures, extensions = [], []
+    for (graph_id, column), relayout_data in zip(METRICS_GRAPHS, relayouts):
+        cursor = cursors.get(graph_id)
+        figure = extension = dash.no_update
+        if triggered_id == "live-interval":
+            if cursor is not None:
+                extended = extend_metrics_figure(cursor)
+                if extended is None:
+                    start, end = requested_range(
+                        start_date, end_date, None, graph_id
+                    )
+                    figure, cursor = metrics_figure(
+                        server_name, column, start, end
+                    )
+                else:
+                    extension, cursor = extended
+        elif triggered_id not in cursors or triggered_id == graph_id:
+            # Zooming in a graph only updates this graph.
+            start, end = requested_range(
+                start_date, end_date, relayout_data, graph_id
+            )
+            figure, cursor = metrics_figure(server_name, column, start, end)
+        figures.append(figure)
+        extensions.append(extension)
+        cursors[graph_id] = cursor
+    if cursors == previous:
+        cursors = dash.no_update
+    return figures, extensions, cursors
 
 
 @dash.callback(
-    Output("memory-used-percent", "figure"),
-    Input("server-name-drop-down", "value"),
+    output=[
+        [Output(graph_id, "figure") for graph_id, _ in METRICS_GRAPHS],
+        [Output(graph_id, "extendData") for graph_id, _ in METRICS_GRAPHS],
+        Output("metrics-cursors", "data"),
+    ],
+    inputs=[
+        Input("server-name-drop-down", "value"),
+        Input("date-range", "start_date"),
+        Input("date-range", "end_date"),
+        [Input(graph_id, "relayoutData") for graph_id, _ in METRICS_GRAPHS],
+        Input("live-interval", "n_intervals"),
+    ],
+    state=[State("metrics-cursors", "data")],
 )
-def update_memory_used_percent(server_name):
-    if server_name == "*":
-        server_names = get_server_names_from_local()
-    else:
-        server_names = [server_name]
-
-    log_paths = []
-    for sname in server_names:
-        dir_name = os.path.join(DATA_DIR, sname)
-        log_paths.extend(
-            [
-                os.path.join(dir_name, path)
-                for path in os.listdir(dir_name)
-                if "metrics" in path
-            ]
-        )
-
-    dfs = []
-    for lpath in log_paths:
-        dfs.append(pd.read_csv(lpath))
-    concat_df = pd.concat(dfs)
-    concat_df["timestamp"] = pd.to_datetime(concat_df["timestamp"])
-
-    ts_cut_df = concat_df[
-        concat_df["timestamp"] >= datetime.now() - timedelta(days=1)
-    ]
+def update_metrics_graphs(
+    server_name, start_date, end_date, relayouts, n_intervals, cursors
+):
+    return metrics_graphs(
+        server_name,
+        start_date,
+        end_date,
+        relayouts,
+        dash.ctx.triggered_id,
+        cursors,
+    )
 
-    if server_name == "*":
-        final_df = ts_cut_df
-    else:
-        final_df = ts_cut_df[ts_cut_df["server_name"] == server_name]
 
-    final_df.sort_values(["server_name", "timestamp"], inplace=True)
+def graph_inputs(graph_id):
+    return [
+        Input("server-name-drop-down", "value"),
+        Input("date-range", "start_date"),
+        Input("date-range", "end_date"),
+        Input(graph_id, "relayoutData"),
+    ]
+
 
-    return px.line(
-        final_df,
-        x="timestamp",
-        y="memory_used_percent",
-        line_group="server_name",
-        color="server_name",
+def load_device_metrics(server_name, device_metric, start, end):
+    kind, metric = device_metric.split(":")
+    devices_df = DATA.load(
+        selected_server_names(server_name), "devices", start=start, end=end
     )
+    if devices_df.empty:
+        return devices_df.reindex(columns=["device", "value"])
+    return devices_df[
+        (devices_df["kind"] == kind) & (devices_df["metric"] == metric)
+    ]
 
 
 @dash.callback(
-    Output("disk-used-percent", "figure"),
+    Output("device-drop-down", "options"),
     Input("server-name-drop-down", "value"),
+    Input("date-range", "start_date"),
+    Input("date-range", "end_date"),
+    Input("device-metric-drop-down", "value"),
 )
-def update_disk_used_percent(server_name):
-    if server_name == "*":
-        server_names = get_server_names_from_local()
-    else:
-        server_names = [server_name]
-
-    log_paths = []
-    for sname in server_names:
-        dir_name = os.path.join(DATA_DIR, sname)
-        log_paths.extend(
-            [
-                os.path.join(dir_name, path)
-                for path in os.listdir(dir_name)
-                if "metrics" in path
-            ]
-        )
-
-    dfs = []
-    for lpath in log_paths:
-        dfs.append(pd.read_csv(lpath))
-    concat_df = pd.concat(dfs)
-    concat_df["timestamp"] = pd.to_datetime(concat_df["timestamp"])
-
-    ts_cut_df = concat_df[
-        concat_df["timestamp"] >= datetime.now() - timedelta(days=1)
-    ]
+def update_device_options(server_name, start_date, end_date, device_metric):
+    start, end = requested_range(start_date, end_date, None, None)
+    devices_df = load_device_metrics(server_name, device_metric, start, end)
+    return sorted(devices_df["device"].unique())
 
-    if server_name == "*":
-        final_df = ts_cut_df
-    else:
-        final_df = ts_cut_df[ts_cut_df["server_name"] == server_name]
 
-    final_df.sort_values(["server_name", "timestamp"], inplace=True)
+@dash.callback(
+    Output("device-metrics", "figure"),
+    *graph_inputs("device-metrics"),
+    Input("device-metric-drop-down", "value"),
+    Input("device-drop-down", "value"),
+)
+def update_device_metrics(
+    server_name, start_date, end_date, relayout_data, device_metric, devices
+):
+    start, end = requested_range(
+        start_date, end_date, relayout_data, "device-metrics"
+    )
+    devices_df = load_device_metrics(server_name, device_metric, start, end)
+    if devices:
+        devices_df = devices_df[devices_df["device"].isin(devices)]
+    final_df = dashboard_data.downsample(
+        devices_df.reindex(
+            columns=["server_name", "device", "timestamp", "value"]
+        ),
+        start,
+        end,
+        by=["server_name", "device"],
+    ).sort_values(["server_name", "device", "timestamp"])
+    final_df["series"] = final_df["server_name"] + " " + final_df["device"]
 
-    return px.line(
+    figure = px.line(
         final_df,
         x="timestamp",
-        y="disk_used_percent",
-        line_group="server_name",
-        color="server_name",
+        y="value",
+        line_group="series",
+        color="series",
     )
+    figure.update_xaxes(range=[start, end])
+    return figure
 
 
 def run_app(debug):
     app = dash.Dash()
-    app.layout = app_layout()
+    # Build the layout on each page load, so that new servers are listed.
+    app.layout = app_layout
     app.run(debug=debug)
 
 
 if __name__ == "__main__":
-    download_last_logs()
+    REFRESHER.refresh_all()
+    REFRESHER.start()
+    # In debug mode, the app is served by a child process started by the
+    # reloader, which is the one that must receive the rows.
+    if LIVE is not None and os.getenv("WERKZEUG_RUN_MAIN") == "true":
+        ingest.IngestServer(
+            LIVE, "0.0.0.0", int(INGEST_PORT), INGEST_TOKEN
+        ).start()
     run_app(debug=True)
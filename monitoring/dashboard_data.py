@@ -0,0 +1,750 @@
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from hds_monitoring import binary, fleet_index, ingest, models, rollup
+
+DATA_DIR = "dashboard_data"
+DATE_FORMAT = "%Y-%m-%d"
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+COMBINED_MAX_ENTRIES = 8
+LOG_FILE_REGEX = re.compile(
+    r"^(?P<kind>[a-z][a-z0-9-]*)_(?P<date>\d{4}-\d{2}-\d{2})\.(csv|bin)$"
+)
+
+# Streams holding metrics at decreasing resolutions, with the number of
+# seconds each row covers. Rows of rollup streams hold the min, max, mean and
+# 95th percentile of each metric, in columns suffixed with the statistic.
+METRICS_TIERS = [("metrics", 60)] + [
+    (f"metrics-{tier}", seconds) for tier, seconds in rollup.TIERS.items()
+]
+ROLLUP_KINDS = [kind for kind, _ in METRICS_TIERS[1:]]
+# Maximum number of points per series in a graph, of the order of the width
+# of a graph in pixels.
+MAX_POINTS = 1500
+# Longest time a row of the "services" logs tells the state of a unit for,
+# a few agent sampling intervals.
+SERVICE_MAX_GAP = timedelta(minutes=5)
+
+S3_DELIM = "/"
+REFRESH_INTERVAL_SEC = 60
+REFRESH_WORKERS = 8
+# Number of most recent days refreshed for each kind of log, so that the last
+# rows of the previous day are still fetched after the day rolled over.
+REFRESH_DAYS = 2
+# Bytes before the end of a local copy that are fetched again and compared,
+# to check that a re-uploaded object still starts with the local data.
+OVERLAP_BYTES = 4096
+# Agents upload the bytes appended to a log file as segment objects, which
+# hold the data found at 'offset' in the file.
+SEGMENT_KEY_REGEX = re.compile(r"^(?P<key>.+)\.(?P<offset>\d{12})\.part$")
+
+LOGGER = logging.getLogger(__name__)
+
+# 'offset' is where reading stopped: the end of the last complete row or
+# segment, None if the file could not be parsed. 'header' is the CSV header
+# line, needed to parse appended rows.
+CacheEntry = namedtuple(
+    "CacheEntry",
+    ["ino", "mtime_ns", "size", "offset", "header", "frame", "nbytes"],
+)
+
+
+def choose_metrics_tier(start, end, max_points=MAX_POINTS) -> str:
+    """
+    Returns the finest metrics stream that covers the time range from 'start'
+    to 'end' with at most 'max_points' rows per server.
+    """
+    seconds = (end - start).total_seconds()
+    for kind, step in METRICS_TIERS:
+        if seconds / step <= max_points:
+            return kind
+    return METRICS_TIERS[-1][0]
+
+
+def merge_rollup_buckets(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns rollup rows with a single row per server and bucket.
+
+    An agent that crashed, or that predates the rollup state, writes several
+    rows for the bucket it was in, each summarizing part of its samples. They
+    are merged into one: the mean is weighted by the samples of each row, and
+    the 95th percentile of the whole bucket being unknown, the highest one is
+    kept.
+    """
+    keys = ["server_name", "timestamp"]
+    if not frame.duplicated(keys).any():
+        return frame
+    aggregations = {"samples": "sum"}
+    weighted = {}
+    for name in models.ROLLUP_SOURCE_FIELDS:
+        aggregations.update(
+            {
+                f"{name}_min": "min",
+                f"{name}_max": "max",
+                f"{name}_mean": "sum",
+                f"{name}_p95": "max",
+            }
+        )
+        weighted[f"{name}_mean"] = frame[f"{name}_mean"] * frame["samples"]
+    merged = (
+        frame.assign(**weighted)
+        .groupby(keys, sort=False, as_index=False)
+        .agg(aggregations)
+    )
+    for column in weighted:
+        merged[column] /= merged["samples"]
+    return merged[frame.columns]
+
+
+def downsample(
+    df: pd.DataFrame,
+    start,
+    end,
+    by: List[str],
+    max_points=MAX_POINTS,
+) -> pd.DataFrame:
+    """
+    Returns the mean of the 'value' column of a long-format frame over time
+    buckets sized so that each group of the columns 'by' has at most about
+    'max_points' rows between 'start' and 'end'. Streams without rollups,
+    such as "devices", are plotted this way over long time ranges.
+    """
+    step = pd.Timedelta(end - start) / max_points
+    if df.empty or step <= pd.Timedelta(minutes=1):
+        return df
+    return (
+        df.groupby(
+            by + [pd.Grouper(key="timestamp", freq=step.ceil("min"))],
+            observed=True,
+        )["value"]
+        .mean()
+        .reset_index()
+    )
+
+
+def service_availability(
+    df: pd.DataFrame, start, end, max_gap=SERVICE_MAX_GAP
+) -> pd.DataFrame:
+    """
+    Returns, for each unit of each server of a "services" frame, indexed by
+    server and unit name: the latest row's 'timestamp', 'active' and
+    'active_state', the percentage of the time between 'start' and 'end'
+    that the unit was active, the number of times it became active or
+    inactive, and the time of its last transition. Units without rows
+    covering any time get a NaN availability, and rows without an
+    'active_state' get "active" or "failed" from 'active'.
+
+    A row gives the state of a unit until the next row of the unit, or until
+    'end', for at most 'max_gap': time not covered by rows, when the agent
+    was down, does not count. Rows are sorted and aggregated with numpy, by
+    integer codes of the units, so that a month of rows of hundreds of units
+    is processed in a few passes over arrays.
+    """
+    columns = [
+        "server_name",
+        "unit_name",
+        "timestamp",
+        "active",
+        "active_state",
+        "availability_percent",
+        "flaps",
+        "last_transition",
+    ]
+    df = df[(df["timestamp"] >= start) & (df["timestamp"] <= end)]
+    if df.empty:
+        return pd.DataFrame(columns=columns).set_index(
+            ["server_name", "unit_name"]
+        )
+
+    codes = df.groupby(["server_name", "unit_name"], sort=False).ngroup()
+    timestamps = df["timestamp"].to_numpy("datetime64[ns]")
+    order = np.lexsort((timestamps, codes.to_numpy()))
+    codes = codes.to_numpy()[order]
+    timestamps = timestamps[order]
+    active = df["active"].to_numpy(bool)[order]
+
+    # Index of the first row of each unit.
+    first = np.empty(len(codes), bool)
+    first[0] = True
+    first[1:] = codes[1:] != codes[:-1]
+    starts = np.flatnonzero(first)
+    lasts = np.append(starts[1:], len(codes)) - 1
+
+    following = np.empty_like(timestamps)
+    following[:-1] = timestamps[1:]
+    following[lasts] = np.datetime64(pd.Timestamp(end), "ns")
+    durations = np.clip(
+        following - timestamps,
+        np.timedelta64(0, "ns"),
+        pd.Timedelta(max_gap).to_timedelta64(),
+    ).view(np.int64)
+    changed = np.empty(len(codes), bool)
+    changed[0] = False
+    changed[1:] = active[1:] != active[:-1]
+    changed &= ~first
+
+    covered = np.add.reduceat(durations, starts)
+    uptime = np.add.reduceat(np.where(active, durations, 0), starts)
+    # NaT is the smallest int64, so units without transitions get NaT.
+    transitions = np.maximum.reduceat(
+        np.where(changed, timestamps.view(np.int64), np.iinfo(np.int64).min),
+        starts,
+    ).view("datetime64[ns]")
+
+    rows = df.iloc[order[lasts]]
+    # Logs written before 'active_state' was recorded only have 'active'.
+    fallback_states = np.where(active[lasts], "active", "failed")
+    if "active_state" in rows:
+        active_states = rows["active_state"].to_numpy(object)
+        missing = pd.isna(active_states)
+        active_states[missing] = fallback_states[missing]
+    else:
+        active_states = fallback_states
+    return pd.DataFrame(
+        {
+            "server_name": rows["server_name"].to_numpy(),
+            "unit_name": rows["unit_name"].to_numpy(),
+            "timestamp": timestamps[lasts],
+            "active": active[lasts],
+            "active_state": active_states,
+            "availability_percent": np.divide(
+                100 * uptime,
+                covered,
+                out=np.full(len(starts), np.nan),
+                where=covered > 0,
+            ),
+            "flaps": np.add.reduceat(changed.astype(np.int64), starts),
+            "last_transition": transitions,
+        }
+    ).set_index(["server_name", "unit_name"])
+
+
+def parse_timestamps(df: pd.DataFrame) -> pd.DataFrame:
+    for name in df.columns:
+        if name == "timestamp" or name.endswith("_at"):
+            df[name] = pd.to_datetime(df[name], format="ISO8601")
+    return df
+
+
+def frame_from_columns(schema: list, columns: dict) -> pd.DataFrame:
+    df = pd.DataFrame(columns)
+    for name, code in schema:
+        if code == "t":
+            df[name] = pd.to_datetime(df[name].where(df[name] != 0), unit="ms")
+    return df
+
+
+class LogCache:
+    """
+    Data access layer of the dashboard.
+
+    Log files are parsed once and the resulting data frames are kept in memory,
+    keyed by path and invalidated by changes of modification time or size.
+    When a file grew in place, only the rows appended since it was last read
+    are parsed. Least recently used frames are evicted once the cache holds
+    more than 'max_bytes'.
+
+    The frames of several servers are concatenated by 'load()', which also
+    caches its result, so that all callbacks triggered by the same input
+    share the same data. Only the daily files whose date overlaps the
+    requested time range are read, and when a 'fetcher' such as an
+    S3Refresher is given, the files missing locally are fetched first.
+
+    When a 'live' store is given (see 'hds_monitoring.ingest'), the rows
+    pushed by agents that are not in the log files yet are added to the
+    metrics and service statuses returned by 'load()'.
+    """
+
+    def __init__(
+        self,
+        data_dir: str = DATA_DIR,
+        max_bytes=CACHE_MAX_BYTES,
+        fetcher=None,
+        live=None,
+    ):
+        self.data_dir = data_dir
+        self.fetcher = fetcher
+        self.live = live
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.listings = {}
+        self.combined = OrderedDict()
+        self.lock = threading.RLock()
+
+    def list_files(
+        self,
+        server_name: str,
+        kind: str,
+        start_date: str = "",
+        end_date: str = "9999",
+    ) -> List[str]:
+        """
+        Returns the paths of the log files of a kind, such as "metrics" or
+        "services", of a server, oldest first. Dates are formatted as
+        YYYY-MM-DD and bounds are inclusive.
+        """
+        dir_name = os.path.join(self.data_dir, server_name)
+        try:
+            mtime_ns = os.stat(dir_name).st_mtime_ns
+        except FileNotFoundError:
+            # Servers only known from the rows they pushed.
+            return []
+        listing = self.listings.get(dir_name)
+        if listing is None or listing[0] != mtime_ns:
+            files = sorted(
+                (match["kind"], match["date"], name)
+                for name in os.listdir(dir_name)
+                if (match := LOG_FILE_REGEX.match(name)) is not None
+            )
+            listing = (mtime_ns, files)
+            self.listings[dir_name] = listing
+        return [
+            os.path.join(dir_name, name)
+            for file_kind, date, name in listing[1]
+            if file_kind == kind and start_date <= date <= end_date
+        ]
+
+    def read(self, path: str, entry: CacheEntry, stat) -> CacheEntry:
+        grew = (
+            entry is not None
+            and entry.offset is not None
+            and entry.ino == stat.st_ino
+            and stat.st_size > entry.size
+        )
+        if path.endswith(binary.FILE_EXT):
+            schema, columns, offset = binary.read_columns(
+                path, entry.offset if grew else None
+            )
+            frame = frame_from_columns(schema, columns)
+            header = None
+        else:
+            with open(path, "rb") as fi:
+                if grew:
+                    fi.seek(entry.offset)
+                data = fi.read(stat.st_size - (entry.offset if grew else 0))
+            if grew:
+                header = entry.header
+                offset = entry.offset
+            else:
+                header = data[: data.find(b"\n") + 1]
+                data = data[len(header) :]
+                offset = len(header)
+            end = data.rfind(b"\n") + 1
+            offset += end
+            frame = (
+                parse_timestamps(pd.read_csv(io.BytesIO(header + data[:end])))
+                if header
+                else pd.DataFrame()
+            )
+        if grew:
+            frame = pd.concat([entry.frame, frame], ignore_index=True)
+        return CacheEntry(
+            stat.st_ino,
+            stat.st_mtime_ns,
+            stat.st_size,
+            offset,
+            header,
+            frame,
+            int(frame.memory_usage(deep=True).sum()),
+        )
+
+    def entry(self, path: str) -> CacheEntry:
+        with self.lock:
+            stat = os.stat(path)
+            entry = self.entries.get(path)
+            if entry is None or (entry.ino, entry.mtime_ns, entry.size) != (
+                stat.st_ino,
+                stat.st_mtime_ns,
+                stat.st_size,
+            ):
+                try:
+                    new_entry = self.read(path, entry, stat)
+                except (ValueError, EOFError) as exc:
+                    # Skipped until the file changes, so that one corrupted
+                    # file does not break every callback.
+                    LOGGER.error(f"Skipping log file '{path}': {exc}")
+                    new_entry = CacheEntry(
+                        stat.st_ino,
+                        stat.st_mtime_ns,
+                        stat.st_size,
+                        None,
+                        None,
+                        pd.DataFrame(),
+                        0,
+                    )
+                self.nbytes += new_entry.nbytes - (
+                    entry.nbytes if entry else 0
+                )
+                self.entries[path] = entry = new_entry
+                self.evict()
+            self.entries.move_to_end(path)
+            return entry
+
+    def frame(self, path: str) -> pd.DataFrame:
+        return self.entry(path).frame
+
+    def evict(self) -> None:
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            self.nbytes -= entry.nbytes
+
+    def load(
+        self,
+        server_names: List[str],
+        kind: str,
+        start: datetime = None,
+        end: datetime = None,
+    ) -> pd.DataFrame:
+        """
+        Returns the concatenated log files of a kind of several servers.
+
+        When 'start' and 'end' are given, only the rows timestamped between
+        them are returned.
+        """
+        dates = ("", "9999")
+        if start is not None and end is not None:
+            dates = (start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT))
+            if self.fetcher is not None:
+                self.fetcher.fetch_partitions(server_names, kind, *dates)
+
+        with self.lock:
+            paths = [
+                path
+                for server_name in server_names
+                for path in self.list_files(server_name, kind, *dates)
+            ]
+            entries = [self.entry(path) for path in paths]
+            key = (kind, tuple(server_names), dates)
+            version = tuple(
+                (path, entry.mtime_ns, entry.size)
+                for path, entry in zip(paths, entries)
+            )
+            cached = self.combined.get(key)
+            if cached is None or cached[0] != version:
+                frames = [
+                    entry.frame
+                    for entry in entries
+                    if entry.offset is not None
+                ]
+                combined = (
+                    pd.concat(frames, ignore_index=True)
+                    if frames
+                    else pd.DataFrame(columns=["server_name", "timestamp"])
+                )
+                if kind in ROLLUP_KINDS:
+                    combined = merge_rollup_buckets(combined)
+                cached = (version, combined)
+                self.combined[key] = cached
+                if len(self.combined) > COMBINED_MAX_ENTRIES:
+                    self.combined.popitem(last=False)
+            self.combined.move_to_end(key)
+            combined = cached[1]
+
+        if self.live is not None and kind in ingest.STREAMS:
+            combined = self.merge_live(combined, server_names, kind, start)
+        if start is not None and end is not None:
+            combined = combined[
+                (combined["timestamp"] >= start)
+                & (combined["timestamp"] <= end)
+            ]
+        return combined
+
+    def merge_live(
+        self,
+        combined: pd.DataFrame,
+        server_names: List[str],
+        kind: str,
+        start: datetime = None,
+    ) -> pd.DataFrame:
+        """
+        Returns 'combined' with the rows of the live store timestamped at or
+        after 'start' that it does not hold yet.
+        """
+        start_ms = (
+            0
+            if start is None
+            else (start - binary.EPOCH) // binary.MILLISECOND
+        )
+        columns = self.live.columns(server_names, kind, start_ms)
+        if not columns["timestamp"]:
+            return combined
+        live = frame_from_columns(binary.schema(ingest.STREAMS[kind]), columns)
+        if combined.empty:
+            return live
+        keys = ["server_name", "timestamp"]
+        if kind == "services":
+            keys.append("unit_name")
+        # Rows that were also synced from S3 are kept once, from the files.
+        # The rows left are the most recent ones, so the rows of each server
+        # stay in time order.
+        return pd.concat([combined, live], ignore_index=True).drop_duplicates(
+            keys, keep="first"
+        )
+
+
+class S3Refresher:
+    """
+    Keeps local copies of the latest logs of every server up to date.
+
+    Servers and their logs are found in the fleet index and in the manifests
+    of servers published by the agents (see 'hds_monitoring.fleet_index'),
+    objects being listed only for buckets without an index. Every 'interval'
+    seconds, the fleet index is read, and the servers whose latest logs grew
+    are refreshed: only the bytes that are not available locally yet are
+    downloaded, segment objects past the end of the local copy, and the tail
+    of log objects that were uploaded again since they were last seen,
+    fetched with ranged GET requests. Objects are only downloaded whole when
+    the local copy does not exist or does not match them anymore. Servers are
+    refreshed concurrently.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        data_dir: str = DATA_DIR,
+        interval=REFRESH_INTERVAL_SEC,
+        workers=REFRESH_WORKERS,
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.data_dir = data_dir
+        self.interval = interval
+        self.workers = workers
+        # ETag of the log object each local copy was last synced with.
+        self.etags = {}
+        # Cached listings of the log objects of a kind of a server.
+        self.listings = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def paginate(self, **kwargs):
+        paginator = self.client.get_paginator("list_objects_v2")
+        return paginator.paginate(Bucket=self.bucket, **kwargs)
+
+    def get(self, key: str, start: int = 0) -> bytes:
+        kwargs = {"Range": f"bytes={start}-"} if start else {}
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=key, **kwargs
+        )
+        return response["Body"].read()
+
+    def get_json(self, key: str):
+        """
+        Returns the decoded JSON object stored at 'key', or None if there is
+        no such object.
+        """
+        try:
+            return json.loads(self.get(key))
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def fleet_index(self):
+        return self.get_json(fleet_index.FLEET_INDEX_KEY)
+
+    def server_names(self, index=None) -> List[str]:
+        if index is None:
+            index = self.fleet_index()
+        if index is not None:
+            return sorted(index)
+        # Index objects are stored under a prefix starting with an
+        # underscore, which is not a server.
+        return sorted(
+            item["Prefix"].rstrip(S3_DELIM)
+            for page in self.paginate(Delimiter=S3_DELIM)
+            for item in page.get("CommonPrefixes", [])
+            if not item["Prefix"].startswith("_")
+        )
+
+    def append_range(self, key: str, path: str, size: int) -> bool:
+        """
+        Appends to a local copy of 'size' bytes the bytes of an object found
+        past this size. Returns False, without writing anything, if the
+        object does not end with the same bytes as the local copy.
+        """
+        start = max(size - OVERLAP_BYTES, 0)
+        data = self.get(key, start)
+        with open(path, "r+b") as fo:
+            fo.seek(start)
+            if data[: size - start] != fo.read(size - start):
+                return False
+            fo.write(data[size - start :])
+        return True
+
+    def refresh_object(self, obj: dict, segments: List[tuple]) -> None:
+        key = obj["Key"]
+        path = os.path.join(self.data_dir, key)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if self.etags.get(path) != obj["ETag"]:
+            if (
+                size == 0
+                or obj["Size"] < size
+                or not self.append_range(key, path, size)
+            ):
+                LOGGER.info(f"Downloading s3://{self.bucket}/{key}")
+                self.client.download_file(
+                    Bucket=self.bucket, Key=key, Filename=path
+                )
+            self.etags[path] = obj["ETag"]
+            size = os.path.getsize(path)
+
+        for offset, segment in segments:
+            if offset + segment["Size"] <= size:
+                continue
+            if offset > size:
+                # A previous segment is not visible yet, wait for it rather
+                # than leaving a hole in the file.
+                break
+            data = self.get(segment["Key"], size - offset)
+            with open(path, "r+b") as fo:
+                fo.seek(size)
+                fo.write(data)
+            size += len(data)
+
+    def list_logs(self, server_name: str, kind: str = "") -> tuple:
+        """
+        Lists the log objects of a server, or only those of a kind, from the
+        manifest of the server, or by listing objects if it has none.
+
+        Returns a dictionary mapping kinds to dictionaries mapping dates to
+        log objects, and a dictionary mapping log keys to lists of (offset,
+        segment object) tuples. Objects are described like in listings, with
+        their version for ETag when they come from a manifest.
+        """
+        logs = defaultdict(dict)
+        segments = defaultdict(list)
+        manifest = self.get_json(fleet_index.server_manifest_key(server_name))
+        if manifest is not None:
+            for key, log in manifest["logs"].items():
+                match = LOG_FILE_REGEX.match(key[len(server_name) + 1 :])
+                if match is None or (kind and match["kind"] != kind):
+                    continue
+                logs[match["kind"]][match["date"]] = {
+                    "Key": key,
+                    "Size": log["size"],
+                    "ETag": log["version"],
+                }
+                segments[key] = [
+                    (offset, {"Key": seg_key, "Size": size})
+                    for seg_key, offset, size in log["segments"]
+                ]
+            return logs, segments
+
+        prefix = f"{server_name}{S3_DELIM}{kind + '_' if kind else ''}"
+        for page in self.paginate(Prefix=prefix):
+            for obj in page.get("Contents", []):
+                name = obj["Key"][len(server_name) + 1 :]
+                if (match := SEGMENT_KEY_REGEX.match(obj["Key"])) is not None:
+                    segments[match["key"]].append((int(match["offset"]), obj))
+                elif (match := LOG_FILE_REGEX.match(name)) is not None:
+                    logs[match["kind"]][match["date"]] = obj
+        for key in segments:
+            segments[key].sort()
+        return logs, segments
+
+    def refresh_server(self, server_name: str) -> None:
+        logs, segments = self.list_logs(server_name)
+        os.makedirs(os.path.join(self.data_dir, server_name), exist_ok=True)
+        for by_date in logs.values():
+            for date in sorted(by_date)[-REFRESH_DAYS:]:
+                obj = by_date[date]
+                self.refresh_object(obj, segments[obj["Key"]])
+
+    def fetch_server_partitions(
+        self, server_name: str, kind: str, start_date: str, end_date: str
+    ) -> None:
+        key = (server_name, kind)
+        listed_at, logs, segments = self.listings.get(key, (None, None, None))
+        if listed_at is None or time.monotonic() - listed_at > self.interval:
+            logs, segments = self.list_logs(server_name, kind)
+            self.listings[key] = (time.monotonic(), logs, segments)
+        os.makedirs(os.path.join(self.data_dir, server_name), exist_ok=True)
+        for date, obj in logs[kind].items():
+            path = os.path.join(self.data_dir, obj["Key"])
+            if start_date <= date <= end_date and not os.path.exists(path):
+                self.refresh_object(obj, segments[obj["Key"]])
+
+    def fetch_partitions(
+        self,
+        server_names: List[str],
+        kind: str,
+        start_date: str,
+        end_date: str,
+    ) -> None:
+        """
+        Downloads the log files of a kind of several servers whose date is
+        between 'start_date' and 'end_date', and that are missing locally.
+        Listings are cached for 'interval' seconds, and files already present
+        are left to the periodic refresh.
+        """
+
+        def fetch(server_name):
+            try:
+                self.fetch_server_partitions(
+                    server_name, kind, start_date, end_date
+                )
+            except Exception:
+                LOGGER.exception(f"Failed to fetch logs of '{server_name}'")
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            list(pool.map(fetch, server_names))
+
+    def is_up_to_date(self, entry: dict) -> bool:
+        """
+        Returns True if the local copies of the latest logs listed in the
+        fleet index entry of a server have their full size.
+        """
+        for latest in entry["latest"].values():
+            path = os.path.join(self.data_dir, latest["key"])
+            if not os.path.exists(path):
+                return False
+            if os.path.getsize(path) != latest["size"]:
+                return False
+        return True
+
+    def refresh_all(self) -> None:
+        def refresh(server_name):
+            try:
+                self.refresh_server(server_name)
+            except Exception:
+                LOGGER.exception(f"Failed to refresh logs of '{server_name}'")
+
+        index = self.fleet_index()
+        server_names = self.server_names(index)
+        if index is not None:
+            server_names = [
+                name
+                for name in server_names
+                if not self.is_up_to_date(index[name])
+            ]
+        with ThreadPoolExecutor(self.workers) as pool:
+            list(pool.map(refresh, server_names))
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.refresh_all()
+            except Exception:
+                LOGGER.exception("Failed to refresh logs")
+
+    def start(self) -> None:
+        self.thread = threading.Thread(
+            target=self.run, name="s3-refresher", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
@@ -0,0 +1,372 @@
+import abc
+import json
+import os
+import shlex
+import subprocess
+import time
+import urllib.request
+
+from hds_monitoring import log, models
+
+LOGGER = log.get_logger(__name__)
+
+FIRING = "firing"
+RESOLVED = "resolved"
+SINK_TIMEOUT_SEC = 10
+
+
+class Rule(abc.ABC):
+    """
+    Base class of alert rules.
+
+    A rule changes state, firing or resolved, after 'samples' consecutive
+    rows agree on the new state. While it is firing, the alert is sent again
+    every 'repeat_sec' seconds, if not 0. 'sinks' are the names of the sinks
+    its alerts are sent to, all sinks if empty.
+    """
+
+    def __init__(self, name, samples=1, repeat_sec=0, sinks=()):
+        self.name = name
+        self.samples = samples
+        self.repeat_sec = repeat_sec
+        self.sinks = sinks
+
+    @abc.abstractmethod
+    def breached(self, value, firing):
+        """
+        Return True if 'value' is in the alerting state, 'firing' telling
+        the current state of the rule.
+        """
+
+    @abc.abstractmethod
+    def message(self, key, value, status):
+        """
+        Return the text of an alert of 'status' for 'key' and 'value'.
+        """
+
+
+class ThresholdRule(Rule):
+    """
+    Fires when a field of Metrics rows is above 'above', or below 'below'.
+
+    Once firing, the rule resolves when the field gets back past 'clear',
+    which defaults to the threshold, so that a value oscillating around the
+    threshold does not fire again and again.
+    """
+
+    def __init__(
+        self, name, field, above=None, below=None, clear=None, **kwargs
+    ):
+        if (above is None) == (below is None):
+            raise ValueError(
+                f"Alert rule '{name}' needs one of 'above' and 'below'"
+            )
+        super().__init__(name, **kwargs)
+        self.field = field
+        self.above = above
+        self.below = below
+        self.threshold = above if above is not None else below
+        self.clear = clear if clear is not None else self.threshold
+
+    def breached(self, value, firing):
+        limit = self.clear if firing else self.threshold
+        if self.above is not None:
+            return value > limit
+        return value < limit
+
+    def message(self, key, value, status):
+        if status == RESOLVED:
+            return f"{self.field} is back to {value:g}"
+        side = "above" if self.above is not None else "below"
+        return f"{self.field} is {value:g}, {side} {self.threshold:g}"
+
+
+class StateRule(Rule):
+    """
+    Fires when systemd units named 'unit', or all units if it is '*', are in
+    one of the active states 'states'.
+    """
+
+    def __init__(self, name, unit, states, **kwargs):
+        super().__init__(name, **kwargs)
+        self.unit = unit
+        self.states = frozenset(states)
+
+    def breached(self, value, firing):
+        return value in self.states
+
+    def message(self, key, value, status):
+        return f"unit '{key}' is {value}"
+
+
+def make_rule(settings):
+    """
+    Return the rule described by the settings of an alert section of the
+    configuration.
+    """
+    kwargs = {
+        "samples": settings["samples"],
+        "repeat_sec": settings["repeat_minutes"] * 60,
+        "sinks": settings["sinks"],
+    }
+    if settings["field"] is not None:
+        if settings["field"] not in models.METRICS_FIELD_NAMES:
+            raise ValueError(
+                f"Alert rule '{settings['name']}' checks unknown field "
+                f"'{settings['field']}'"
+            )
+        return ThresholdRule(
+            settings["name"],
+            settings["field"],
+            settings["above"],
+            settings["below"],
+            settings["clear"],
+            **kwargs,
+        )
+    if settings["unit"] is not None:
+        return StateRule(
+            settings["name"], settings["unit"], settings["states"], **kwargs
+        )
+    raise ValueError(
+        f"Alert rule '{settings['name']}' needs a 'field' or a 'unit'"
+    )
+
+
+class AlertState:
+    """
+    State of a rule for a key: the Metrics field or the systemd unit it is
+    checked against.
+    """
+
+    __slots__ = ("firing", "streak", "notified_at")
+
+    def __init__(self, firing=False, streak=0, notified_at=0.0):
+        self.firing = firing
+        # Consecutive rows that disagree with 'firing'.
+        self.streak = streak
+        self.notified_at = notified_at
+
+
+class AlertEngine:
+    """
+    Checks alert rules against each row as it is produced, and returns the
+    alerts to send. At most 'max_per_minute' alerts are sent per minute,
+    others being dropped and counted.
+
+    Each rule only keeps its current state, so checking a row costs the same
+    however many rows were checked before.
+    """
+
+    def __init__(self, rules, max_per_minute, clock=time.time):
+        self.metric_rules = []
+        self.unit_rules = []
+        for rule in rules:
+            if isinstance(rule, ThresholdRule):
+                self.metric_rules.append(rule)
+            else:
+                self.unit_rules.append(rule)
+        self.max_per_minute = max_per_minute
+        self.clock = clock
+        self.states = {}
+        # Token bucket limiting the rate of alerts.
+        self.tokens = float(max_per_minute)
+        self.refilled_at = clock()
+        self.fired = 0
+        self.dropped = 0
+
+    def allow(self, now):
+        self.tokens = min(
+            self.max_per_minute,
+            self.tokens + (now - self.refilled_at) * self.max_per_minute / 60,
+        )
+        self.refilled_at = now
+        if self.tokens < 1:
+            self.dropped += 1
+            return False
+        self.tokens -= 1
+        return True
+
+    def check(self, rule, key, value, row, now):
+        state_key = (rule.name, key)
+        state = self.states.get(state_key)
+        if state is None:
+            state = self.states[state_key] = AlertState()
+
+        if rule.breached(value, state.firing) != state.firing:
+            state.streak += 1
+            if state.streak < rule.samples:
+                return None
+            state.firing = not state.firing
+            state.streak = 0
+        else:
+            state.streak = 0
+            if not (
+                state.firing
+                and rule.repeat_sec
+                and now - state.notified_at >= rule.repeat_sec
+            ):
+                return None
+
+        if not self.allow(now):
+            LOGGER.warning(f"Alert rate exceeded, dropped '{rule.name}'")
+            return None
+        state.notified_at = now
+        self.fired += 1
+        status = FIRING if state.firing else RESOLVED
+        return {
+            "rule": rule.name,
+            "key": key,
+            "status": status,
+            "value": value,
+            "server_name": row.server_name,
+            "timestamp": row.timestamp.isoformat(),
+            "message": (
+                f"[{status}] {row.server_name} {rule.name}: "
+                f"{rule.message(key, value, status)}"
+            ),
+            "sinks": list(rule.sinks),
+        }
+
+    def check_metrics(self, row):
+        now = self.clock()
+        alerts = []
+        for rule in self.metric_rules:
+            alert = self.check(
+                rule, rule.field, getattr(row, rule.field), row, now
+            )
+            if alert is not None:
+                alerts.append(alert)
+        return alerts
+
+    def check_units(self, rows):
+        now = self.clock()
+        alerts = []
+        for row in rows:
+            for rule in self.unit_rules:
+                if rule.unit not in ("*", row.unit_name):
+                    continue
+                alert = self.check(
+                    rule, row.unit_name, row.active_state, row, now
+                )
+                if alert is not None:
+                    alerts.append(alert)
+        return alerts
+
+    def save(self, path):
+        """
+        Write the state of the rules and of the rate limit to 'path', so that
+        agents collecting one sample per run keep them between runs.
+        """
+        data = {
+            "states": [
+                [name, key, state.firing, state.streak, state.notified_at]
+                for (name, key), state in self.states.items()
+            ],
+            "tokens": self.tokens,
+            "refilled_at": self.refilled_at,
+        }
+        tmp_path = f"{path}.tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w") as fo:
+            json.dump(data, fo)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        try:
+            with open(path) as fi:
+                data = json.load(fi)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            LOGGER.warning(f"Ignoring corrupted alert state '{path}'")
+            return
+        self.states = {
+            (name, key): AlertState(firing, streak, notified_at)
+            for name, key, firing, streak, notified_at in data["states"]
+        }
+        self.tokens = data["tokens"]
+        self.refilled_at = data["refilled_at"]
+
+
+class WebhookSink:
+    """
+    Posts alerts as JSON to a URL.
+    """
+
+    def __init__(self, url):
+        self.url = url
+
+    def send(self, alert):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(alert).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=SINK_TIMEOUT_SEC):
+            pass
+
+
+class FileSink:
+    """
+    Appends alerts to a file, one JSON object per line.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, alert):
+        with open(self.path, "a") as fo:
+            fo.write(json.dumps(alert) + "\n")
+
+
+class CommandSink:
+    """
+    Runs a command for each alert, with the alert as JSON on its standard
+    input and its message in the environment variable ALERT_MESSAGE.
+    """
+
+    def __init__(self, command):
+        self.args = shlex.split(command)
+
+    def send(self, alert):
+        subprocess.run(
+            self.args,
+            input=json.dumps(alert),
+            text=True,
+            env=dict(os.environ, ALERT_MESSAGE=alert["message"]),
+            timeout=SINK_TIMEOUT_SEC,
+            check=True,
+        )
+
+
+def make_sinks(webhook_url=None, file_path=None, command=None):
+    """
+    Return a dictionary mapping the names of the configured sinks to sinks.
+    """
+    sinks = {}
+    if webhook_url:
+        sinks["webhook"] = WebhookSink(webhook_url)
+    if file_path:
+        sinks["file"] = FileSink(file_path)
+    if command:
+        sinks["command"] = CommandSink(command)
+    return sinks
+
+
+def send(alerts, sinks):
+    """
+    Send alerts to their sinks. A sink failing does not prevent the others
+    from being tried.
+    """
+    for alert in alerts:
+        LOGGER.info(alert["message"])
+        for name in alert["sinks"] or sinks:
+            sink = sinks.get(name)
+            if sink is None:
+                LOGGER.warning(f"Unknown alert sink '{name}'")
+                continue
+            try:
+                sink.send(alert)
+            except Exception as exc:
+                LOGGER.error(f"Failed to send alert to '{name}': {exc}")
@@ -1,35 +1,345 @@
+import hashlib
+import json
 import os
-from datetime import datetime, timedelta
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
+from hds_monitoring import fleet_index, instrumentation, log
+from hds_monitoring.config import config
+from hds_monitoring.manifest import load_manifest, save_manifest
 
-from hds_monitoring import log
-
-S3 = boto3.client("s3")
 LOGGER = log.get_logger(__name__)
 
+UPLOAD_ATTEMPTS = 5
+BACKOFF_BASE_SEC = 1
+BACKOFF_MAX_SEC = 60
+
+# boto3 takes a large share of the start-up time and memory of the agent, it
+# is only imported when the first S3 request is made.
+S3 = None
+TRANSFER_CONFIG = None
+
+
+def get_client():
+    global S3, TRANSFER_CONFIG
+    if S3 is None:
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        S3 = boto3.client(
+            "s3",
+            endpoint_url=config["s3_endpoint_url"],
+            config=Config(
+                retries={"max_attempts": 3, "mode": "standard"},
+                max_pool_connections=config["upload_workers"] * 2,
+                connect_timeout=10,
+                read_timeout=30,
+            ),
+        )
+        # Log files are small, uploading them in a single request is faster
+        # than multipart uploads, and concurrency comes from the Uploader
+        # threads.
+        TRANSFER_CONFIG = TransferConfig(
+            multipart_threshold=64 * 1024 * 1024,
+            max_concurrency=2,
+        )
+    return S3
+
+
+READ_CHUNK_SIZE = 1024 * 1024
+# Once a file has that many segments, it is uploaded whole again, which bounds
+# the number of objects readers have to fetch.
+MAX_SEGMENTS = 48
+
+
+def segment_key(key, offset):
+    """
+    Return the S3 key of a segment object holding the bytes appended to the
+    object 'key', starting at byte 'offset' of the file.
+    """
+    return f"{key}.{offset:012d}.part"
+
+
+def iter_chunks(fi, size):
+    while size > 0 and (chunk := fi.read(min(READ_CHUNK_SIZE, size))):
+        size -= len(chunk)
+        yield chunk
+
+
+def read_file(path, size, prefix_size):
+    """
+    Read the first 'size' bytes of a file in a single pass.
+
+    Return the SHA-256 digest of the first 'prefix_size' bytes, the digest of
+    the first 'size' bytes and these bytes.
+    """
+    digest = hashlib.sha256()
+    chunks = []
+    with open(path, "rb") as fi:
+        for chunk in iter_chunks(fi, prefix_size):
+            digest.update(chunk)
+            chunks.append(chunk)
+        prefix_digest = digest.hexdigest()
+        for chunk in iter_chunks(fi, size - prefix_size):
+            digest.update(chunk)
+            chunks.append(chunk)
+    return prefix_digest, digest.hexdigest(), b"".join(chunks)
+
+
+def sync_file(path, bucket, key, entry, spool):
+    """
+    Spool the uploads needed to ship the changes made to a file since it was
+    described by the manifest entry 'entry', and return the new entry.
+
+    Files that did not change are skipped. When the file only grew, the new
+    bytes are uploaded as a segment object (see 'segment_key()'). Otherwise,
+    or when the file already has MAX_SEGMENTS segments, the whole file is
+    uploaded, replacing uploads of the file still in the spool, and the
+    segments of the previous version are deleted.
+    """
+    stat = os.stat(path)
+    size, mtime = stat.st_size, stat.st_mtime_ns
+    if entry is not None and (entry["size"], entry["mtime"]) == (size, mtime):
+        return entry
+
+    prefix_size = entry["size"] if entry and size > entry["size"] else 0
+    prefix_digest, digest, data = read_file(path, size, prefix_size)
 
-def modified_last_two_days(path: str) -> bool:
+    if (
+        prefix_size
+        and prefix_digest == entry["sha256"]
+        and len(entry["segments"]) < MAX_SEGMENTS
+    ):
+        seg_key = segment_key(key, prefix_size)
+        LOGGER.debug(
+            f"Spooling {size - prefix_size} bytes of '{path}' as '{seg_key}'"
+        )
+        spool.put(bucket, seg_key, data[prefix_size:], file_key=key)
+        segments = entry["segments"] + [seg_key]
+        base_digest = entry.get("base_sha256", entry["sha256"])
+    else:
+        LOGGER.debug(f"Spooling '{path}' as '{key}'")
+        spool.discard_puts(key)
+        spool.put(bucket, key, data, file_key=key)
+        if entry and entry["segments"]:
+            spool.delete(bucket, entry["segments"], file_key=key)
+        segments = []
+        base_digest = digest
+
+    return {
+        "size": size,
+        "mtime": mtime,
+        "sha256": digest,
+        "base_sha256": base_digest,
+        "segments": segments,
+    }
+
+
+def retry(func, attempts=UPLOAD_ATTEMPTS):
+    """
+    Call 'func' until it succeeds, at most 'attempts' times, waiting between
+    attempts with exponential backoff and full jitter.
+    """
+    for attempt in range(attempts):
+        try:
+            return func()
+        except Exception as exc:
+            if attempt == attempts - 1:
+                raise
+            delay = random.uniform(
+                0, min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2**attempt)
+            )
+            LOGGER.warning(f"{exc}, retrying in {delay:.1f} s")
+            time.sleep(delay)
+
+
+class Uploader:
+    """
+    Applies the operations stored in a spool to S3 with a pool of threads.
+
+    Operations on the same file are applied in order by a single thread,
+    different files are uploaded concurrently. An operation is removed from
+    the spool once it succeeded, failed ones stay in the spool and are
+    retried by the next call to 'drain()', after the other operations of the
+    same file.
+    """
+
+    def __init__(self, spool, client=None, workers=None):
+        self.spool = spool
+        self.client = client
+        self.workers = workers or config["upload_workers"]
+        self.lock = threading.Lock()
+        self.bytes_uploaded = 0
+        self.upload_sec = 0.0
+        self.failures = 0
+
+    def get_client(self):
+        if self.client is None:
+            self.client = get_client()
+        return self.client
+
+    def execute(self, entry):
+        if entry["op"] == "put":
+            path = self.spool.data_path(entry)
+            size = os.path.getsize(path)
+            start = time.monotonic()
+            self.client.upload_file(
+                path, entry["bucket"], entry["key"], Config=TRANSFER_CONFIG
+            )
+            elapsed = time.monotonic() - start
+            instrumentation.observe("s3_put", elapsed)
+            with self.lock:
+                self.bytes_uploaded += size
+                self.upload_sec += elapsed
+        else:
+            with instrumentation.timed("s3_delete"):
+                self.client.delete_objects(
+                    Bucket=entry["bucket"],
+                    Delete={
+                        "Objects": [{"Key": key} for key in entry["keys"]]
+                    },
+                )
+
+    def apply_in_order(self, entries):
+        for entry in entries:
+            try:
+                retry(lambda: self.execute(entry))
+            except Exception:
+                LOGGER.exception(
+                    f"Failed to apply spooled {entry['op']} of "
+                    f"'{entry['file_key']}', will retry later"
+                )
+                with self.lock:
+                    self.failures += 1
+                return
+            self.spool.remove(entry)
+
+    def drain(self):
+        by_file = defaultdict(list)
+        for entry in self.spool.pending():
+            by_file[entry["file_key"]].append(entry)
+        if not by_file:
+            return
+        self.get_client()
+        with ThreadPoolExecutor(self.workers) as pool:
+            list(pool.map(self.apply_in_order, by_file.values()))
+        stats = self.stats()
+        LOGGER.info(
+            f"Upload queue depth: {stats['queue_depth']}, uploaded "
+            f"{stats['bytes_uploaded']} bytes at "
+            f"{stats['throughput_bytes_per_sec']:.0f} bytes/s, "
+            f"{stats['failures']} failures"
+        )
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queue_depth": self.spool.depth(),
+                "bytes_uploaded": self.bytes_uploaded,
+                "upload_sec": self.upload_sec,
+                "throughput_bytes_per_sec": (
+                    self.bytes_uploaded / self.upload_sec
+                    if self.upload_sec > 0
+                    else 0.0
+                ),
+                "failures": self.failures,
+            }
+
+
+def publish_index(client, bucket, server_name, manifest):
     """
-    Return True if the file indicated by the provided path was modified in the
-    past 2 days, otherwise return False.
+    Upload the manifest of the logs of a server and update its entry in the
+    fleet index (see the 'fleet_index' module).
+
+    The manifest of the server is cumulative: it is read back and merged
+    with 'manifest', so that it keeps the logs removed from the data
+    directory since they were uploaded.
+
+    Agents update the fleet index concurrently, so it is replaced with a
+    conditional request, which fails if another agent replaced it since it
+    was read, in which case it is read and updated again.
     """
-    mtime = datetime.fromtimestamp(os.path.getmtime(path))
-    return mtime >= datetime.now() - timedelta(days=2)
+    manifest_key = fleet_index.server_manifest_key(server_name)
+    try:
+        response = client.get_object(Bucket=bucket, Key=manifest_key)
+    except client.exceptions.NoSuchKey:
+        previous = None
+    else:
+        previous = json.loads(response["Body"].read())
+    server_manifest = fleet_index.server_manifest(
+        server_name, manifest, time.time(), previous
+    )
+    client.put_object(
+        Bucket=bucket,
+        Key=manifest_key,
+        Body=json.dumps(server_manifest).encode(),
+        ContentType="application/json",
+    )
+    entry = fleet_index.fleet_entry(server_manifest)
+
+    def update():
+        try:
+            response = client.get_object(
+                Bucket=bucket, Key=fleet_index.FLEET_INDEX_KEY
+            )
+        except client.exceptions.NoSuchKey:
+            index = {}
+            condition = {"IfNoneMatch": "*"}
+        else:
+            index = json.loads(response["Body"].read())
+            condition = {"IfMatch": response["ETag"]}
+        index[server_name] = entry
+        client.put_object(
+            Bucket=bucket,
+            Key=fleet_index.FLEET_INDEX_KEY,
+            Body=json.dumps(index, sort_keys=True).encode(),
+            ContentType="application/json",
+            **condition,
+        )
 
+    retry(update)
 
-def copy_folder_to_s3(folder, bucket, key_prefix):
+
+def copy_folder_to_s3(folder, bucket, key_prefix, manifest_path, uploader):
     """
     Copies files stored in the path 'folder' to an S3 bucket.
 
     The path 'folder' must be an absolute path.
 
     If there are any sub-folders, they are ignored.
+
+    The manifest stored at 'manifest_path' records the size, modification time
+    and hash of what was shipped for each file, so that only new data is
+    uploaded. Entries of files that no longer exist are dropped.
+
+    New data is first written to the spool of 'uploader', then the uploader
+    drains the spool. Data that cannot be uploaded, for example while the
+    server is offline, stays in the spool until a later call succeeds. Once
+    the spool is empty, the manifest of the server and the fleet index are
+    updated, see 'publish_index()'.
     """
     key_prefix = key_prefix.rstrip("/")
+    manifest = load_manifest(manifest_path)
+    keys = set()
     for file_path in os.listdir(folder):
         full_path = os.path.join(folder, file_path)
-        if os.path.isfile(full_path) and modified_last_two_days(full_path):
-            key = f"{key_prefix}/{file_path}"
-            LOGGER.debug(f"Uploading '{full_path}' to 's3://{bucket}/{key}")
-            S3.upload_file(full_path, bucket, key)
+        if not os.path.isfile(full_path):
+            continue
+        key = f"{key_prefix}/{file_path}"
+        keys.add(key)
+        entry = manifest.get(key)
+        new_entry = sync_file(full_path, bucket, key, entry, uploader.spool)
+        if new_entry is not entry:
+            manifest[key] = new_entry
+            save_manifest(manifest_path, manifest)
+    for key in set(manifest) - keys:
+        del manifest[key]
+    save_manifest(manifest_path, manifest)
+    uploader.drain()
+    if uploader.spool.depth() == 0:
+        with instrumentation.timed("publish_index"):
+            publish_index(uploader.get_client(), bucket, key_prefix, manifest)
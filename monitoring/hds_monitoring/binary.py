@@ -0,0 +1,337 @@
+import argparse
+import csv
+import math
+import os
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from hds_monitoring import models
+
+# A binary log file starts with a header describing its columns, followed by
+# segments that each hold a batch of rows:
+#
+#   header:  MAGIC, uint32 schema length, schema
+#   segment: uint32 row count, uint32 payload length, payload
+#
+# The schema is a UTF-8 string of 'name:code' lines, codes being the values
+# of TYPE_CODES. The payload is a zlib-compressed sequence of columns, each
+# one prefixed with its uint32 length. Integers and timestamps are stored as
+# int64 deltas from the previous row, floats as float64, and both are
+# byte-shuffled (all first bytes, then all second bytes, and so on), which
+# makes slowly changing values compress very well.
+#
+# This module only depends on 'models', so that the dashboard can read binary
+# files without loading the agent configuration.
+
+FILE_EXT = ".bin"
+MAGIC = b"HDSB\x01"
+UINT32 = struct.Struct("<I")
+SEGMENT_HEADER = struct.Struct("<II")
+COMPRESSION_LEVEL = 6
+CONVERT_SEGMENT_ROWS = 10000
+
+TYPE_CODES = {datetime: "t", int: "i", float: "f", bool: "b", str: "s"}
+
+# Fields missing from this mapping are floats.
+FIELD_TYPES = {
+    **models.METRICS_FIELD_TYPES,
+    **models.SYSTEMD_UNITS_FIELD_TYPES,
+    **models.ROLLUP_FIELD_TYPES,
+    **models.PROCESSES_FIELD_TYPES,
+    **models.DEVICES_FIELD_TYPES,
+    **models.UNIT_RESOURCES_FIELD_TYPES,
+    **models.AGENT_FIELD_TYPES,
+}
+
+# Timestamps are stored as the number of milliseconds between 1970-01-01 and
+# the local wall clock time, the same naive datetimes as in CSV files. 0
+# stands for a missing timestamp.
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+BIG_ENDIAN = sys.byteorder == "big"
+
+
+def schema(field_names, field_types=FIELD_TYPES):
+    return [
+        (name, TYPE_CODES[field_types.get(name, float)])
+        for name in field_names
+    ]
+
+
+def encode_header(schema):
+    spec = "\n".join(f"{name}:{code}" for name, code in schema).encode()
+    return MAGIC + UINT32.pack(len(spec)) + spec
+
+
+def read_header(fi):
+    """
+    Read the header at the start of the file object 'fi' and return the
+    schema. Raise EOFError if the header is incomplete and ValueError if this
+    is not a binary log file.
+    """
+    magic = fi.read(len(MAGIC))
+    if len(magic) < len(MAGIC) and MAGIC.startswith(magic):
+        raise EOFError("Incomplete header")
+    if magic != MAGIC:
+        raise ValueError("Not a binary log file")
+    raw_length = fi.read(UINT32.size)
+    if len(raw_length) < UINT32.size:
+        raise EOFError("Incomplete header")
+    (length,) = UINT32.unpack(raw_length)
+    spec = fi.read(length)
+    if len(spec) < length:
+        raise EOFError("Incomplete header")
+    return [tuple(line.split(":")) for line in spec.decode().splitlines()]
+
+
+def _shuffle(raw, width=8):
+    return b"".join(raw[i::width] for i in range(width))
+
+
+def _unshuffle(raw, width=8):
+    size = len(raw) // width
+    out = bytearray(len(raw))
+    for i in range(width):
+        out[i::width] = raw[i * size : (i + 1) * size]
+    return bytes(out)
+
+
+def _to_bytes(typecode, values):
+    arr = array(typecode, values)
+    if BIG_ENDIAN:
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _from_bytes(typecode, raw):
+    arr = array(typecode)
+    arr.frombytes(raw)
+    if BIG_ENDIAN:
+        arr.byteswap()
+    return arr
+
+
+def encode_column(code, values):
+    if code == "s":
+        return "\0".join("" if v is None else str(v) for v in values).encode()
+    if code == "b":
+        return bytes(1 if v else 0 for v in values)
+    if code == "f":
+        values = [math.nan if v is None else v for v in values]
+        return _shuffle(_to_bytes("d", values))
+    if code == "t":
+        values = [
+            0 if v is None else (v - EPOCH) // MILLISECOND for v in values
+        ]
+    else:
+        values = [0 if v is None else int(v) for v in values]
+    deltas = [cur - prev for prev, cur in zip([0] + values, values)]
+    return _shuffle(_to_bytes("q", deltas))
+
+
+def decode_column(code, raw, n_rows):
+    """
+    Decode a column, timestamps are returned as integer milliseconds.
+    """
+    if n_rows == 0:
+        return []
+    if code == "s":
+        return raw.decode().split("\0")
+    if code == "b":
+        return [bool(v) for v in raw]
+    if code == "f":
+        return _from_bytes("d", _unshuffle(raw)).tolist()
+    return list(accumulate(_from_bytes("q", _unshuffle(raw))))
+
+
+def encode_segment(schema, rows):
+    """
+    Encode a sequence of rows, each row being a sequence of values in schema
+    order.
+    """
+    columns = list(zip(*rows)) if rows else [() for _ in schema]
+    payload = b"".join(
+        UINT32.pack(len(raw)) + raw
+        for raw in (
+            encode_column(code, values)
+            for (_, code), values in zip(schema, columns)
+        )
+    )
+    compressed = zlib.compress(payload, COMPRESSION_LEVEL)
+    return SEGMENT_HEADER.pack(len(rows), len(compressed)) + compressed
+
+
+def decode_segment(schema, n_rows, compressed):
+    payload = zlib.decompress(compressed)
+    columns = []
+    offset = 0
+    for _, code in schema:
+        (length,) = UINT32.unpack_from(payload, offset)
+        offset += UINT32.size
+        raw = payload[offset : offset + length]
+        offset += length
+        columns.append(decode_column(code, raw, n_rows))
+    return columns
+
+
+def iter_segments(fi):
+    """
+    Yield the row count and compressed payload of the segments following the
+    header, stopping at the first incomplete segment.
+    """
+    while len(header := fi.read(SEGMENT_HEADER.size)) == SEGMENT_HEADER.size:
+        n_rows, length = SEGMENT_HEADER.unpack(header)
+        payload = fi.read(length)
+        if len(payload) < length:
+            return
+        yield n_rows, payload
+
+
+def recover(path):
+    """
+    Prepare an existing file for appending and return its schema, or None if
+    the file does not exist or is empty.
+
+    A segment or header left incomplete by a crash is truncated, so that new
+    segments are appended right after the last complete one.
+    """
+    try:
+        fi = open(path, "r+b")
+    except FileNotFoundError:
+        return None
+    with fi:
+        size = fi.seek(0, os.SEEK_END)
+        fi.seek(0)
+        try:
+            file_schema = read_header(fi)
+        except EOFError:
+            fi.truncate(0)
+            return None
+        end = fi.tell()
+        while end + SEGMENT_HEADER.size <= size:
+            fi.seek(end)
+            _, length = SEGMENT_HEADER.unpack(fi.read(SEGMENT_HEADER.size))
+            if end + SEGMENT_HEADER.size + length > size:
+                break
+            end += SEGMENT_HEADER.size + length
+        if end != size:
+            fi.truncate(end)
+        return file_schema
+
+
+def read_columns(path, offset=None):
+    """
+    Read a binary log file and return its schema, a dictionary mapping field
+    names to lists of values, and the offset that follows the last complete
+    segment. Timestamps are integer milliseconds, see 'EPOCH'.
+
+    When 'offset' is given, reading starts at this offset, which must be the
+    offset returned by a previous call, so that a file that is being appended
+    to can be read incrementally.
+    """
+    with open(path, "rb") as fi:
+        file_schema = read_header(fi)
+        if offset is not None:
+            fi.seek(offset)
+        end = fi.tell()
+        columns = {name: [] for name, _ in file_schema}
+        for n_rows, payload in iter_segments(fi):
+            values = decode_segment(file_schema, n_rows, payload)
+            for (name, _), column_values in zip(file_schema, values):
+                columns[name].extend(column_values)
+            end = fi.tell()
+    return file_schema, columns, end
+
+
+def to_datetime(milliseconds):
+    return None if milliseconds == 0 else EPOCH + milliseconds * MILLISECOND
+
+
+def read_rows(path):
+    """
+    Read a binary log file and return its rows as dictionaries, timestamps
+    being converted back to datetimes.
+    """
+    file_schema, columns, _ = read_columns(path)
+    for name, code in file_schema:
+        if code == "t":
+            columns[name] = [to_datetime(v) for v in columns[name]]
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def parse_csv_value(code, text):
+    if text == "":
+        return None
+    if code == "t":
+        return datetime.fromisoformat(text)
+    if code == "i":
+        return int(float(text))
+    if code == "f":
+        return float(text)
+    if code == "b":
+        return text.lower() == "true"
+    return text
+
+
+def convert_csv(path, remove=False):
+    """
+    Convert a CSV log file to the binary format and return the path of the
+    new file, which is written next to the CSV file. The columns are taken
+    from the CSV header, so files written by older versions of the agent can
+    also be converted.
+    """
+    with open(path, newline="") as fi:
+        reader = csv.reader(fi)
+        file_schema = schema(next(reader))
+        rows = [
+            tuple(
+                parse_csv_value(code, text)
+                for (_, code), text in zip(file_schema, row)
+            )
+            for row in reader
+            if len(row) == len(file_schema)
+        ]
+
+    out_path = os.path.splitext(path)[0] + FILE_EXT
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as fo:
+        fo.write(encode_header(file_schema))
+        for start in range(0, len(rows), CONVERT_SEGMENT_ROWS):
+            fo.write(
+                encode_segment(
+                    file_schema, rows[start : start + CONVERT_SEGMENT_ROWS]
+                )
+            )
+    os.replace(tmp_path, out_path)
+    if remove:
+        os.remove(path)
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert CSV metrics and services logs to binary files."
+    )
+    parser.add_argument("paths", nargs="+", help="CSV files to convert")
+    parser.add_argument(
+        "--remove",
+        action="store_true",
+        help="delete CSV files once converted",
+    )
+    args = parser.parse_args()
+    for path in args.paths:
+        size = os.path.getsize(path)
+        out_path = convert_csv(path, remove=args.remove)
+        print(
+            f"{path} ({size} bytes) -> {out_path} "
+            f"({os.path.getsize(out_path)} bytes)"
+        )
+
+
+if __name__ == "__main__":
+    main()
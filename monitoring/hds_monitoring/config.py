@@ -1,13 +1,41 @@
+import os
+from collections.abc import Mapping
 from configparser import ConfigParser
 
 from hds_monitoring import settings
 
+ALERT_SECTION_PREFIX = "alert:"
+
+
+def split_list(text):
+    return tuple(item.strip() for item in text.split(",") if item.strip())
+
+
+def parse_alert_rule(name, section):
+    return {
+        "name": name,
+        "field": section.get("field", fallback=None),
+        "above": section.getfloat("above", fallback=None),
+        "below": section.getfloat("below", fallback=None),
+        "clear": section.getfloat("clear", fallback=None),
+        "unit": section.get("unit", fallback=None),
+        "states": split_list(section.get("states", fallback="failed")),
+        "samples": section.getint("samples", fallback=1),
+        "repeat_minutes": section.getfloat("repeat_minutes", fallback=60),
+        "sinks": split_list(section.get("sinks", fallback="")),
+    }
+
 
 def parse_config(config):
     default = config["default"]
     units = tuple(
         unit for unit in default["systemd_units"].split(",") if unit != ""
     )
+    mount_points = tuple(
+        path
+        for path in default.get("mount_points", fallback="").split(",")
+        if path != ""
+    )
     return {
         "server_name": default["server_name"],
         "systemd_units": units,
@@ -15,6 +43,38 @@ def parse_config(config):
         "log_dir": default["log_dir"],
         "log_level": default["log_level"],
         "s3_bucket": default["s3_bucket"],
+        "flush_rows": default.getint("flush_rows", fallback=1),
+        "fsync": default.getboolean("fsync", fallback=False),
+        "storage_format": default.get("storage_format", fallback="csv"),
+        "s3_endpoint_url": default.get("s3_endpoint_url", fallback=None),
+        "upload_workers": default.getint("upload_workers", fallback=4),
+        "sample_interval": default.getfloat("sample_interval", fallback=1.0),
+        "device_metrics": default.getboolean("device_metrics", fallback=False),
+        "mount_points": mount_points,
+        "top_processes": default.getint("top_processes", fallback=0),
+        "unit_resources": default.getboolean("unit_resources", fallback=False),
+        "exporter_port": default.getint("exporter_port", fallback=None),
+        "exporter_address": default.get(
+            "exporter_address", fallback="127.0.0.1"
+        ),
+        "retention_days": default.getint("retention_days", fallback=30),
+        "retention_max_mb": default.getint("retention_max_mb", fallback=1024),
+        "alert_rules": tuple(
+            parse_alert_rule(name[len(ALERT_SECTION_PREFIX) :], config[name])
+            for name in config.sections()
+            if name.startswith(ALERT_SECTION_PREFIX)
+        ),
+        "alert_webhook_url": default.get("alert_webhook_url", fallback=None),
+        "alert_file": default.get("alert_file", fallback=None),
+        "alert_command": default.get("alert_command", fallback=None),
+        "alert_max_per_minute": default.getint(
+            "alert_max_per_minute", fallback=10
+        ),
+        "ingest_url": default.get("ingest_url", fallback=None),
+        "ingest_token": default.get("ingest_token", fallback=None),
+        "state_dir": default.get(
+            "state_dir", fallback=os.path.join(settings.APP_DIR, "state")
+        ),
     }
 
 
@@ -24,4 +84,29 @@ def get_config(config_file=settings.CONFIG_FILE):
     return parse_config(config)
 
 
-config = get_config()
+class LazyConfig(Mapping):
+    """
+    Configuration of the agent, read from the configuration file on first
+    access rather than when the module is imported.
+    """
+
+    def __init__(self, config_file=None):
+        self.config_file = config_file
+        self.values = None
+
+    def load(self):
+        if self.values is None:
+            self.values = get_config(self.config_file or settings.CONFIG_FILE)
+        return self.values
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+
+config = LazyConfig()
@@ -0,0 +1,206 @@
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from hds_monitoring import log, models
+
+LOGGER = log.get_logger(__name__)
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+METRIC_PREFIX = "hds_"
+METRICS_PATH = "/metrics"
+
+# Metrics fields that are labels or strings rather than values.
+NON_VALUE_FIELDS = ("server_name", "timestamp")
+
+
+def escape_label_value(value):
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def format_value(value):
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def labels(**values):
+    pairs = ",".join(
+        f'{name}="{escape_label_value(value)}"'
+        for name, value in values.items()
+    )
+    return "{" + pairs + "}"
+
+
+def gauge(name, help_text, samples):
+    """
+    Return the lines of a gauge metric family, 'samples' being a list of
+    (labels, value) tuples.
+    """
+    name = METRIC_PREFIX + name
+    lines = [f"# TYPE {name} gauge", f"# HELP {name} {help_text}"]
+    lines.extend(
+        f"{name}{label} {format_value(value)}" for label, value in samples
+    )
+    return lines
+
+
+def metric_name(field_name):
+    # The '_total' suffix is reserved for counters, and the totals of the
+    # Metrics rows are sizes in bytes.
+    if field_name.endswith("_total"):
+        return field_name + "_bytes"
+    return field_name
+
+
+def render(metrics, units):
+    """
+    Return the OpenMetrics text exposition of a Metrics row and a list of
+    SystemdUnit rows.
+    """
+    lines = []
+    if metrics is not None:
+        server = labels(server_name=metrics.server_name)
+        lines.extend(
+            gauge(
+                "sample_timestamp_seconds",
+                "Time the latest sample was collected at.",
+                [(server, metrics.timestamp.timestamp())],
+            )
+        )
+        for name in models.METRICS_FIELD_NAMES:
+            if name in NON_VALUE_FIELDS:
+                continue
+            lines.extend(
+                gauge(
+                    metric_name(name),
+                    f"Latest value of '{name}'.",
+                    [(server, getattr(metrics, name))],
+                )
+            )
+    if units:
+        unit_labels = [
+            labels(server_name=unit.server_name, unit_name=unit.unit_name)
+            for unit in units
+        ]
+        lines.extend(
+            gauge(
+                "unit_active",
+                "Whether the systemd unit is active.",
+                [
+                    (label, 1 if unit.active else 0)
+                    for label, unit in zip(unit_labels, units)
+                ],
+            )
+        )
+        lines.extend(
+            gauge(
+                "unit_state",
+                "Current state of the systemd unit, always 1.",
+                [
+                    (
+                        labels(
+                            server_name=unit.server_name,
+                            unit_name=unit.unit_name,
+                            active_state=unit.active_state,
+                            sub_state=unit.sub_state,
+                        ),
+                        1,
+                    )
+                    for unit in units
+                ],
+            )
+        )
+        lines.extend(
+            gauge(
+                "unit_state_changed_timestamp_seconds",
+                "Time the systemd unit last changed state.",
+                [
+                    (label, unit.state_changed_at.timestamp())
+                    for label, unit in zip(unit_labels, units)
+                    if unit.state_changed_at is not None
+                ],
+            )
+        )
+    lines.append("# EOF")
+    return ("\n".join(lines) + "\n").encode()
+
+
+class Snapshot:
+    """
+    Latest Metrics and SystemdUnit rows collected by the agent.
+
+    The exposition is rendered on the first scrape after an update and
+    reused by the following scrapes, so scraping never triggers a collection
+    and costs little more than sending bytes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = None
+        self.units = []
+        self.body = None
+
+    def update(self, metrics, units):
+        with self.lock:
+            self.metrics = metrics
+            self.units = list(units)
+            self.body = None
+
+    def exposition(self):
+        with self.lock:
+            if self.body is None:
+                self.body = render(self.metrics, self.units)
+            return self.body
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+        body = self.server.snapshot.exposition()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOGGER.debug(f"{self.address_string()} {format % args}")
+
+
+class MetricsServer:
+    """
+    Serves the exposition of a Snapshot at '/metrics' from a background
+    thread. With port 0, the operating system picks a free port, which is
+    then available as 'port'.
+    """
+
+    def __init__(self, snapshot, address="127.0.0.1", port=0):
+        self.httpd = ThreadingHTTPServer((address, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.snapshot = snapshot
+        self.port = self.httpd.server_address[1]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, name="exporter", daemon=True
+        )
+        self.thread.start()
+        LOGGER.info(f"Serving metrics on port {self.port}")
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,83 @@
+import re
+
+# Objects describing the logs of the bucket, maintained by the agents so that
+# readers find servers and their logs with a few GET requests rather than
+# listing every object. Their keys start with an underscore, which server
+# names do not.
+#
+# The manifest of a server maps the key of each of its log objects to:
+#   - 'size': size of the object,
+#   - 'version': changes when the object is uploaded whole again,
+#   - 'segments': [key, offset, size] lists of its segment objects.
+# The fleet index maps server names to:
+#   - 'last_seen': UNIX time of the last sync of the server,
+#   - 'latest': dictionary mapping kinds of logs to the key, date and total
+#     size, segments included, of the log of the latest day.
+INDEX_PREFIX = "_index"
+FLEET_INDEX_KEY = f"{INDEX_PREFIX}/fleet.json"
+LOG_FILE_REGEX = re.compile(
+    r"^(?P<kind>[a-z][a-z0-9-]*)_(?P<date>\d{4}-\d{2}-\d{2})\.(csv|bin)$"
+)
+
+
+def server_manifest_key(server_name):
+    return f"{INDEX_PREFIX}/servers/{server_name}.json"
+
+
+def segment_offset(seg_key):
+    """
+    Return the offset of a segment object in its file, from its key
+    '<key>.<offset>.part'.
+    """
+    return int(seg_key.rsplit(".", 2)[1])
+
+
+def server_manifest(key_prefix, manifest, last_seen, previous=None):
+    """
+    Return the manifest of a server, built from the upload manifest of its
+    agent (see 'aws.copy_folder_to_s3()').
+
+    The upload manifest only describes the files still in the data directory,
+    while the objects of files that were archived or evicted by the retention
+    engine stay in the bucket. Their entries are carried over from the
+    'previous' manifest of the server, so that readers still find them.
+    """
+    logs = dict(previous["logs"]) if previous else {}
+    for key, entry in sorted(manifest.items()):
+        if not key.startswith(f"{key_prefix}/"):
+            continue
+        offsets = [segment_offset(seg_key) for seg_key in entry["segments"]]
+        ends = offsets[1:] + [entry["size"]]
+        logs[key] = {
+            "size": offsets[0] if offsets else entry["size"],
+            "version": entry.get("base_sha256", entry["sha256"]),
+            "segments": [
+                [seg_key, offset, end - offset]
+                for seg_key, offset, end in zip(
+                    entry["segments"], offsets, ends
+                )
+            ],
+        }
+    return {"last_seen": last_seen, "logs": logs}
+
+
+def total_size(log):
+    if log["segments"]:
+        _, offset, size = log["segments"][-1]
+        return offset + size
+    return log["size"]
+
+
+def fleet_entry(manifest):
+    """
+    Return the entry of a server in the fleet index, from its manifest.
+    """
+    latest = {}
+    for key, log in manifest["logs"].items():
+        match = LOG_FILE_REGEX.match(key.rsplit("/", 1)[-1])
+        if match is None:
+            continue
+        kind, date = match["kind"], match["date"]
+        if kind not in latest or date > latest[kind]["date"]:
+            latest[kind] = {"key": key, "date": date, "size": total_size(log)}
+    return {"last_seen": manifest["last_seen"], "latest": latest}
@@ -0,0 +1,336 @@
+import argparse
+import hmac
+import http.client
+import io
+import logging
+import struct
+import threading
+import time
+import urllib.parse
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from hds_monitoring import binary, models
+
+# Agents push the rows they collect to an ingestion server, which keeps the
+# rows of the last WINDOW_SEC seconds of each server in memory for the
+# dashboard, S3 remaining the durable archive.
+#
+# A batch is the body of a POST request to INGEST_PATH, made of one block
+# per stream:
+#
+#   block: uint32 name length, name, uint32 data length, data
+#
+# where data is a header and a segment of the 'binary' format, so a batch
+# is self-describing and compressed.
+#
+# Like 'binary', this module does not load the agent configuration, so that
+# the dashboard can run the server.
+
+LOGGER = logging.getLogger(__name__)
+
+INGEST_PATH = "/ingest"
+CONTENT_TYPE = "application/x-hds-batch"
+# Field names of the streams accepted by the server.
+STREAMS = {
+    "metrics": models.METRICS_FIELD_NAMES,
+    "services": models.SYSTEMD_UNITS_FIELD_NAMES,
+}
+WINDOW_SEC = 3600
+MAX_BATCH_BYTES = 1024 * 1024
+PUSH_TIMEOUT_SEC = 5
+# Rows of each stream kept by an agent while the server cannot be reached.
+PUSH_MAX_PENDING_ROWS = 1000
+
+
+def encode_batch(streams):
+    """
+    Encode a batch, 'streams' being a dictionary mapping stream names to
+    lists of rows, namedtuples of 'models'.
+    """
+    parts = []
+    for name, rows in streams.items():
+        if not rows:
+            continue
+        schema = binary.schema(STREAMS[name])
+        data = binary.encode_header(schema) + binary.encode_segment(
+            schema, rows
+        )
+        raw_name = name.encode()
+        parts.extend(
+            [
+                binary.UINT32.pack(len(raw_name)),
+                raw_name,
+                binary.UINT32.pack(len(data)),
+                data,
+            ]
+        )
+    return b"".join(parts)
+
+
+def decode_batch(data):
+    """
+    Return a dictionary mapping the stream names of a batch to (schema,
+    columns) tuples, columns being a dictionary mapping field names to lists
+    of values. Raise ValueError if the batch is malformed.
+    """
+    streams = {}
+    fi = io.BytesIO(data)
+    while raw := fi.read(binary.UINT32.size):
+        try:
+            (length,) = binary.UINT32.unpack(raw)
+            name = fi.read(length).decode()
+            (length,) = binary.UINT32.unpack(fi.read(binary.UINT32.size))
+            block_data = fi.read(length)
+            if len(block_data) < length:
+                raise EOFError(f"block of stream '{name}' is truncated")
+            block = io.BytesIO(block_data)
+            schema = binary.read_header(block)
+        except (EOFError, UnicodeDecodeError, struct.error) as exc:
+            raise ValueError(f"Malformed batch: {exc}") from exc
+        if name not in STREAMS:
+            raise ValueError(f"Unknown stream '{name}'")
+        if [field for field, _ in schema] != STREAMS[name]:
+            raise ValueError(f"Fields of stream '{name}' do not match")
+        columns = {field: [] for field, _ in schema}
+        for n_rows, payload in binary.iter_segments(block):
+            values = binary.decode_segment(schema, n_rows, payload)
+            for (field, _), column in zip(schema, values):
+                columns[field].extend(column)
+        streams[name] = (schema, columns)
+    return streams
+
+
+class LiveStore:
+    """
+    Rows of the last 'window_sec' seconds of each stream of each server.
+
+    Rows are stored as tuples in the order of the fields of the stream,
+    timestamps as integer milliseconds (see 'binary.EPOCH'), in one deque per
+    server and stream. Rows are expected in time order, and rows that fall
+    out of the window are dropped as new ones come in, so adding a row costs
+    the same however many rows are held.
+    """
+
+    def __init__(self, window_sec=WINDOW_SEC):
+        self.window_ms = window_sec * 1000
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.last_seen = {}
+        self.batches = 0
+
+    def add(self, stream, columns):
+        names = columns["server_name"]
+        timestamps = columns["timestamp"]
+        rows = list(zip(*columns.values()))
+        now = time.time()
+        with self.lock:
+            self.batches += 1
+            for server_name, timestamp, row in zip(names, timestamps, rows):
+                key = (server_name, stream)
+                window = self.rows.get(key)
+                if window is None:
+                    window = self.rows[key] = deque()
+                window.append(row)
+                while window[0][1] < timestamp - self.window_ms:
+                    window.popleft()
+                self.last_seen[server_name] = now
+
+    def server_names(self):
+        with self.lock:
+            return sorted(self.last_seen)
+
+    def columns(self, server_names, stream, start_ms=0):
+        """
+        Return a dictionary mapping the field names of a stream to the values
+        of the rows of the servers 'server_names' timestamped at or after
+        'start_ms'.
+        """
+        selected = []
+        with self.lock:
+            for server_name in server_names:
+                window = self.rows.get((server_name, stream), ())
+                selected.extend(row for row in window if row[1] >= start_ms)
+        fields = STREAMS[stream]
+        if not selected:
+            return {field: [] for field in fields}
+        return dict(zip(fields, map(list, zip(*selected))))
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    # Agents keep their connection open between batches.
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if self.path.split("?")[0] != INGEST_PATH:
+            self.send_error(404)
+            return
+        token = self.server.token
+        if token and not hmac.compare_digest(
+            self.headers.get("Authorization", ""), f"Bearer {token}"
+        ):
+            self.send_error(401)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BATCH_BYTES:
+            self.send_error(413)
+            return
+        try:
+            streams = decode_batch(self.rfile.read(length))
+        except ValueError as exc:
+            self.send_error(400, str(exc))
+            return
+        for stream, (_, columns) in streams.items():
+            self.server.store.add(stream, columns)
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        LOGGER.debug(f"{self.address_string()} {format % args}")
+
+
+class IngestServer:
+    """
+    Receives batches pushed by agents at INGEST_PATH and adds their rows to
+    a LiveStore, from a background thread. With 'token', requests must carry
+    the header 'Authorization: Bearer <token>'.
+    """
+
+    def __init__(self, store, address="127.0.0.1", port=0, token=None):
+        self.httpd = ThreadingHTTPServer((address, port), IngestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.store = store
+        self.httpd.token = token
+        self.port = self.httpd.server_address[1]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, name="ingest", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class Pusher:
+    """
+    Pushes the rows collected by an agent to an ingestion server.
+
+    Batches are posted on a connection kept open between them. Rows that
+    cannot be pushed, because the server cannot be reached or refused the
+    token, are kept, up to PUSH_MAX_PENDING_ROWS per stream, and pushed with
+    the next batch. The server only holds recent rows, so the oldest ones
+    are dropped first. Rows of a batch the server rejected as invalid or too
+    large would be rejected again, they are dropped.
+    """
+
+    def __init__(self, url, token=None, max_pending=PUSH_MAX_PENDING_ROWS):
+        self.url = url
+        parts = urllib.parse.urlsplit(url)
+        self.connection_class = (
+            http.client.HTTPSConnection
+            if parts.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.netloc = parts.netloc
+        self.path = parts.path or "/"
+        if parts.query:
+            self.path += f"?{parts.query}"
+        self.connection = None
+        self.headers = {"Content-Type": CONTENT_TYPE}
+        if token:
+            self.headers["Authorization"] = f"Bearer {token}"
+        self.pending = {name: deque(maxlen=max_pending) for name in STREAMS}
+        self.pushed = 0
+        self.failures = 0
+
+    def push(self, item):
+        """
+        Push a (metrics, units) tuple of a Metrics row and SystemdUnit rows,
+        with the rows left pending by previous calls.
+        """
+        metrics, units = item
+        self.pending["metrics"].append(metrics)
+        self.pending["services"].extend(units)
+        try:
+            status = self.post(encode_batch(self.pending))
+        except (OSError, http.client.HTTPException) as exc:
+            self.failures += 1
+            LOGGER.warning(f"Failed to push rows to '{self.url}': {exc}")
+            return
+        if status == 401 or status >= 500:
+            self.failures += 1
+            LOGGER.warning(
+                f"Failed to push rows to '{self.url}': status {status}"
+            )
+            return
+        if status >= 400:
+            self.failures += 1
+            LOGGER.error(
+                f"Rows pushed to '{self.url}' were rejected with status "
+                f"{status}, dropping them"
+            )
+        else:
+            self.pushed += 1
+        for rows in self.pending.values():
+            rows.clear()
+
+    def post(self, body):
+        """
+        Post a batch and return the status of the response. The connection
+        is opened on first use, and opened again once if the server closed it
+        since the previous batch.
+        """
+        reused = self.connection is not None
+        if not reused:
+            self.connection = self.connection_class(
+                self.netloc, timeout=PUSH_TIMEOUT_SEC
+            )
+        try:
+            self.connection.request("POST", self.path, body, self.headers)
+            response = self.connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            if not reused:
+                raise
+            return self.post(body)
+        return response.status
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Receive the rows pushed by agents and keep the recent "
+        "ones in memory."
+    )
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8428)
+    parser.add_argument("--token", help="token agents must send")
+    parser.add_argument("--window-sec", type=int, default=WINDOW_SEC)
+    args = parser.parse_args()
+    logging.basicConfig(
+        format="%(asctime)s %(name)s %(levelname)s: %(message)s",
+        level=logging.INFO,
+    )
+    store = LiveStore(args.window_sec)
+    server = IngestServer(store, args.address, args.port, args.token)
+    LOGGER.info(f"Listening on {args.address}:{server.port}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
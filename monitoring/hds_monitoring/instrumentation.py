@@ -0,0 +1,163 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import psutil as psu
+
+from hds_monitoring import models
+
+# Upper bounds of the buckets of duration histograms, in seconds.
+DURATION_BUCKETS_SEC = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    math.inf,
+)
+
+
+class Histogram:
+    """
+    Counts observations in buckets of DURATION_BUCKETS_SEC, and keeps their
+    sum and maximum.
+    """
+
+    def __init__(self, bounds=DURATION_BUCKETS_SEC):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+
+class Recorder:
+    """
+    Records the durations of the stages of the agent, such as collecting
+    metrics or syncing logs to S3, in one Histogram per stage.
+
+    Histograms are reset each time their rows are taken by 'rows()', so each
+    batch of rows describes the interval since the previous batch.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].observe(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - start)
+
+    def rows(self, server_name, timestamp):
+        with self.lock:
+            histograms = self.histograms
+            self.histograms = {}
+        rows = []
+        for stage, histogram in sorted(histograms.items()):
+            values = [
+                ("duration_count", histogram.count),
+                ("duration_sec_sum", histogram.total),
+                ("duration_sec_max", histogram.maximum),
+            ] + [
+                (f"duration_sec_le_{bound:g}", count)
+                for bound, count in zip(histogram.bounds, histogram.counts)
+                if count
+            ]
+            rows.extend(
+                models.AgentMetric(
+                    server_name, timestamp, metric, stage, value
+                )
+                for metric, value in values
+            )
+        return rows
+
+
+RECORDER = Recorder()
+
+# Process of the agent and the CPU times it had used at the previous call to
+# 'process_rows()'.
+PROCESS = psu.Process()
+LAST_CPU_TIMES = None
+
+
+def timed(stage):
+    return RECORDER.time(stage)
+
+
+def observe(stage, seconds):
+    RECORDER.observe(stage, seconds)
+
+
+def process_rows(server_name, timestamp):
+    """
+    Return AgentMetric rows holding the resident memory, CPU usage, open
+    file descriptors and threads of the agent.
+    """
+    global LAST_CPU_TIMES
+    with PROCESS.oneshot():
+        rss = PROCESS.memory_info().rss
+        cpu_times = PROCESS.cpu_times()
+        num_fds = PROCESS.num_fds()
+        num_threads = PROCESS.num_threads()
+    now = time.monotonic()
+    cpu_sec = cpu_times.user + cpu_times.system
+    cpu_percent = 0.0
+    if LAST_CPU_TIMES is not None and now > LAST_CPU_TIMES[0]:
+        cpu_percent = (cpu_sec - LAST_CPU_TIMES[1]) / (now - LAST_CPU_TIMES[0])
+        cpu_percent *= 100
+    LAST_CPU_TIMES = (now, cpu_sec)
+    return [
+        models.AgentMetric(server_name, timestamp, metric, "", value)
+        for metric, value in (
+            ("rss_bytes", rss),
+            ("cpu_user_sec_total", cpu_times.user),
+            ("cpu_system_sec_total", cpu_times.system),
+            ("cpu_percent", cpu_percent),
+            ("open_fds", num_fds),
+            ("threads", num_threads),
+        )
+    ]
+
+
+def agent_rows(server_name, timestamp, counters):
+    """
+    Return the AgentMetric rows of the stage histograms, of the resource
+    usage of the agent and of 'counters', a dictionary mapping metric names
+    to values.
+    """
+    return (
+        RECORDER.rows(server_name, timestamp)
+        + process_rows(server_name, timestamp)
+        + [
+            models.AgentMetric(server_name, timestamp, metric, "", value)
+            for metric, value in counters.items()
+        ]
+    )
@@ -1,45 +1,313 @@
+import abc
 import csv
+import itertools
 import os
-from datetime import date, datetime, timedelta
 
-from hds_monitoring import models, settings
+from hds_monitoring import binary, log, models, rollup, settings
 from hds_monitoring.config import config
 
+LOGGER = log.get_logger(__name__)
 
-def to_csv(row, field_names, file_path):
-    if os.path.exists(file_path):
-        new_file = False
-    else:
-        new_file = True
-    with open(file_path, "a") as fi:
-        writer = csv.DictWriter(fi, fieldnames=field_names)
-        if new_file:
-            writer.writeheader()
-        writer.writerow(row._asdict())
+READ_BLOCK_SIZE = 4096
 
 
-def metrics_to_csv(row):
-    date_str = date.today().strftime(settings.DATE_FORMAT)
-    file_path = os.path.join(
-        config["data_dir"], f"metrics_{date_str}{settings.FILE_EXT}"
-    )
-    to_csv(row, models.METRICS_FIELD_NAMES, file_path)
+def truncate_partial_row(path):
+    """
+    Remove the partial row that a crash may have left at the end of a file,
+    and return the size of the file.
+
+    Rows always end with a newline, so everything after the last newline is
+    an incomplete write.
+    """
+    try:
+        fi = open(path, "r+b")
+    except FileNotFoundError:
+        return 0
+    with fi:
+        size = fi.seek(0, os.SEEK_END)
+        end = 0
+        pos = size
+        while pos > 0:
+            start = max(pos - READ_BLOCK_SIZE, 0)
+            fi.seek(start)
+            idx = fi.read(pos - start).rfind(b"\n")
+            if idx != -1:
+                end = start + idx + 1
+                break
+            pos = start
+        if end != size:
+            LOGGER.warning(f"Truncating partial row at the end of '{path}'")
+            fi.truncate(end)
+        return end
+
+
+class Appender(abc.ABC):
+    """
+    Appends rows to daily files named '<prefix>_<date><file_ext>'.
+
+    The file of the current day is kept open between writes and the appender
+    rolls over to a new file when rows from another day come in. Rows are
+    buffered and written once 'flush_rows' rows are pending, and with 'fsync'
+    each write is synced to disk.
+
+    A file written with another layout, for example by an older version of
+    the agent, is moved aside by 'move_aside()' rather than appended to.
+
+    Subclasses implement the file format with 'open_file()' and
+    'write_rows()', and set 'file_ext'.
+    """
+
+    file_ext = None
+
+    def __init__(
+        self,
+        prefix,
+        field_names,
+        data_dir,
+        flush_rows=1,
+        fsync=False,
+        field_types=None,
+    ):
+        self.prefix = prefix
+        self.field_names = field_names
+        self.field_types = field_types or {}
+        self.data_dir = data_dir
+        self.flush_rows = flush_rows
+        self.fsync = fsync
+        self.date_str = None
+        self.file = None
+        self.buffer = []
+
+    def path(self, date_str):
+        return os.path.join(
+            self.data_dir, f"{self.prefix}_{date_str}{self.file_ext}"
+        )
+
+    def open(self, date_str):
+        self.close()
+        self.file = self.open_file(self.path(date_str))
+        self.date_str = date_str
+
+    def append(self, *rows):
+        for row in rows:
+            date_str = row.timestamp.strftime(settings.DATE_FORMAT)
+            if date_str != self.date_str:
+                self.flush()
+                self.open(date_str)
+            self.buffer.append(row)
+        if len(self.buffer) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if self.file is None or not self.buffer:
+            return
+        self.write_rows(self.buffer)
+        self.buffer.clear()
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
+        self.date_str = None
+
+    def move_aside(self, path):
+        """
+        Rename a file whose header or schema does not match the rows, so that
+        rows are appended to a new file. The file keeps its date under the
+        prefix '<prefix>-old', or '<prefix>-old<n>' if that file exists, so
+        that it is still synced to S3 and removed by the retention engine.
+        """
+        directory, name = os.path.split(path)
+        for n in itertools.count(1):
+            suffix = "old" if n == 1 else f"old{n}"
+            aside_path = os.path.join(
+                directory,
+                name.replace(f"{self.prefix}_", f"{self.prefix}-{suffix}_", 1),
+            )
+            if not os.path.exists(aside_path):
+                break
+        os.replace(path, aside_path)
+        LOGGER.warning(
+            f"Layout of '{path}' does not match the rows, moved it to "
+            f"'{aside_path}'"
+        )
+        return aside_path
+
+    @abc.abstractmethod
+    def open_file(self, path):
+        """
+        Open the file at 'path' for appending, recovering it if it was left
+        incomplete by a crash, and return the file object.
+        """
+
+    @abc.abstractmethod
+    def write_rows(self, rows):
+        """
+        Write a batch of rows to 'self.file', without flushing it.
+        """
+
+
+class CsvAppender(Appender):
+    """
+    Appends rows to CSV files. When an existing file is reopened, a partial
+    last row is removed, and the file is moved aside if its header does not
+    match the rows. The header is only written to empty files.
+    """
+
+    file_ext = settings.FILE_EXT
+
+    def open_file(self, path):
+        size = truncate_partial_row(path)
+        if size > 0:
+            with open(path, newline="") as existing:
+                header = next(csv.reader(existing), [])
+            if header != self.field_names:
+                self.move_aside(path)
+                size = 0
+        fi = open(path, "a", newline="")
+        self.writer = csv.DictWriter(fi, fieldnames=self.field_names)
+        if size == 0:
+            self.writer.writeheader()
+        return fi
+
+    def write_rows(self, rows):
+        self.writer.writerows(row._asdict() for row in rows)
+
+
+class BinaryAppender(Appender):
+    """
+    Appends rows to files in the format of the 'binary' module, each flush
+    writing one compressed segment. Larger values of 'flush_rows' give
+    better compression. Like CSV files, files with another schema are moved
+    aside.
+    """
+
+    file_ext = binary.FILE_EXT
+
+    def open_file(self, path):
+        self.schema = binary.schema(self.field_names, self.field_types)
+        file_schema = binary.recover(path)
+        if file_schema is not None and file_schema != self.schema:
+            self.move_aside(path)
+            file_schema = None
+        fi = open(path, "ab")
+        if file_schema is None:
+            fi.write(binary.encode_header(self.schema))
+        return fi
 
+    def write_rows(self, rows):
+        self.file.write(binary.encode_segment(self.schema, rows))
 
-def services_to_csv(row):
-    date_str = date.today().strftime(settings.DATE_FORMAT)
-    file_path = os.path.join(
-        config["data_dir"], f"services_{date_str}{settings.FILE_EXT}"
+
+APPENDER_CLASSES = {
+    "csv": CsvAppender,
+    "binary": BinaryAppender,
+}
+
+
+def make_appender(prefix, field_names, field_types):
+    appender_class = APPENDER_CLASSES[config["storage_format"]]
+    return appender_class(
+        prefix,
+        field_names,
+        config["data_dir"],
+        flush_rows=config["flush_rows"],
+        fsync=config["fsync"],
+        field_types=field_types,
     )
-    to_csv(row, models.SYSTEMD_UNITS_FIELD_NAMES, file_path)
 
 
-def cleanup_logs():
-    for path in os.listdir(config["data_dir"]):
-        full_path = os.path.join(config["data_dir"], path)
-        last_modified_at = datetime.utcfromtimestamp(
-            os.path.getmtime(full_path)
+# Fields and field types of the rows of each stream, streams being named
+# after the prefix of their files.
+STREAMS = {
+    "metrics": (models.METRICS_FIELD_NAMES, models.METRICS_FIELD_TYPES),
+    "services": (
+        models.SYSTEMD_UNITS_FIELD_NAMES,
+        models.SYSTEMD_UNITS_FIELD_TYPES,
+    ),
+    "processes": (
+        models.PROCESSES_FIELD_NAMES,
+        models.PROCESSES_FIELD_TYPES,
+    ),
+    "devices": (models.DEVICES_FIELD_NAMES, models.DEVICES_FIELD_TYPES),
+    "unit-resources": (
+        models.UNIT_RESOURCES_FIELD_NAMES,
+        models.UNIT_RESOURCES_FIELD_TYPES,
+    ),
+    "agent": (models.AGENT_FIELD_NAMES, models.AGENT_FIELD_TYPES),
+    **{
+        f"metrics-{tier}": (
+            models.ROLLUP_FIELD_NAMES,
+            models.ROLLUP_FIELD_TYPES,
         )
-        now = datetime.now()
-        if last_modified_at < now - timedelta(days=7):
-            os.remove(full_path)
+        for tier in rollup.TIERS
+    },
+}
+
+# Appenders of the streams written to so far, created on first use so that
+# the configuration is only read when rows are written.
+APPENDERS = {}
+
+
+def get_appender(prefix):
+    if prefix not in APPENDERS:
+        APPENDERS[prefix] = make_appender(prefix, *STREAMS[prefix])
+    return APPENDERS[prefix]
+
+
+def metrics_to_csv(row):
+    get_appender("metrics").append(row)
+
+
+def services_to_csv(*rows):
+    get_appender("services").append(*rows)
+
+
+def processes_to_csv(*rows):
+    get_appender("processes").append(*rows)
+
+
+def devices_to_csv(*rows):
+    get_appender("devices").append(*rows)
+
+
+def unit_resources_to_csv(*rows):
+    get_appender("unit-resources").append(*rows)
+
+
+def agent_to_csv(*rows):
+    get_appender("agent").append(*rows)
+
+
+def rollups_to_csv(tier, *rows):
+    get_appender(f"metrics-{tier}").append(*rows)
+
+
+def all_appenders():
+    return list(APPENDERS.values())
+
+
+def flush_all():
+    for appender in all_appenders():
+        appender.flush()
+
+
+def close_all():
+    for appender in all_appenders():
+        appender.close()
+
+
+def open_paths():
+    """
+    Return the paths of the files that appenders keep open for writing.
+    """
+    return [
+        appender.path(appender.date_str)
+        for appender in all_appenders()
+        if appender.file is not None
+    ]
@@ -4,12 +4,6 @@ import os
 
 from hds_monitoring import config
 
-ROTATING_FILE_HANDLER = logging.handlers.RotatingFileHandler(
-    filename=os.path.join(config.config["log_dir"], "hds-monitoring.log"),
-    maxBytes=20000000,
-    backupCount=5,
-)
-
 LEVEL_MAPPING = {
     "debug": logging.DEBUG,
     "info": logging.INFO,
@@ -18,11 +12,25 @@ LEVEL_MAPPING = {
     "critical": logging.CRITICAL,
 }
 
-logging.basicConfig(
-    format="%(asctime)s %(name)s %(levelname)s: %(message)s",
-    level=LEVEL_MAPPING.get(config.config["log_level"].lower(), logging.INFO),
-    handlers=[ROTATING_FILE_HANDLER],
-)
+
+def setup():
+    """
+    Send logs to a rotating file in the log directory of the configuration.
+    Called by the entry point rather than when the module is imported, so
+    that importing modules of the agent does not open files.
+    """
+    handler = logging.handlers.RotatingFileHandler(
+        filename=os.path.join(config.config["log_dir"], "hds-monitoring.log"),
+        maxBytes=20000000,
+        backupCount=5,
+    )
+    logging.basicConfig(
+        format="%(asctime)s %(name)s %(levelname)s: %(message)s",
+        level=LEVEL_MAPPING.get(
+            config.config["log_level"].lower(), logging.INFO
+        ),
+        handlers=[handler],
+    )
 
 
 def get_logger(name):
@@ -1,11 +1,56 @@
-from hds_monitoring import monitoring, log
+import argparse
+
+from hds_monitoring import log, monitoring
 
 LOGGER = log.get_logger(__name__)
 
+COMMANDS = {
+    "run": "sample continuously, the default",
+    "collect": "write a single sample and exit",
+    "sync": "sync the logs to S3 and exit",
+    "cleanup": "archive and evict old logs and exit",
+}
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        prog="hds-monitoring",
+        description="Record metrics and service statuses of this server.",
+    )
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="run",
+        choices=COMMANDS,
+        help="; ".join(f"{name}: {help}" for name, help in COMMANDS.items()),
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="same as the 'collect' command, for systemd timers",
+    )
+    args = parser.parse_args(args)
+    if args.once:
+        if args.command not in ("run", "collect"):
+            parser.error(
+                f"--once cannot be used with the '{args.command}' command"
+            )
+        args.command = "collect"
+    return args
+
 
-def main():
-    LOGGER.info("Starting application")
-    monitoring.monitor()
+def main(args=None):
+    args = parse_args(args)
+    log.setup()
+    LOGGER.info(f"Starting application: {args.command}")
+    if args.command == "run":
+        monitoring.monitor()
+    elif args.command == "collect":
+        monitoring.collect_once()
+    elif args.command == "sync":
+        monitoring.sync_once()
+    elif args.command == "cleanup":
+        monitoring.cleanup_once()
 
 
 if __name__ == "__main__":
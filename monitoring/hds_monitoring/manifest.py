@@ -0,0 +1,35 @@
+import json
+import os
+
+from hds_monitoring import log
+
+LOGGER = log.get_logger(__name__)
+
+
+def load_manifest(path):
+    """
+    Return the manifest stored at 'path', or an empty manifest if the file
+    does not exist or is corrupted.
+    """
+    try:
+        with open(path) as fi:
+            return json.load(fi)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        LOGGER.warning(f"Ignoring corrupted manifest '{path}'")
+        return {}
+
+
+def save_manifest(path, manifest):
+    """
+    Write the manifest to 'path' atomically, so that a crash cannot leave a
+    partially written manifest.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as fo:
+        json.dump(manifest, fo)
+        fo.flush()
+        os.fsync(fo.fileno())
+    os.replace(tmp_path, path)
@@ -1,4 +1,5 @@
 from collections import namedtuple
+from datetime import datetime
 
 METRICS_FIELD_NAMES = [
     "server_name",
@@ -15,23 +16,198 @@ METRICS_FIELD_NAMES = [
     "disk_total",
     "disk_used",
     "disk_used_percent",
-    "disk_read_count",
-    "disk_write_count",
-    "disk_read_bytes",
-    "disk_write_bytes",
-    "network_bytes_sent",
-    "network_bytes_received",
-    "network_errors_receiving",
-    "network_errors_sending",
+    "disk_read_ops_per_sec",
+    "disk_write_ops_per_sec",
+    "disk_read_bytes_per_sec",
+    "disk_write_bytes_per_sec",
+    "network_bytes_sent_per_sec",
+    "network_bytes_received_per_sec",
+    "network_errors_receiving_per_sec",
+    "network_errors_sending_per_sec",
 ]
 
+# Gauges sampled continuously between two Metrics rows. Their columns hold
+# the mean over the interval, and those of SUMMARIZED_FIELDS are followed by
+# columns holding their distribution over the interval.
+SAMPLED_FIELDS = [
+    "cpu_percent",
+    "cpu_load_percent",
+    "memory_available",
+    "memory_used_percent",
+    "memory_swap_used",
+    "memory_swap_used_percent",
+    "disk_used",
+    "disk_used_percent",
+]
+
+SUMMARIZED_FIELDS = [
+    "cpu_percent",
+    "cpu_load_percent",
+    "memory_used_percent",
+    "memory_swap_used_percent",
+]
+
+SUMMARY_STATS = ["min", "max", "p50", "p95", "p99"]
+
+SUMMARY_FIELD_NAMES = [
+    f"{name}_{stat}" for name in SUMMARIZED_FIELDS for stat in SUMMARY_STATS
+]
+
+METRICS_FIELD_NAMES += SUMMARY_FIELD_NAMES
+
 Metrics = namedtuple("Metrics", METRICS_FIELD_NAMES)
 
+# Types of the fields that are not floats, used by the binary storage format.
+METRICS_FIELD_TYPES = {
+    "server_name": str,
+    "timestamp": datetime,
+    "cpu_count": int,
+    "memory_total": int,
+    "memory_swap_total": int,
+    "disk_total": int,
+}
+
 SYSTEMD_UNITS_FIELD_NAMES = [
     "server_name",
     "timestamp",
     "unit_name",
     "active",
+    "active_state",
+    "sub_state",
+    "state_changed_at",
 ]
 
 SystemdUnit = namedtuple("SystemdUnit", SYSTEMD_UNITS_FIELD_NAMES)
+
+SYSTEMD_UNITS_FIELD_TYPES = {
+    "server_name": str,
+    "timestamp": datetime,
+    "unit_name": str,
+    "active": bool,
+    "active_state": str,
+    "sub_state": str,
+    "state_changed_at": datetime,
+}
+
+# Metrics fields summarized by rollups, totals that do not change are left
+# out.
+ROLLUP_SOURCE_FIELDS = [
+    name
+    for name in METRICS_FIELD_NAMES
+    if name not in ("server_name", "timestamp", "cpu_count")
+    and not name.endswith("_total")
+    and name not in SUMMARY_FIELD_NAMES
+]
+
+ROLLUP_STATS = ["min", "max", "mean", "p95"]
+
+ROLLUP_FIELD_NAMES = ["server_name", "timestamp", "samples"] + [
+    f"{name}_{stat}" for name in ROLLUP_SOURCE_FIELDS for stat in ROLLUP_STATS
+]
+
+Rollup = namedtuple("Rollup", ROLLUP_FIELD_NAMES)
+
+ROLLUP_FIELD_TYPES = {
+    "server_name": str,
+    "timestamp": datetime,
+    "samples": int,
+}
+
+PROCESSES_FIELD_NAMES = [
+    "server_name",
+    "timestamp",
+    "pid",
+    "name",
+    "username",
+    "cpu_percent",
+    "memory_rss",
+    "memory_percent",
+    "io_read_bytes_per_sec",
+    "io_write_bytes_per_sec",
+    "num_threads",
+]
+
+Process = namedtuple("Process", PROCESSES_FIELD_NAMES)
+
+PROCESSES_FIELD_TYPES = {
+    "server_name": str,
+    "timestamp": datetime,
+    "pid": int,
+    "name": str,
+    "username": str,
+    "memory_rss": int,
+    "num_threads": int,
+}
+
+# Resources used by the cgroups of systemd units. CPU and I/O are rates over
+# the interval since the previous row of the unit, CPU utilization being a
+# percentage of one CPU like that of processes.
+UNIT_RESOURCES_FIELD_NAMES = [
+    "server_name",
+    "timestamp",
+    "unit_name",
+    "cpu_percent",
+    "cpu_user_percent",
+    "cpu_system_percent",
+    "memory_current",
+    "memory_peak",
+    "io_read_bytes_per_sec",
+    "io_write_bytes_per_sec",
+    "io_read_ops_per_sec",
+    "io_write_ops_per_sec",
+    "pids",
+]
+
+UnitResources = namedtuple("UnitResources", UNIT_RESOURCES_FIELD_NAMES)
+
+UNIT_RESOURCES_FIELD_TYPES = {
+    "server_name": str,
+    "timestamp": datetime,
+    "unit_name": str,
+    "memory_current": int,
+    "memory_peak": int,
+    "pids": int,
+}
+
+# Metrics of individual mount points, disks and network interfaces, one row
+# per device and metric, so that hosts with more devices get more rows rather
+# than more columns.
+DEVICES_FIELD_NAMES = [
+    "server_name",
+    "timestamp",
+    "kind",
+    "device",
+    "metric",
+    "value",
+]
+
+DeviceMetric = namedtuple("DeviceMetric", DEVICES_FIELD_NAMES)
+
+DEVICES_FIELD_TYPES = {
+    "server_name": str,
+    "timestamp": datetime,
+    "kind": str,
+    "device": str,
+    "metric": str,
+}
+
+# Metrics of the agent itself, one row per metric. 'stage' names the part of
+# the agent that duration metrics describe, it is empty for the other
+# metrics. Duration metrics cover the interval since the previous rows,
+# metrics suffixed with '_total' are counted since the agent started.
+AGENT_FIELD_NAMES = [
+    "server_name",
+    "timestamp",
+    "metric",
+    "stage",
+    "value",
+]
+
+AgentMetric = namedtuple("AgentMetric", AGENT_FIELD_NAMES)
+
+AGENT_FIELD_TYPES = {
+    "server_name": str,
+    "timestamp": datetime,
+    "metric": str,
+    "stage": str,
+}
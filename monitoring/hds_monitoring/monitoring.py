@@ -1,15 +1,30 @@
+import functools
+import json
+import os
+import signal
 import time
+from collections import namedtuple
 from datetime import datetime, timedelta
-from statistics import mean
 
 import psutil as psu
 
 from hds_monitoring import (
+    alerts,
     aws,
+    cgroups,
     config,
+    exporter,
+    ingest,
+    instrumentation,
     io,
     log,
     models,
+    processes,
+    retention,
+    rollup,
+    sampler,
+    scheduler,
+    spool,
     systemd,
 )
 
@@ -17,12 +32,102 @@ LOGGER = log.get_logger(__name__)
 
 REPETITIONS = 5
 COLLECT_INTERVAL_SEC = 1
+# Seconds between the samples of a one-shot collection, kept short so that a
+# collection started by a timer exits quickly.
+ONESHOT_INTERVAL_SEC = 0.2
 SLEEP_SEC = 60
+WRITE_QUEUE_SIZE = 10
+ALERT_QUEUE_SIZE = 100
+PUSH_QUEUE_SIZE = 10
+SHUTDOWN_TIMEOUT_SEC = 10
+# The sampler buffer holds the samples of this many collection intervals, so
+# that none is lost when a collection is late.
+SAMPLER_BUFFER_INTERVALS = 2
+
+SAMPLE_STATS = ["mean", *models.SUMMARY_STATS]
+
+RATE_FIELDS = [
+    name for name in models.METRICS_FIELD_NAMES if name.endswith("_per_sec")
+]
 
 DISK_PATH = "/"
 
 LAST_S3_SYNC_TS = None
 
+ROLLUP_AGGREGATORS = rollup.make_aggregators()
+
+# Created on first use, so that the configuration is only read when the
+# agent runs.
+PROCESS_COLLECTOR = None
+
+# Created on first use, like PROCESS_COLLECTOR.
+RETENTION = None
+ALERT_ENGINE = None
+UNIT_RESOURCE_COLLECTOR = None
+
+# Latest sample, served by the metrics endpoint when it is enabled.
+SNAPSHOT = exporter.Snapshot()
+
+IoCounters = namedtuple(
+    "IoCounters",
+    [
+        "monotonic_ts",
+        "disk_read_count",
+        "disk_write_count",
+        "disk_read_bytes",
+        "disk_write_bytes",
+        "network_bytes_sent",
+        "network_bytes_received",
+        "network_errors_receiving",
+        "network_errors_sending",
+    ],
+)
+
+# Counters read at the end of the previous collection, rates are computed
+# against them so that no traffic between two collections goes unaccounted.
+LAST_IO_COUNTERS = None
+# CPU times read by the previous one-shot collection, as a dictionary, see
+# 'cpu_since_previous_run()'.
+LAST_CPU_TIMES = None
+
+DiskCounters = namedtuple(
+    "DiskCounters",
+    [
+        "monotonic_ts",
+        "read_ops_per_sec",
+        "write_ops_per_sec",
+        "read_bytes_per_sec",
+        "write_bytes_per_sec",
+    ],
+)
+
+NicCounters = namedtuple(
+    "NicCounters",
+    [
+        "monotonic_ts",
+        "bytes_sent_per_sec",
+        "bytes_received_per_sec",
+        "errors_receiving_per_sec",
+        "errors_sending_per_sec",
+    ],
+)
+
+# File of the state directory holding the counters of the previous one-shot
+# collection, see 'save_counters()'.
+COUNTERS_FILE = "counters.json"
+# File of the state directory holding the rows of the rollup buckets in
+# progress, see 'rollup.save_state()'.
+ROLLUP_STATE_FILE = "rollups.json"
+DEVICE_COUNTERS = {"disk": DiskCounters, "nic": NicCounters}
+
+# Block devices that are not tracked individually.
+IGNORED_DISK_PREFIXES = ("loop", "ram")
+
+# Counters of each disk and network interface read at the previous
+# collection, keyed by (kind, device). The fields of the counters are named
+# after the rates computed from them.
+LAST_DEVICE_COUNTERS = {}
+
 
 def get_load_avg_1_min():
     load = psu.getloadavg()
@@ -30,85 +135,299 @@ def get_load_avg_1_min():
     return load_pct[0]
 
 
-def collect_metrics(interval=COLLECT_INTERVAL_SEC, rep=REPETITIONS):
-    cpu_pct = []
-    cpu_load_pct = []
-    mem_avail = []
-    mem_pct = []
-    mem_swap_used = []
-    mem_swap_pct = []
-    disk_used = []
-    disk_used_pct = []
-    disk_read_cnt = []
-    disk_write_cnt = []
-    disk_read_bytes = []
-    disk_write_bytes = []
-    net_bytes_sent = []
-    net_bytes_recv = []
-    net_err_in = []
-    net_err_out = []
+def read_io_counters():
+    disk_io = psu.disk_io_counters()
+    net = psu.net_io_counters()
+    disk_values = (
+        (0, 0, 0, 0)
+        if disk_io is None
+        else (
+            disk_io.read_count,
+            disk_io.write_count,
+            disk_io.read_bytes,
+            disk_io.write_bytes,
+        )
+    )
+    return IoCounters(
+        time.monotonic(),
+        *disk_values,
+        net.bytes_sent,
+        net.bytes_recv,
+        net.errin,
+        net.errout,
+    )
+
+
+def io_rates(previous, current):
+    """
+    Return the per-second rate of each counter between two IoCounters.
+
+    A counter lower than its previous value has been reset (reboot, driver
+    reload, device removed), so its current value is the increase since the
+    reset.
+    """
+    elapsed = current.monotonic_ts - previous.monotonic_ts
+    rates = []
+    for prev, cur in zip(previous[1:], current[1:]):
+        delta = cur - prev if cur >= prev else cur
+        rates.append(delta / elapsed if elapsed > 0 else 0.0)
+    return rates
+
+
+def cpu_percent_between(previous, current):
+    """
+    Return the CPU utilization between two readings of psutil.cpu_times()
+    given as dictionaries, computed like psutil.cpu_percent() does: guest
+    times are already counted in user and nice times, and iowait is idle.
+    """
+
+    def busy_and_total(times):
+        total = (
+            sum(times.values())
+            - times.get("guest", 0)
+            - times.get("guest_nice", 0)
+        )
+        return total - times["idle"] - times.get("iowait", 0), total
+
+    previous_busy, previous_total = busy_and_total(previous)
+    busy, total = busy_and_total(current)
+    if total <= previous_total:
+        return 0.0
+    percent = (busy - previous_busy) / (total - previous_total) * 100
+    return min(max(percent, 0.0), 100.0)
 
+
+def cpu_since_previous_run(metrics):
+    """
+    Return 'metrics' with its CPU utilization measured since the previous
+    one-shot collection. Its distribution over the interval being unknown,
+    the summary columns hold the same value. On the first run after a boot,
+    'metrics' is returned as sampled.
+    """
+    global LAST_CPU_TIMES
+    cpu_times = psu.cpu_times()._asdict()
+    previous, LAST_CPU_TIMES = LAST_CPU_TIMES, cpu_times
+    if previous is None:
+        return metrics
+    percent = cpu_percent_between(previous, cpu_times)
+    return metrics._replace(
+        cpu_percent=percent,
+        **{f"cpu_percent_{stat}": percent for stat in models.SUMMARY_STATS},
+    )
+
+
+def read_gauges():
+    """
+    Return the current values of models.SAMPLED_FIELDS.
+    """
+    mem = psu.virtual_memory()
+    swap = psu.swap_memory()
+    disk = psu.disk_usage(DISK_PATH)
+    return (
+        psu.cpu_percent(),
+        get_load_avg_1_min(),
+        mem.available,
+        mem.percent,
+        swap.used,
+        swap.percent,
+        disk.used,
+        disk.percent,
+    )
+
+
+def make_sampler(interval, collect_interval=SLEEP_SEC):
+    # The first call measures CPU utilization since the module was loaded.
+    psu.cpu_percent()
+    capacity = int(SAMPLER_BUFFER_INTERVALS * collect_interval / interval)
+    return sampler.Sampler(
+        read_gauges, models.SAMPLED_FIELDS, interval, max(capacity, 1)
+    )
+
+
+def collect_metrics(
+    interval=COLLECT_INTERVAL_SEC, rep=REPETITIONS, gauge_sampler=None
+):
+    """
+    Return a Metrics row summarizing the gauges sampled by 'gauge_sampler'
+    since the previous call. Without a sampler, or before it took its first
+    sample, 'rep' samples are taken 'interval' seconds apart instead.
+    """
+    global LAST_IO_COUNTERS
     cpu_cnt = psu.cpu_count()
     mem_total = psu.virtual_memory().total
     swap_total = psu.swap_memory().total
     disk_total = psu.disk_usage(DISK_PATH).total
 
-    for _ in range(rep):
-        cpu_pct.append(psu.cpu_percent())
-        cpu_load_pct.append(get_load_avg_1_min())
+    if LAST_IO_COUNTERS is None:
+        LAST_IO_COUNTERS = read_io_counters()
+
+    summary = None
+    if gauge_sampler is not None:
+        summary = gauge_sampler.drain(SAMPLE_STATS)
+    if summary is None:
+        buffer = sampler.RingBuffer(models.SAMPLED_FIELDS, rep)
+        for _ in range(rep):
+            buffer.append(read_gauges())
+            time.sleep(interval)
+        summary = buffer.summary(SAMPLE_STATS)
+
+    io_counters = read_io_counters()
+    rates = io_rates(LAST_IO_COUNTERS, io_counters)
+    LAST_IO_COUNTERS = io_counters
+
+    return models.Metrics(
+        server_name=config.config["server_name"],
+        timestamp=datetime.now(),
+        cpu_count=cpu_cnt,
+        memory_total=mem_total,
+        memory_swap_total=swap_total,
+        disk_total=disk_total,
+        **{name: summary[name]["mean"] for name in models.SAMPLED_FIELDS},
+        **dict(zip(RATE_FIELDS, rates)),
+        **{
+            f"{name}_{stat}": summary[name][stat]
+            for name in models.SUMMARIZED_FIELDS
+            for stat in models.SUMMARY_STATS
+        },
+    )
 
-        mem = psu.virtual_memory()
-        mem_avail.append(mem.available)
-        mem_pct.append(mem.percent)
 
-        swap = psu.swap_memory()
-        mem_swap_used.append(swap.used)
-        mem_swap_pct.append(swap.percent)
+def read_device_counters():
+    now = time.monotonic()
+    counters = {}
+    for name, disk_io in (psu.disk_io_counters(perdisk=True) or {}).items():
+        if not name.startswith(IGNORED_DISK_PREFIXES):
+            counters[("disk", name)] = DiskCounters(
+                now,
+                disk_io.read_count,
+                disk_io.write_count,
+                disk_io.read_bytes,
+                disk_io.write_bytes,
+            )
+    for name, net in psu.net_io_counters(pernic=True).items():
+        counters[("nic", name)] = NicCounters(
+            now, net.bytes_sent, net.bytes_recv, net.errin, net.errout
+        )
+    return counters
 
-        disk = psu.disk_usage(DISK_PATH)
-        disk_used.append(disk.used)
-        disk_used_pct.append(disk.percent)
 
-        disk_io = psu.disk_io_counters()
-        disk_read_cnt.append(disk_io.read_count)
-        disk_write_cnt.append(disk_io.write_count)
-        disk_read_bytes.append(disk_io.read_bytes)
-        disk_write_bytes.append(disk_io.write_bytes)
+def mount_points():
+    if config.config["mount_points"]:
+        return config.config["mount_points"]
+    return sorted({part.mountpoint for part in psu.disk_partitions()})
 
-        net = psu.net_io_counters()
-        net_bytes_sent.append(net.bytes_sent)
-        net_bytes_recv.append(net.bytes_recv)
-        net_err_in.append(net.errin)
-        net_err_out.append(net.errout)
 
-        time.sleep(interval)
+def collect_device_metrics(server_name, timestamp):
+    """
+    Return DeviceMetric rows holding the usage of each mount point and the
+    I/O rates of each disk and network interface since the previous call.
+    Devices seen for the first time only get rates from the next call.
+    """
+    global LAST_DEVICE_COUNTERS
+    rows = []
+    for path in mount_points():
+        try:
+            usage = psu.disk_usage(path)
+        except OSError as exc:
+            LOGGER.warning(f"Failed to read usage of '{path}': {exc}")
+            continue
+        for metric, value in (
+            ("total", usage.total),
+            ("used", usage.used),
+            ("used_percent", usage.percent),
+        ):
+            rows.append(
+                models.DeviceMetric(
+                    server_name, timestamp, "mount", path, metric, value
+                )
+            )
 
-    return models.Metrics(
-        config.config["server_name"],
-        datetime.now(),
-        cpu_cnt,
-        mean(cpu_pct),
-        mean(cpu_load_pct),
-        mem_total,
-        mean(mem_avail),
-        mean(mem_pct),
-        swap_total,
-        mean(mem_swap_used),
-        mean(mem_swap_pct),
-        disk_total,
-        mean(disk_used),
-        mean(disk_used_pct),
-        mean(disk_read_cnt),
-        mean(disk_write_cnt),
-        mean(disk_read_bytes),
-        mean(disk_write_bytes),
-        mean(net_bytes_sent),
-        mean(net_bytes_recv),
-        mean(net_err_in),
-        mean(net_err_out),
+    counters = read_device_counters()
+    for (kind, device), current in counters.items():
+        previous = LAST_DEVICE_COUNTERS.get((kind, device))
+        if previous is None:
+            continue
+        for metric, value in zip(
+            current._fields[1:], io_rates(previous, current)
+        ):
+            rows.append(
+                models.DeviceMetric(
+                    server_name, timestamp, kind, device, metric, value
+                )
+            )
+    LAST_DEVICE_COUNTERS = counters
+    return rows
+
+
+def get_process_collector():
+    global PROCESS_COLLECTOR
+    if PROCESS_COLLECTOR is None and config.config["top_processes"] > 0:
+        PROCESS_COLLECTOR = processes.ProcessCollector(
+            config.config["top_processes"]
+        )
+    return PROCESS_COLLECTOR
+
+
+def get_unit_resource_collector():
+    global UNIT_RESOURCE_COLLECTOR
+    if UNIT_RESOURCE_COLLECTOR is None and config.config["unit_resources"]:
+        UNIT_RESOURCE_COLLECTOR = cgroups.UnitResourceCollector(
+            config.config["systemd_units"]
+        )
+    return UNIT_RESOURCE_COLLECTOR
+
+
+def manifest_path():
+    return os.path.join(config.config["state_dir"], "s3_manifest.json")
+
+
+def get_retention():
+    global RETENTION
+    if RETENTION is None:
+        max_mb = config.config["retention_max_mb"]
+        RETENTION = retention.Retention(
+            data_dir=config.config["data_dir"],
+            manifest_path=manifest_path(),
+            key_prefix=config.config["server_name"],
+            max_age_days=config.config["retention_days"],
+            max_bytes=max_mb * 1024 * 1024 if max_mb > 0 else None,
+        )
+    return RETENTION
+
+
+def get_alert_engine():
+    """
+    Return the AlertEngine checking the alert rules of the configuration, or
+    None if there are none.
+    """
+    global ALERT_ENGINE
+    if ALERT_ENGINE is None and config.config["alert_rules"]:
+        ALERT_ENGINE = alerts.AlertEngine(
+            [alerts.make_rule(rule) for rule in config.config["alert_rules"]],
+            config.config["alert_max_per_minute"],
+        )
+    return ALERT_ENGINE
+
+
+def make_alert_sinks():
+    return alerts.make_sinks(
+        config.config["alert_webhook_url"],
+        config.config["alert_file"],
+        config.config["alert_command"],
     )
 
 
+def check_alerts(metrics, units):
+    """
+    Return the alerts raised by a Metrics row and SystemdUnit rows.
+    """
+    engine = get_alert_engine()
+    if engine is None:
+        return []
+    with instrumentation.timed("check_alerts"):
+        return engine.check_metrics(metrics) + engine.check_units(units)
+
+
 def should_sync_to_s3():
     global LAST_S3_SYNC_TS
     LOGGER.debug(f"Last S3 sync: {LAST_S3_SYNC_TS}")
@@ -122,21 +441,392 @@ def should_sync_to_s3():
     return ret
 
 
+def make_pusher():
+    if config.config["ingest_url"] is None:
+        return None
+    return ingest.Pusher(
+        config.config["ingest_url"], config.config["ingest_token"]
+    )
+
+
+def sample(writer, gauge_sampler, agent_counters, alerter, pusher):
+    with instrumentation.timed("collect_metrics"):
+        metrics = collect_metrics(gauge_sampler=gauge_sampler)
+    with instrumentation.timed("all_active_units"):
+        units = systemd.all_active_units(config.config["systemd_units"])
+    SNAPSHOT.update(metrics, units)
+    if pusher is not None and not pusher.submit((metrics, units)):
+        LOGGER.warning(
+            f"Push queue is full, dropped sample (total {pusher.dropped})"
+        )
+    raised = check_alerts(metrics, units)
+    if raised and not alerter.submit(raised):
+        LOGGER.warning(
+            f"Alert queue is full, dropped {len(raised)} alerts "
+            f"(total {alerter.dropped})"
+        )
+    top_processes = []
+    process_collector = get_process_collector()
+    if process_collector is not None:
+        with instrumentation.timed("top_processes"):
+            top_processes = process_collector.collect(
+                metrics.server_name, metrics.timestamp
+            )
+    devices = []
+    if config.config["device_metrics"]:
+        with instrumentation.timed("device_metrics"):
+            devices = collect_device_metrics(
+                metrics.server_name, metrics.timestamp
+            )
+    unit_resources = []
+    unit_resource_collector = get_unit_resource_collector()
+    if unit_resource_collector is not None:
+        with instrumentation.timed("unit_resources"):
+            unit_resources = unit_resource_collector.collect(
+                metrics.server_name, metrics.timestamp
+            )
+    agent = instrumentation.agent_rows(
+        metrics.server_name, metrics.timestamp, agent_counters()
+    )
+    if not writer.submit(
+        (metrics, units, top_processes, devices, unit_resources, agent)
+    ):
+        LOGGER.warning(
+            f"Writer queue is full, dropped sample (total {writer.dropped})"
+        )
+
+
+def persist(item, shipper):
+    metrics, units, top_processes, devices, unit_resources, agent = item
+    with instrumentation.timed("metrics_to_csv"):
+        io.metrics_to_csv(metrics)
+    with instrumentation.timed("write_logs"):
+        for aggregator in ROLLUP_AGGREGATORS:
+            io.rollups_to_csv(aggregator.tier, *aggregator.add(metrics))
+        io.services_to_csv(*units)
+        io.processes_to_csv(*top_processes)
+        io.devices_to_csv(*devices)
+        io.unit_resources_to_csv(*unit_resources)
+        io.agent_to_csv(*agent)
+    LOGGER.info("Finished logging metrics and service statuses")
+    if should_sync_to_s3():
+        io.flush_all()
+        # A full queue means a sync is already pending, it will pick up the
+        # rows written since.
+        shipper.submit(True)
+    with instrumentation.timed("retention"):
+        get_retention().maybe_run(io.open_paths())
+
+
+def alert_counters():
+    engine = get_alert_engine()
+    if engine is None:
+        return {}
+    return {
+        "alerts_raised_total": engine.fired,
+        "alerts_rate_limited_total": engine.dropped,
+    }
+
+
+def make_uploader():
+    return aws.Uploader(
+        spool.Spool(os.path.join(config.config["state_dir"], "spool"))
+    )
+
+
+def ship(_, uploader):
+    with instrumentation.timed("copy_folder_to_s3"):
+        aws.copy_folder_to_s3(
+            folder=config.config["data_dir"],
+            bucket=config.config["s3_bucket"],
+            key_prefix=config.config["server_name"],
+            manifest_path=manifest_path(),
+            uploader=uploader,
+        )
+    LOGGER.info("Finished syncing logs to S3")
+
+
 def monitor(interval=SLEEP_SEC):
+    """
+    Run the agent as a pipeline of three stages joined by bounded queues.
+
+    Sampling runs in the calling thread and ticks at a fixed rate. Rows are
+    persisted by a writer thread, which hands S3 syncs to a shipper thread, so
+    a slow disk or a slow upload never delays the next sample.
+    """
     LOGGER.debug("Entering monitoring loop")
-    while True:
-        metrics = collect_metrics()
+    rollup_state_path = os.path.join(
+        config.config["state_dir"], ROLLUP_STATE_FILE
+    )
+    rollup.load_state(rollup_state_path, ROLLUP_AGGREGATORS)
+    # The state is written again when the agent stops. Left in place, it
+    # would make an agent restarted after a crash summarize the buckets it
+    # holds a second time.
+    try:
+        os.remove(rollup_state_path)
+    except FileNotFoundError:
+        pass
+    ticker = scheduler.Ticker(interval)
+    signal.signal(signal.SIGTERM, lambda signum, frame: ticker.stop())
+
+    uploader = make_uploader()
+    shipper = scheduler.Stage(
+        "shipper", functools.partial(ship, uploader=uploader), maxsize=1
+    )
+    writer = scheduler.Stage(
+        "writer",
+        functools.partial(persist, shipper=shipper),
+        maxsize=WRITE_QUEUE_SIZE,
+    )
+    gauge_sampler = make_sampler(config.config["sample_interval"], interval)
+    alerter = None
+    if get_alert_engine() is not None:
+        alerter = scheduler.Stage(
+            "alerter",
+            functools.partial(alerts.send, sinks=make_alert_sinks()),
+            maxsize=ALERT_QUEUE_SIZE,
+        )
+        alerter.start()
+    pusher = make_pusher()
+    if pusher is not None:
+        pusher = scheduler.Stage(
+            "pusher", pusher.push, maxsize=PUSH_QUEUE_SIZE
+        )
+        pusher.start()
+    shipper.start()
+    writer.start()
+    gauge_sampler.start()
+
+    def agent_counters():
+        upload_stats = uploader.stats()
+        return {
+            "ticks_late_total": ticker.late_ticks,
+            "ticks_missed_total": ticker.missed_ticks,
+            "samples_dropped_total": writer.dropped,
+            "syncs_dropped_total": shipper.dropped,
+            "sampler_cpu_percent": gauge_sampler.cost_percent(),
+            "s3_queue_depth": upload_stats["queue_depth"],
+            "s3_bytes_uploaded_total": upload_stats["bytes_uploaded"],
+            "s3_upload_sec_total": upload_stats["upload_sec"],
+            "s3_failures_total": upload_stats["failures"],
+            **alert_counters(),
+        }
+
+    server = None
+    if config.config["exporter_port"] is not None:
+        server = exporter.MetricsServer(
+            SNAPSHOT,
+            config.config["exporter_address"],
+            config.config["exporter_port"],
+        )
+        server.start()
+
+    try:
+        while ticker.wait():
+            start = time.monotonic()
+            try:
+                sample(writer, gauge_sampler, agent_counters, alerter, pusher)
+            except Exception:
+                LOGGER.exception("Failed to collect sample")
+            elapsed = time.monotonic() - start
+            instrumentation.observe("cycle", elapsed)
+            if elapsed > interval:
+                instrumentation.observe("cycle_overrun", elapsed - interval)
+            LOGGER.debug(
+                f"Ticks: {ticker.ticks}, late: {ticker.late_ticks}, "
+                f"missed: {ticker.missed_ticks}"
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        LOGGER.info("Stopping monitoring loop")
+        gauge_sampler.stop()
+        if server is not None:
+            server.stop()
+        if alerter is not None:
+            alerter.stop(SHUTDOWN_TIMEOUT_SEC)
+        if pusher is not None:
+            pusher.stop(SHUTDOWN_TIMEOUT_SEC)
+        writer.stop(SHUTDOWN_TIMEOUT_SEC)
+        if writer.is_alive():
+            # The writer may still be writing rows through the appenders.
+            LOGGER.warning("Writer did not stop, log files are left open")
+        else:
+            rollup.save_state(rollup_state_path, ROLLUP_AGGREGATORS)
+            io.close_all()
+        shipper.stop(SHUTDOWN_TIMEOUT_SEC)
+
+
+def save_counters(path, process_collector, unit_resource_collector):
+    """
+    Write the I/O counters and the counters of devices, processes and units
+    read by the last collection to 'path', so that agents collecting one
+    sample per run compute rates since the previous run.
+    """
+    data = {
+        "boot_time": psu.boot_time(),
+        "io": LAST_IO_COUNTERS,
+        "cpu_times": LAST_CPU_TIMES,
+        "devices": [
+            [kind, device, counters]
+            for (kind, device), counters in LAST_DEVICE_COUNTERS.items()
+        ],
+        "processes": (
+            []
+            if process_collector is None
+            else [
+                [pid, create_time, counters]
+                for (pid, create_time), counters in (
+                    process_collector.counters.items()
+                )
+            ]
+        ),
+        "units": (
+            []
+            if unit_resource_collector is None
+            else [
+                [unit_name, inode, counters]
+                for (unit_name, inode), counters in (
+                    unit_resource_collector.counters.items()
+                )
+            ]
+        ),
+    }
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(tmp_path, "w") as fo:
+        json.dump(data, fo)
+    os.replace(tmp_path, path)
+
+
+def load_counters(path, process_collector, unit_resource_collector):
+    """
+    Restore the counters written by 'save_counters()'. Return False if there
+    are none, or if they were read before the last boot, since counters and
+    the monotonic clock start again from 0 at boot.
+    """
+    global LAST_IO_COUNTERS, LAST_CPU_TIMES, LAST_DEVICE_COUNTERS
+    try:
+        with open(path) as fi:
+            data = json.load(fi)
+    except FileNotFoundError:
+        return False
+    except ValueError:
+        LOGGER.warning(f"Ignoring corrupted counters '{path}'")
+        return False
+    if data["boot_time"] != psu.boot_time() or data["io"] is None:
+        return False
+    LAST_IO_COUNTERS = IoCounters(*data["io"])
+    # Counters written by agents that did not keep CPU times have none.
+    LAST_CPU_TIMES = data.get("cpu_times")
+    LAST_DEVICE_COUNTERS = {
+        (kind, device): DEVICE_COUNTERS[kind](*counters)
+        for kind, device, counters in data["devices"]
+    }
+    if process_collector is not None:
+        process_collector.counters = {
+            (pid, create_time): processes.ProcessCounters(*counters)
+            for pid, create_time, counters in data["processes"]
+        }
+    if unit_resource_collector is not None:
+        unit_resource_collector.counters = {
+            (unit_name, inode): cgroups.UnitCounters(*counters)
+            for unit_name, inode, counters in data["units"]
+        }
+    return True
+
+
+def collect_once(interval=ONESHOT_INTERVAL_SEC):
+    """
+    Collect and write a single sample, for agents started by a timer rather
+    than running continuously.
+
+    Rates, CPU utilization and the usage of processes and units are measured
+    since the previous run, whose counters are kept in the state directory.
+    On the first run after a boot, they are measured over the 'interval'
+    seconds between the first and the last of the REPETITIONS samples.
+    Rollup buckets in progress are kept in the state directory too, a Rollup
+    row is written by the first run of a later bucket.
+    """
+    global LAST_DEVICE_COUNTERS
+    state_dir = config.config["state_dir"]
+    process_collector = get_process_collector()
+    unit_resource_collector = get_unit_resource_collector()
+    counters_path = os.path.join(state_dir, COUNTERS_FILE)
+    if not load_counters(
+        counters_path, process_collector, unit_resource_collector
+    ):
+        if process_collector is not None:
+            process_collector.sample()
+        if unit_resource_collector is not None:
+            unit_resource_collector.sample()
+        if config.config["device_metrics"]:
+            LAST_DEVICE_COUNTERS = read_device_counters()
+    psu.cpu_percent()
+    with instrumentation.timed("collect_metrics"):
+        metrics = collect_metrics(
+            interval=interval / REPETITIONS, rep=REPETITIONS
+        )
+    metrics = cpu_since_previous_run(metrics)
+    with instrumentation.timed("all_active_units"):
+        units = systemd.all_active_units(config.config["systemd_units"])
+    pusher = make_pusher()
+    if pusher is not None:
+        pusher.push((metrics, units))
+    engine = get_alert_engine()
+    if engine is not None:
+        # Rules keep their state between runs in the state directory.
+        state_path = os.path.join(state_dir, "alerts.json")
+        engine.load(state_path)
+        alerts.send(check_alerts(metrics, units), make_alert_sinks())
+        engine.save(state_path)
+    try:
         io.metrics_to_csv(metrics)
-        active_units = systemd.all_active_units(config.config["systemd_units"])
-        for unit in active_units:
-            io.services_to_csv(unit)
-        LOGGER.info("Finished logging metrics and service statuses")
-        if should_sync_to_s3():
-            aws.copy_folder_to_s3(
-                folder=config.config["data_dir"],
-                bucket=config.config["s3_bucket"],
-                key_prefix=config.config["server_name"],
+        rollup_state_path = os.path.join(state_dir, ROLLUP_STATE_FILE)
+        rollup.load_state(rollup_state_path, ROLLUP_AGGREGATORS)
+        for aggregator in ROLLUP_AGGREGATORS:
+            io.rollups_to_csv(aggregator.tier, *aggregator.add(metrics))
+        rollup.save_state(rollup_state_path, ROLLUP_AGGREGATORS)
+        io.services_to_csv(*units)
+        if process_collector is not None:
+            with instrumentation.timed("top_processes"):
+                io.processes_to_csv(
+                    *process_collector.collect(
+                        metrics.server_name, metrics.timestamp
+                    )
+                )
+        if config.config["device_metrics"]:
+            with instrumentation.timed("device_metrics"):
+                io.devices_to_csv(
+                    *collect_device_metrics(
+                        metrics.server_name, metrics.timestamp
+                    )
+                )
+        if unit_resource_collector is not None:
+            with instrumentation.timed("unit_resources"):
+                io.unit_resources_to_csv(
+                    *unit_resource_collector.collect(
+                        metrics.server_name, metrics.timestamp
+                    )
+                )
+        io.agent_to_csv(
+            *instrumentation.agent_rows(
+                metrics.server_name, metrics.timestamp, alert_counters()
             )
-            LOGGER.info("Finished syncing logs to S3")
-        io.cleanup_logs()
-        time.sleep(interval)
+        )
+    finally:
+        io.close_all()
+    save_counters(counters_path, process_collector, unit_resource_collector)
+    LOGGER.info("Finished logging metrics and service statuses")
+
+
+def sync_once():
+    """
+    Sync the logs to S3 once, and retry the uploads left in the spool by
+    previous runs.
+    """
+    ship(None, make_uploader())
+
+
+def cleanup_once():
+    get_retention().run()
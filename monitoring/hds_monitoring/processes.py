@@ -0,0 +1,154 @@
+import heapq
+import pwd
+import time
+from collections import namedtuple
+
+import psutil as psu
+
+from hds_monitoring import log, models
+
+LOGGER = log.get_logger(__name__)
+
+# Only these attributes are read. 'process_iter()' reads them within
+# 'oneshot()', so that each process costs a few system calls, and reuses the
+# Process objects of the previous call for PIDs that are still alive.
+ATTRS = [
+    "pid",
+    "name",
+    "uids",
+    "create_time",
+    "cpu_times",
+    "memory_info",
+    "io_counters",
+    "num_threads",
+]
+
+ProcessCounters = namedtuple(
+    "ProcessCounters", ["monotonic_ts", "cpu_sec", "read_bytes", "write_bytes"]
+)
+
+ProcessSample = namedtuple(
+    "ProcessSample",
+    ["info", "rss", "cpu_percent", "read_rate", "write_rate"],
+)
+
+RANKING_KEYS = [
+    lambda sample: sample.cpu_percent,
+    lambda sample: sample.rss,
+    lambda sample: sample.read_rate + sample.write_rate,
+]
+
+
+class ProcessCollector:
+    """
+    Records the 'top_n' processes by CPU, by resident memory and by I/O.
+
+    CPU and I/O are rates computed against the counters read at the previous
+    collection, which are kept per process between calls, so no process is
+    sampled twice in a cycle and no sleep is needed. Processes are only
+    ranked with heaps and user names are cached per UID, so a cycle costs
+    one pass over the process table and O(P log N) for P processes.
+    """
+
+    def __init__(self, top_n):
+        self.top_n = top_n
+        # Previous counters of each process, keyed by PID and creation time
+        # so that a reused PID does not inherit the counters of a dead
+        # process.
+        self.counters = {}
+        self.usernames = {}
+
+    def username(self, uids):
+        if uids is None:
+            return ""
+        uid = uids.real
+        if uid not in self.usernames:
+            try:
+                self.usernames[uid] = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                self.usernames[uid] = str(uid)
+        return self.usernames[uid]
+
+    def sample(self):
+        """
+        Return a ProcessSample for each process that was already running at
+        the previous call, 'info' being the dictionary of ATTRS.
+        """
+        counters = {}
+        samples = []
+        for proc in psu.process_iter(ATTRS, ad_value=None):
+            info = proc.info
+            cpu_times = info["cpu_times"]
+            io = info["io_counters"]
+            current = ProcessCounters(
+                time.monotonic(),
+                (
+                    0.0
+                    if cpu_times is None
+                    else cpu_times.user + cpu_times.system
+                ),
+                0 if io is None else io.read_bytes,
+                0 if io is None else io.write_bytes,
+            )
+            key = (info["pid"], info["create_time"])
+            counters[key] = current
+            previous = self.counters.get(key)
+            if previous is None:
+                # Rates need two readings, new processes are ranked from the
+                # next cycle.
+                continue
+            elapsed = current.monotonic_ts - previous.monotonic_ts
+            if elapsed <= 0:
+                continue
+            samples.append(
+                ProcessSample(
+                    info,
+                    (
+                        0
+                        if info["memory_info"] is None
+                        else info["memory_info"].rss
+                    ),
+                    (current.cpu_sec - previous.cpu_sec) / elapsed * 100,
+                    max(current.read_bytes - previous.read_bytes, 0) / elapsed,
+                    max(current.write_bytes - previous.write_bytes, 0)
+                    / elapsed,
+                )
+            )
+        # Replacing the dictionary drops the counters of dead processes.
+        self.counters = counters
+        return samples
+
+    def collect(self, server_name, timestamp):
+        """
+        Return the Process rows of the union of the top processes by CPU, by
+        resident memory and by I/O, highest CPU first.
+        """
+        start = time.monotonic()
+        samples = self.sample()
+        top = {}
+        for key in RANKING_KEYS:
+            for sample in heapq.nlargest(self.top_n, samples, key=key):
+                top[sample.info["pid"]] = sample
+        memory_total = psu.virtual_memory().total
+        rows = [
+            models.Process(
+                server_name,
+                timestamp,
+                sample.info["pid"],
+                sample.info["name"] or "",
+                self.username(sample.info["uids"]),
+                sample.cpu_percent,
+                sample.rss,
+                sample.rss / memory_total * 100,
+                sample.read_rate,
+                sample.write_rate,
+                sample.info["num_threads"] or 0,
+            )
+            for sample in top.values()
+        ]
+        rows.sort(key=lambda row: row.cpu_percent, reverse=True)
+        LOGGER.debug(
+            f"Ranked {len(self.counters)} processes in "
+            f"{time.monotonic() - start:.3f} s"
+        )
+        return rows
@@ -0,0 +1,222 @@
+import gzip
+import os
+import shutil
+import time
+from datetime import date, datetime, timedelta
+
+from hds_monitoring import binary, log, rollup, settings
+from hds_monitoring.manifest import load_manifest
+
+LOGGER = log.get_logger(__name__)
+
+# Sub-directory of the data directory holding compressed logs. The S3 sync
+# ignores sub-directories, so archives are not uploaded again.
+ARCHIVE_DIR = "archive"
+ARCHIVE_EXT = ".gz"
+# Minimum seconds between two runs triggered by the size quota, when logs
+# over quota cannot be evicted yet because they are logs of the current day.
+# Eviction does not wait for logs to be shipped, a disk filling up while S3
+# is unreachable would stop the agent.
+QUOTA_CHECK_INTERVAL_SEC = 300
+ROLLUP_PREFIXES = tuple(f"metrics-{tier}_" for tier in rollup.TIERS)
+
+
+def log_date(name):
+    """
+    Return the date of a log file named '<prefix>_<date><ext>[.gz]', or None
+    if the name does not follow this pattern.
+    """
+    stem = name.removesuffix(ARCHIVE_EXT)
+    stem = os.path.splitext(stem)[0]
+    _, sep, date_str = stem.rpartition("_")
+    if not sep:
+        return None
+    try:
+        return datetime.strptime(date_str, settings.DATE_FORMAT).date()
+    except ValueError:
+        return None
+
+
+def is_shipped(path, manifest, key):
+    """
+    Return True if the manifest shows that the current content of the file
+    was synced to S3.
+    """
+    entry = manifest.get(key)
+    if entry is None:
+        return False
+    stat = os.stat(path)
+    return (entry["size"], entry["mtime"]) == (stat.st_size, stat.st_mtime_ns)
+
+
+def archive_file(path, archive_dir):
+    """
+    Move a log file to 'archive_dir', compressing it unless it is a binary
+    log, which is already compressed. Return the path of the archive.
+    """
+    name = os.path.basename(path)
+    if name.endswith(binary.FILE_EXT):
+        archive_path = os.path.join(archive_dir, name)
+        os.replace(path, archive_path)
+        return archive_path
+    archive_path = os.path.join(archive_dir, name + ARCHIVE_EXT)
+    tmp_path = f"{archive_path}.tmp"
+    with open(path, "rb") as fi:
+        with gzip.open(tmp_path, "wb", compresslevel=6) as fo:
+            shutil.copyfileobj(fi, fo)
+    os.replace(tmp_path, archive_path)
+    os.remove(path)
+    return archive_path
+
+
+class Retention:
+    """
+    Keeps the logs of the data directory within an age and a size quota.
+
+    Logs of closed days are compressed into the archive directory once they
+    are shipped to S3, then logs are evicted, oldest first, when their date
+    is more than 'max_age_days' days ago or while the logs and archives
+    together take more than 'max_bytes' bytes. Under the size quota, raw
+    metrics, service statuses, etc. are evicted before rollups, so a small
+    disk keeps a long history of rollups.
+
+    Logs still open by appenders are never compacted or evicted. Listing
+    the data directory is only done by 'run()', which 'maybe_run()' calls at
+    day boundaries and when the open logs take the usage over quota.
+    """
+
+    def __init__(
+        self, data_dir, manifest_path, key_prefix, max_age_days, max_bytes
+    ):
+        self.data_dir = data_dir
+        self.archive_dir = os.path.join(data_dir, ARCHIVE_DIR)
+        self.manifest_path = manifest_path
+        self.key_prefix = key_prefix.rstrip("/")
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.last_day = None
+        self.last_run_ts = None
+        # Bytes taken by logs that were not open at the last run.
+        self.closed_bytes = 0
+
+    def list_logs(self, open_paths):
+        """
+        Return (path, size, date, archived) tuples describing the logs that
+        are not open, and the total size of the open logs.
+        """
+        logs = []
+        open_bytes = 0
+        for directory, archived in (
+            (self.data_dir, False),
+            (self.archive_dir, True),
+        ):
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                size = entry.stat().st_size
+                if entry.path in open_paths:
+                    open_bytes += size
+                    continue
+                day = log_date(entry.name)
+                if day is None:
+                    day = datetime.fromtimestamp(entry.stat().st_mtime).date()
+                logs.append((entry.path, size, day, archived))
+        return logs, open_bytes
+
+    def compact(self, logs, today):
+        """
+        Archive the logs of closed days that are shipped to S3, and return
+        the updated list of logs.
+        """
+        manifest = load_manifest(self.manifest_path)
+        compacted = []
+        for path, size, day, archived in logs:
+            name = os.path.basename(path)
+            if (
+                not archived
+                and day < today
+                and is_shipped(path, manifest, f"{self.key_prefix}/{name}")
+            ):
+                os.makedirs(self.archive_dir, exist_ok=True)
+                try:
+                    archive_path = archive_file(path, self.archive_dir)
+                except OSError as exc:
+                    LOGGER.warning(f"Failed to archive '{path}': {exc}")
+                else:
+                    archive_size = os.path.getsize(archive_path)
+                    LOGGER.debug(
+                        f"Archived '{name}', {size} to {archive_size} bytes"
+                    )
+                    compacted.append((archive_path, archive_size, day, True))
+                    continue
+            compacted.append((path, size, day, archived))
+        return compacted
+
+    def evict(self, logs, open_bytes, today):
+        """
+        Delete the logs over the age and size quotas, and return the size of
+        the logs left.
+        """
+        oldest_day = today - timedelta(days=self.max_age_days)
+        total = open_bytes + sum(size for _, size, _, _ in logs)
+        # Oldest first, raw logs before rollups.
+        logs = sorted(
+            logs,
+            key=lambda log: (
+                os.path.basename(log[0]).startswith(ROLLUP_PREFIXES),
+                log[2],
+            ),
+        )
+        kept = 0
+        for path, size, day, _ in logs:
+            over_quota = self.max_bytes is not None and total > self.max_bytes
+            if day < oldest_day or (over_quota and day < today):
+                LOGGER.info(f"Deleting '{path}' ({day}, {size} bytes)")
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            else:
+                kept += size
+        return kept
+
+    def run(self, open_paths=(), today=None):
+        today = today or date.today()
+        logs, open_bytes = self.list_logs(set(open_paths))
+        logs = self.compact(logs, today)
+        self.closed_bytes = self.evict(logs, open_bytes, today)
+        total = self.closed_bytes + open_bytes
+        if self.max_bytes is not None and total > self.max_bytes:
+            LOGGER.warning(
+                f"Logs take {total} bytes, over the quota of {self.max_bytes} "
+                "bytes, the logs left being those of the current day"
+            )
+        self.last_day = today
+        self.last_run_ts = time.monotonic()
+
+    def maybe_run(self, open_paths, today=None):
+        """
+        Call 'run()' on the first call of a day, or when the logs take more
+        than the size quota. Only the open logs are checked on other calls.
+        """
+        today = today or date.today()
+        if today != self.last_day:
+            self.run(open_paths, today)
+            return
+        if self.max_bytes is None:
+            return
+        if time.monotonic() - self.last_run_ts < QUOTA_CHECK_INTERVAL_SEC:
+            return
+        open_bytes = 0
+        for path in open_paths:
+            try:
+                open_bytes += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        if self.closed_bytes + open_bytes > self.max_bytes:
+            self.run(open_paths, today)
@@ -0,0 +1,143 @@
+import json
+import logging
+import math
+import os
+from datetime import datetime, timedelta
+
+from hds_monitoring import models
+
+# Rollup tiers and the length of their buckets in seconds. Rows of a tier are
+# stored in the stream 'metrics-<tier>', raw metrics being the 1 minute tier.
+TIERS = {
+    "5m": 300,
+    "1h": 3600,
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+LOGGER = logging.getLogger(__name__)
+
+
+def percentile(sorted_values, q):
+    """
+    Return the q-th quantile (0 <= q <= 1) of sorted values, interpolating
+    linearly between the closest ranks.
+    """
+    pos = (len(sorted_values) - 1) * q
+    low = math.floor(pos)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (
+        pos - low
+    )
+
+
+def summarize(server_name, timestamp, rows):
+    """
+    Return the Rollup row summarizing Metrics rows, timestamped with the
+    start of their bucket.
+    """
+    values = []
+    for name in models.ROLLUP_SOURCE_FIELDS:
+        column = sorted(getattr(row, name) for row in rows)
+        values.extend(
+            [
+                column[0],
+                column[-1],
+                sum(column) / len(column),
+                percentile(column, 0.95),
+            ]
+        )
+    return models.Rollup(server_name, timestamp, len(rows), *values)
+
+
+class RollupAggregator:
+    """
+    Groups Metrics rows into buckets of 'seconds' seconds aligned on the local
+    wall clock, and summarizes each bucket once a row from a later bucket
+    comes in.
+
+    Rows of a bucket are kept in memory until the bucket is complete, which
+    costs at most one hour of rows. They are written to the state directory by
+    'save_state()' when the agent stops, or after each run of a one-shot
+    collection, so that a bucket spanning a restart is summarized once.
+    """
+
+    def __init__(self, tier, seconds):
+        self.tier = tier
+        self.seconds = seconds
+        self.bucket_start = None
+        self.rows = []
+
+    def bucket(self, timestamp):
+        elapsed = (timestamp - EPOCH) // timedelta(seconds=1)
+        return EPOCH + timedelta(seconds=elapsed - elapsed % self.seconds)
+
+    def add(self, row):
+        """
+        Add a Metrics row, return the Rollup rows of the buckets it completed.
+        """
+        completed = []
+        bucket_start = self.bucket(row.timestamp)
+        if bucket_start != self.bucket_start:
+            if self.rows:
+                completed.append(
+                    summarize(row.server_name, self.bucket_start, self.rows)
+                )
+            self.bucket_start = bucket_start
+            self.rows = []
+        self.rows.append(row)
+        return completed
+
+
+def make_aggregators():
+    return [RollupAggregator(tier, seconds) for tier, seconds in TIERS.items()]
+
+
+def save_state(path, aggregators):
+    """
+    Write the rows of the buckets in progress to 'path'.
+    """
+    data = {
+        "fields": models.METRICS_FIELD_NAMES,
+        "tiers": {
+            aggregator.tier: [
+                list(row._replace(timestamp=row.timestamp.isoformat()))
+                for row in aggregator.rows
+            ]
+            for aggregator in aggregators
+        },
+    }
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(tmp_path, "w") as fo:
+        json.dump(data, fo)
+    os.replace(tmp_path, path)
+
+
+def load_state(path, aggregators):
+    """
+    Restore the buckets in progress written by 'save_state()'. Rows written
+    by an agent with another layout of Metrics are ignored.
+    """
+    try:
+        with open(path) as fi:
+            data = json.load(fi)
+    except FileNotFoundError:
+        return
+    except ValueError:
+        LOGGER.warning(f"Ignoring corrupted rollup state '{path}'")
+        return
+    if data["fields"] != models.METRICS_FIELD_NAMES:
+        LOGGER.warning(f"Ignoring rollup state of another layout '{path}'")
+        return
+    for aggregator in aggregators:
+        rows = [
+            models.Metrics(*row)._replace(
+                timestamp=datetime.fromisoformat(row[1])
+            )
+            for row in data["tiers"].get(aggregator.tier, [])
+        ]
+        aggregator.rows = rows
+        aggregator.bucket_start = (
+            aggregator.bucket(rows[0].timestamp) if rows else None
+        )
@@ -0,0 +1,124 @@
+import threading
+import time
+from array import array
+
+from hds_monitoring import log, rollup, scheduler
+
+LOGGER = log.get_logger(__name__)
+
+STAT_QUANTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer of samples, each sample being a tuple of floats, one
+    per field. Values are stored in one preallocated array per field, so
+    appending does not allocate memory. Once full, the oldest samples are
+    overwritten.
+    """
+
+    def __init__(self, fields, capacity):
+        self.fields = fields
+        self.capacity = capacity
+        self.columns = [array("d", bytes(8 * capacity)) for _ in fields]
+        self.next_index = 0
+        self.count = 0
+
+    def append(self, values):
+        for column, value in zip(self.columns, values):
+            column[self.next_index] = value
+        self.next_index = (self.next_index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def clear(self):
+        self.count = 0
+
+    def values(self, field_index):
+        """
+        Return the values of a field, oldest first.
+        """
+        column = self.columns[field_index]
+        start = (self.next_index - self.count) % self.capacity
+        if start + self.count <= self.capacity:
+            return column[start : start + self.count].tolist()
+        return (column[start:] + column[: self.next_index]).tolist()
+
+    def summary(self, stats):
+        """
+        Return a dictionary mapping each field to a dictionary mapping the
+        statistics 'stats' to their values over the buffered samples. Stats
+        are "mean", "min", "max" and the quantiles of STAT_QUANTILES.
+        """
+        summary = {}
+        for index, field in enumerate(self.fields):
+            values = sorted(self.values(index))
+            field_summary = {}
+            for stat in stats:
+                if stat == "mean":
+                    field_summary[stat] = sum(values) / len(values)
+                elif stat == "min":
+                    field_summary[stat] = values[0]
+                elif stat == "max":
+                    field_summary[stat] = values[-1]
+                else:
+                    field_summary[stat] = rollup.percentile(
+                        values, STAT_QUANTILES[stat]
+                    )
+            summary[field] = field_summary
+        return summary
+
+
+class Sampler(threading.Thread):
+    """
+    Calls 'read' every 'interval' seconds and stores the samples it returns
+    in a RingBuffer, until they are summarized and cleared by 'drain()'.
+
+    The CPU time the thread spends reading and storing samples is measured,
+    'cost_percent()' gives it as a percentage of the wall clock time since
+    the thread started.
+    """
+
+    def __init__(self, read, fields, interval, capacity):
+        super().__init__(name="sampler", daemon=True)
+        self.read = read
+        self.buffer = RingBuffer(fields, capacity)
+        self.lock = threading.Lock()
+        self.ticker = scheduler.Ticker(interval)
+        self.cpu_sec = 0.0
+        self.started_at = None
+        self.samples = 0
+
+    def run(self):
+        self.started_at = time.monotonic()
+        while self.ticker.wait():
+            start = time.thread_time()
+            try:
+                values = self.read()
+            except Exception:
+                LOGGER.exception("Failed to read sample")
+                continue
+            with self.lock:
+                self.buffer.append(values)
+                self.samples += 1
+            self.cpu_sec += time.thread_time() - start
+
+    def stop(self):
+        self.ticker.stop()
+
+    def drain(self, stats):
+        """
+        Return the summary of the samples taken since the previous call, see
+        'RingBuffer.summary()', or None if there are none.
+        """
+        with self.lock:
+            if self.buffer.count == 0:
+                return None
+            summary = self.buffer.summary(stats)
+            self.buffer.clear()
+        return summary
+
+    def cost_percent(self):
+        if self.started_at is None:
+            return 0.0
+        elapsed = time.monotonic() - self.started_at
+        return self.cpu_sec / elapsed * 100 if elapsed > 0 else 0.0
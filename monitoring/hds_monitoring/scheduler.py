@@ -0,0 +1,142 @@
+import queue
+import threading
+import time
+
+from hds_monitoring import log
+
+LOGGER = log.get_logger(__name__)
+
+LATE_TOLERANCE_SEC = 1
+
+# Sentinel put in a stage queue to make its thread exit.
+STOP = object()
+
+
+class Ticker:
+    """
+    Fires at a fixed rate measured on the monotonic clock.
+
+    Deadlines are derived from the previous deadline rather than from the time
+    the previous tick was handled, so the time spent handling ticks does not
+    accumulate as drift. A tick that fires more than 'tolerance' seconds after
+    its deadline is counted as late. When handling a tick takes longer than a
+    whole interval, the deadlines that went by are counted as missed and
+    skipped instead of being fired in a burst.
+    """
+
+    def __init__(
+        self,
+        interval,
+        stop_event=None,
+        tolerance=LATE_TOLERANCE_SEC,
+        clock=time.monotonic,
+    ):
+        self.interval = interval
+        self.stop_event = stop_event or threading.Event()
+        self.tolerance = tolerance
+        self.clock = clock
+        self.next_deadline = None
+        self.ticks = 0
+        self.late_ticks = 0
+        self.missed_ticks = 0
+
+    def wait(self):
+        """
+        Block until the next tick, return False if the ticker was stopped.
+        """
+        now = self.clock()
+        if self.next_deadline is None:
+            self.next_deadline = now
+        else:
+            self.next_deadline += self.interval
+
+        lateness = now - self.next_deadline
+        if lateness > 0:
+            missed = int(lateness // self.interval)
+            if missed:
+                self.missed_ticks += missed
+                self.next_deadline += missed * self.interval
+                lateness -= missed * self.interval
+                LOGGER.warning(
+                    f"Missed {missed} ticks (total {self.missed_ticks})"
+                )
+            if lateness > self.tolerance:
+                self.late_ticks += 1
+                LOGGER.warning(
+                    f"Tick is {lateness:.3f} s late (total {self.late_ticks})"
+                )
+        elif self.stop_event.wait(-lateness):
+            return False
+
+        self.ticks += 1
+        return not self.stop_event.is_set()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class Stage(threading.Thread):
+    """
+    Worker thread that applies 'handler' to items taken from a bounded queue.
+
+    Producers call 'submit()', which never blocks: when the queue is full, the
+    item is dropped and counted, so a slow stage cannot hold up the stages
+    that feed it. Exceptions raised by the handler are logged and do not stop
+    the thread.
+    """
+
+    def __init__(self, name, handler, maxsize):
+        super().__init__(name=name, daemon=True)
+        self.handler = handler
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.stop_event = threading.Event()
+        self.processed = 0
+        self.dropped = 0
+
+    def submit(self, item):
+        """
+        Enqueue an item without blocking, return False if it was dropped.
+        """
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def stop(self, timeout=None):
+        """
+        Let the stage process the items already queued, then stop it.
+
+        Waits at most 'timeout' seconds in total. If the queue is still full
+        when the timeout expires, the items left in it are abandoned and the
+        thread exits once the item being processed is done. Callers check
+        'is_alive()' to know whether the thread stopped in time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            self.queue.put(STOP, timeout=timeout)
+        except queue.Full:
+            LOGGER.warning(
+                f"Stage '{self.name}' did not catch up within {timeout} s, "
+                f"abandoning {self.queue.qsize()} queued items"
+            )
+            self.stop_event.set()
+            try:
+                self.queue.put_nowait(STOP)
+            except queue.Full:
+                pass
+        if deadline is not None:
+            timeout = max(0, deadline - time.monotonic())
+        self.join(timeout)
+
+    def run(self):
+        while (
+            not self.stop_event.is_set()
+            and (item := self.queue.get()) is not STOP
+        ):
+            try:
+                self.handler(item)
+            except Exception:
+                LOGGER.exception(f"Stage '{self.name}' failed")
+            self.processed += 1
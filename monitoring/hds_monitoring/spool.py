@@ -0,0 +1,101 @@
+import json
+import os
+
+from hds_monitoring import log
+
+LOGGER = log.get_logger(__name__)
+
+
+class Spool:
+    """
+    Durable queue of pending S3 operations stored in a directory.
+
+    Each entry is a JSON file named after its sequence number, and the bytes
+    to upload, if any, are stored in a data file next to it. The data file is
+    written first and the JSON file is renamed into place, so after a crash an
+    entry is either complete or absent.
+
+    Entries carry the key of the file they belong to ('file_key'), so that
+    operations on the same file can be applied in order.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        seqs = [-1]
+        for name in os.listdir(directory):
+            stem, ext = os.path.splitext(name)
+            if ext == ".json":
+                seqs.append(int(stem))
+            elif not os.path.exists(self.path(stem, ".json")):
+                # Data of an entry that was never committed or already
+                # removed, or a temporary file.
+                os.remove(os.path.join(directory, name))
+        self.next_seq = max(seqs) + 1
+
+    def path(self, seq, ext):
+        return os.path.join(self.directory, f"{int(seq):012d}{ext}")
+
+    def add(self, op, bucket, file_key, data=None, **params):
+        seq = self.next_seq
+        self.next_seq += 1
+        if data is not None:
+            with open(self.path(seq, ".data"), "wb") as fo:
+                fo.write(data)
+                fo.flush()
+                os.fsync(fo.fileno())
+        entry = {
+            "seq": seq,
+            "op": op,
+            "bucket": bucket,
+            "file_key": file_key,
+            **params,
+        }
+        tmp_path = self.path(seq, ".tmp")
+        with open(tmp_path, "w") as fo:
+            json.dump(entry, fo)
+            fo.flush()
+            os.fsync(fo.fileno())
+        os.replace(tmp_path, self.path(seq, ".json"))
+        return entry
+
+    def put(self, bucket, key, data, file_key):
+        return self.add("put", bucket, file_key, data=data, key=key)
+
+    def delete(self, bucket, keys, file_key):
+        return self.add("delete", bucket, file_key, keys=keys)
+
+    def data_path(self, entry):
+        return self.path(entry["seq"], ".data")
+
+    def pending(self):
+        """
+        Return the pending entries, oldest first.
+        """
+        entries = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".json"):
+                with open(os.path.join(self.directory, name)) as fi:
+                    entries.append(json.load(fi))
+        return entries
+
+    def depth(self):
+        return sum(
+            1 for name in os.listdir(self.directory) if name.endswith(".json")
+        )
+
+    def remove(self, entry):
+        os.remove(self.path(entry["seq"], ".json"))
+        if entry["op"] == "put":
+            os.remove(self.data_path(entry))
+
+    def discard_puts(self, file_key):
+        """
+        Remove the pending uploads of a file, used when they are superseded by
+        an upload of the whole file. Deletions are kept, since the objects
+        they delete may have been uploaded before.
+        """
+        for entry in self.pending():
+            if entry["op"] == "put" and entry["file_key"] == file_key:
+                LOGGER.debug(f"Discarding spooled upload of '{entry['key']}'")
+                self.remove(entry)
@@ -1,22 +1,79 @@
 import subprocess
+import time
 from datetime import datetime
 
+from hds_monitoring import log
 from hds_monitoring.config import config
 from hds_monitoring.models import SystemdUnit
 
+LOGGER = log.get_logger(__name__)
 
-def is_unit_active(name):
-    stat = subprocess.call(["systemctl", "is-active", "--quiet", name])
-    return stat == 0
+UNIT_PROPERTIES = [
+    "ActiveState",
+    "SubState",
+    "StateChangeTimestampMonotonic",
+]
+
+
+def show_units(names):
+    """
+    Query the properties of all units with a single 'systemctl show' call.
+
+    Return a list of dictionaries mapping property names to values, in the
+    same order as 'names'. systemctl prints one block of properties per unit,
+    blocks being separated by an empty line, and also prints a block for
+    units that do not exist.
+    """
+    if not names:
+        return []
+    result = subprocess.run(
+        ["systemctl", "show", f"--property={','.join(UNIT_PROPERTIES)}"]
+        + list(names),
+        capture_output=True,
+        text=True,
+    )
+    blocks = [
+        dict(line.split("=", 1) for line in block.splitlines() if "=" in line)
+        for block in result.stdout.strip().split("\n\n")
+    ]
+    if len(blocks) != len(names):
+        LOGGER.error(
+            f"Expected properties of {len(names)} units from systemctl, got "
+            f"{len(blocks)} (exit status {result.returncode}): "
+            f"{result.stderr.strip()}"
+        )
+        return [{} for _ in names]
+    return blocks
+
+
+def monotonic_usec_to_datetime(usec):
+    """
+    Convert a CLOCK_MONOTONIC timestamp in microseconds, as reported by
+    systemd, to a local datetime. systemd reports 0 for events that never
+    happened, in which case None is returned.
+    """
+    if usec <= 0:
+        return None
+    boot_ts = time.time() - time.monotonic()
+    return datetime.fromtimestamp(boot_ts + usec / 1_000_000)
 
 
 def all_active_units(names):
-    return tuple(
-        SystemdUnit(
-            config["server_name"],
-            datetime.now(),
-            unit_name,
-            is_unit_active(unit_name),
+    now = datetime.now()
+    units = []
+    for unit_name, props in zip(names, show_units(names)):
+        active_state = props.get("ActiveState", "unknown")
+        units.append(
+            SystemdUnit(
+                config["server_name"],
+                now,
+                unit_name,
+                active_state == "active",
+                active_state,
+                props.get("SubState", "unknown"),
+                monotonic_usec_to_datetime(
+                    int(props.get("StateChangeTimestampMonotonic") or 0)
+                ),
+            )
         )
-        for unit_name in names
-    )
+    return tuple(units)
@@ -9,7 +9,11 @@ setup(
     name=NAME,
     packages=find_packages(include=["hds_monitoring", "hds_monitoring.*"]),
     entry_points={
-        "console_scripts": ["hds-monitoring=hds_monitoring.main:main"],
+        "console_scripts": [
+            "hds-monitoring=hds_monitoring.main:main",
+            "hds-monitoring-convert=hds_monitoring.binary:main",
+            "hds-monitoring-ingest=hds_monitoring.ingest:main",
+        ],
     },
     version=VERSION,
     author=AUTHOR,
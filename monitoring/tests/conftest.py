@@ -0,0 +1,66 @@
+import os
+import tempfile
+from datetime import datetime
+
+import pytest
+
+# The agent reads its configuration file from the environment when its
+# modules are imported, so it is written before the tests are collected.
+CONFIG = """[default]
+server_name = test
+systemd_units =
+data_dir = {work_dir}/data
+log_dir = {work_dir}/log
+log_level = debug
+s3_bucket = test
+state_dir = {work_dir}/state
+"""
+
+WORK_DIR = tempfile.mkdtemp(prefix="hds-tests-")
+with open(os.path.join(WORK_DIR, "hds.conf"), "w") as fo:
+    fo.write(CONFIG.format(work_dir=WORK_DIR))
+os.environ["HDS_MONITORING_APP_DIR"] = WORK_DIR
+os.environ["HDS_MONITORING_CONFIG_FILE"] = "hds.conf"
+
+
+@pytest.fixture
+def metrics_row():
+    """
+    Return a function building a Metrics row, all values being 'value'.
+    """
+    from hds_monitoring import models
+
+    def make(server_name="server", timestamp=None, value=1.0):
+        values = dict.fromkeys(models.METRICS_FIELD_NAMES, value)
+        values.update(
+            server_name=server_name,
+            timestamp=timestamp or datetime(2024, 1, 1, 12),
+        )
+        return models.Metrics(**values)
+
+    return make
+
+
+@pytest.fixture
+def unit_rows():
+    """
+    Return a function building a SystemdUnit row for each unit name.
+    """
+    from hds_monitoring import models
+
+    def make(server_name="server", timestamp=None, unit_names=("ssh",)):
+        timestamp = timestamp or datetime(2024, 1, 1, 12)
+        return [
+            models.SystemdUnit(
+                server_name,
+                timestamp,
+                unit_name,
+                True,
+                "active",
+                "running",
+                timestamp,
+            )
+            for unit_name in unit_names
+        ]
+
+    return make
@@ -0,0 +1,182 @@
+import http.server
+import json
+import threading
+
+import pytest
+
+from hds_monitoring import alerts
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def cpu_rule(**kwargs):
+    return alerts.ThresholdRule("cpu", "cpu_percent", above=90, **kwargs)
+
+
+def statuses(alerts_sent):
+    return [alert["status"] for alert in alerts_sent]
+
+
+def check_values(engine, metrics_row, values):
+    """
+    Check a Metrics row for each value, return the statuses of the alerts.
+    """
+    return [
+        statuses(engine.check_metrics(metrics_row(value=value)))
+        for value in values
+    ]
+
+
+def test_rule_is_abstract():
+    with pytest.raises(TypeError):
+        alerts.Rule("rule")
+
+
+def test_consecutive_samples(clock, metrics_row):
+    engine = alerts.AlertEngine([cpu_rule(samples=3)], 10, clock=clock)
+
+    assert check_values(
+        engine, metrics_row, [95, 95, 50, 95, 95, 95, 95, 50, 50, 50]
+    ) == [[], [], [], [], [], ["firing"], [], [], [], ["resolved"]]
+
+
+def test_clear_threshold(clock, metrics_row):
+    engine = alerts.AlertEngine([cpu_rule(clear=80)], 10, clock=clock)
+
+    # Values between 'clear' and the threshold keep the current state.
+    assert check_values(engine, metrics_row, [85, 95, 85, 92, 75, 85]) == [
+        [],
+        ["firing"],
+        [],
+        [],
+        ["resolved"],
+        [],
+    ]
+    [alert] = engine.check_metrics(metrics_row(value=95))
+    assert alert["rule"] == "cpu"
+    assert alert["key"] == "cpu_percent"
+    assert alert["message"] == (
+        "[firing] server cpu: cpu_percent is 95, above 90"
+    )
+
+
+def test_below_rule_and_repeat(clock, metrics_row):
+    rule = alerts.ThresholdRule(
+        "memory", "memory_available", below=100, repeat_sec=600
+    )
+    engine = alerts.AlertEngine([rule], 10, clock=clock)
+
+    assert check_values(engine, metrics_row, [50, 50]) == [["firing"], []]
+    clock.now += 600
+    assert check_values(engine, metrics_row, [50, 50]) == [["firing"], []]
+
+
+def test_rate_limit(clock, metrics_row):
+    rules = [
+        alerts.ThresholdRule(f"cpu{n}", "cpu_percent", above=90)
+        for n in range(3)
+    ]
+    engine = alerts.AlertEngine(rules, 2, clock=clock)
+
+    assert len(engine.check_metrics(metrics_row(value=95))) == 2
+    assert (engine.fired, engine.dropped) == (2, 1)
+
+    # One token is refilled every 30 seconds, for one of the three rules
+    # resolving.
+    clock.now += 30
+    assert len(engine.check_metrics(metrics_row(value=50))) == 1
+    assert (engine.fired, engine.dropped) == (3, 3)
+
+
+def test_unit_rules(clock, unit_rows):
+    engine = alerts.AlertEngine(
+        [alerts.StateRule("down", "*", ["failed"])], 10, clock=clock
+    )
+    rows = unit_rows(unit_names=["ssh", "cron"])
+
+    assert engine.check_units(rows) == []
+    [alert] = engine.check_units(
+        [rows[0], rows[1]._replace(active_state="failed")]
+    )
+    assert (alert["key"], alert["status"]) == ("cron", "firing")
+    assert alert["message"] == "[firing] server down: unit 'cron' is failed"
+
+
+def test_state_is_saved_between_runs(tmp_path, clock, metrics_row):
+    path = str(tmp_path / "state" / "alerts.json")
+    rules = [
+        cpu_rule(samples=2),
+        alerts.ThresholdRule("cpu_now", "cpu_percent", above=90),
+    ]
+    engine = alerts.AlertEngine(rules, 1, clock=clock)
+    assert statuses(engine.check_metrics(metrics_row(value=95))) == ["firing"]
+    engine.save(path)
+
+    engine = alerts.AlertEngine(rules, 1, clock=clock)
+    engine.load(path)
+    engine.check_metrics(metrics_row(value=95))
+
+    # The second bad sample fired the rule, whose alert is dropped since the
+    # only token was taken by the previous run.
+    assert engine.states[("cpu", "cpu_percent")].firing
+    assert engine.states[("cpu_now", "cpu_percent")].firing
+    assert (engine.fired, engine.dropped) == (0, 1)
+
+    (tmp_path / "state" / "alerts.json").write_text("{")
+    engine = alerts.AlertEngine(rules, 1, clock=clock)
+    engine.load(path)
+    assert engine.states == {}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        self.server.received.append(json.loads(self.rfile.read(length)))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def webhook():
+    server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    server.received = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_sinks(tmp_path, webhook):
+    sinks = alerts.make_sinks(
+        webhook_url=f"http://127.0.0.1:{webhook.server_port}/alerts",
+        file_path=str(tmp_path / "alerts.log"),
+        command=f"sh -c 'cat > {tmp_path}/stdin; "
+        f'echo "$ALERT_MESSAGE" > {tmp_path}/message\'',
+    )
+    sinks["failing"] = alerts.FileSink(str(tmp_path / "missing" / "log"))
+    alert = {"message": "[firing] server cpu", "sinks": []}
+
+    alerts.send([alert, dict(alert, sinks=["file", "other"])], sinks)
+
+    assert webhook.received == [alert]
+    assert [
+        json.loads(line)
+        for line in (tmp_path / "alerts.log").read_text().splitlines()
+    ] == [alert, dict(alert, sinks=["file", "other"])]
+    assert json.loads((tmp_path / "stdin").read_text()) == alert
+    assert (tmp_path / "message").read_text() == "[firing] server cpu\n"
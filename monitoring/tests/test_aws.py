@@ -0,0 +1,126 @@
+import json
+import os
+
+import pytest
+
+from benchmarks import fakes
+from hds_monitoring import aws, fleet_index, spool
+
+
+class FlakyS3(fakes.FakeS3):
+    """
+    FakeS3 whose uploads fail while 'failures' is positive, each failure
+    decrementing it. Negative values make uploads fail until it is reset.
+    """
+
+    def __init__(self, failures=0):
+        super().__init__()
+        self.failures = failures
+        self.attempts = 0
+
+    def upload_file(self, path, bucket, key, Config=None):
+        self.attempts += 1
+        if self.failures:
+            self.failures -= 1
+            raise fakes.ClientError("ServiceUnavailable")
+        super().upload_file(path, bucket, key, Config)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(aws, "BACKOFF_BASE_SEC", 0)
+
+
+@pytest.fixture
+def spool_dir(tmp_path):
+    return str(tmp_path / "spool")
+
+
+def test_drain_empties_spool(spool_dir):
+    client = FlakyS3()
+    uploader = aws.Uploader(spool.Spool(spool_dir), client, workers=2)
+    uploader.spool.put("bucket", "a.csv", b"a", file_key="a.csv")
+    uploader.spool.put("bucket", "b.csv", b"b", file_key="b.csv")
+    uploader.spool.put("bucket", "b.csv.1.part", b"bb", file_key="b.csv")
+
+    uploader.drain()
+
+    assert client.objects == {
+        "a.csv": b"a",
+        "b.csv": b"b",
+        "b.csv.1.part": b"bb",
+    }
+    stats = uploader.stats()
+    assert stats["queue_depth"] == 0
+    assert stats["bytes_uploaded"] == 4
+    assert stats["failures"] == 0
+    assert os.listdir(spool_dir) == []
+
+
+def test_transient_failures_are_retried(spool_dir):
+    client = FlakyS3(failures=aws.UPLOAD_ATTEMPTS - 1)
+    uploader = aws.Uploader(spool.Spool(spool_dir), client, workers=1)
+    uploader.spool.put("bucket", "a.csv", b"a", file_key="a.csv")
+
+    uploader.drain()
+
+    assert client.objects == {"a.csv": b"a"}
+    assert client.attempts == aws.UPLOAD_ATTEMPTS
+    assert uploader.stats()["failures"] == 0
+
+
+def test_failed_uploads_stay_spooled_in_order(spool_dir):
+    client = FlakyS3(failures=-1)
+    uploader = aws.Uploader(spool.Spool(spool_dir), client, workers=2)
+    uploader.spool.put("bucket", "a.csv", b"a", file_key="a.csv")
+    uploader.spool.put("bucket", "a.csv.1.part", b"aa", file_key="a.csv")
+
+    uploader.drain()
+
+    # Later operations of a file wait for the failed one.
+    assert client.attempts == aws.UPLOAD_ATTEMPTS
+    assert client.objects == {}
+    assert uploader.stats()["queue_depth"] == 2
+    assert uploader.stats()["failures"] == 1
+
+    client.failures = 0
+    uploader.drain()
+
+    assert client.objects == {"a.csv": b"a", "a.csv.1.part": b"aa"}
+    assert uploader.stats()["queue_depth"] == 0
+
+
+def test_sync_resumes_after_restart(tmp_path, spool_dir):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "metrics_2024-01-01.csv").write_bytes(b"a,b\n1,2\n")
+    manifest_path = str(tmp_path / "state" / "s3_manifest.json")
+
+    offline = FlakyS3(failures=-1)
+    uploader = aws.Uploader(spool.Spool(spool_dir), offline, workers=2)
+    aws.copy_folder_to_s3(
+        str(data_dir), "bucket", "server", manifest_path, uploader
+    )
+    assert offline.objects == {}
+    assert uploader.stats()["queue_depth"] == 1
+
+    # The agent restarts with the spool and manifest left on disk, and the
+    # file grew meanwhile.
+    with open(data_dir / "metrics_2024-01-01.csv", "ab") as fo:
+        fo.write(b"3,4\n")
+    client = FlakyS3()
+    uploader = aws.Uploader(spool.Spool(spool_dir), client, workers=2)
+    aws.copy_folder_to_s3(
+        str(data_dir), "bucket", "server", manifest_path, uploader
+    )
+
+    key = "server/metrics_2024-01-01.csv"
+    assert client.objects[key] == b"a,b\n1,2\n"
+    assert client.objects[aws.segment_key(key, 8)] == b"3,4\n"
+    assert uploader.stats()["queue_depth"] == 0
+    server_manifest = json.loads(
+        client.objects[fleet_index.server_manifest_key("server")]
+    )
+    assert server_manifest["logs"][key]["segments"] == [
+        [aws.segment_key(key, 8), 8, 4]
+    ]
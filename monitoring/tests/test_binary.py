@@ -0,0 +1,152 @@
+import math
+from datetime import datetime, timedelta
+
+import pytest
+
+from hds_monitoring import binary, models
+
+START = datetime(2024, 1, 1, 12)
+
+
+def write_file(path, file_schema, *segments):
+    with open(path, "wb") as fo:
+        fo.write(binary.encode_header(file_schema))
+        for rows in segments:
+            fo.write(binary.encode_segment(file_schema, rows))
+
+
+@pytest.mark.parametrize(
+    "code, values, decoded",
+    [
+        ("i", [5, -3, 2**40, None], [5, -3, 2**40, 0]),
+        ("f", [1.5, -0.25, None], [1.5, -0.25, math.nan]),
+        ("b", [True, False, True], [True, False, True]),
+        ("s", ["ssh", "", "é", None], ["ssh", "", "é", ""]),
+        (
+            "t",
+            [START, START - timedelta(days=1), None],
+            [
+                (START - binary.EPOCH) // binary.MILLISECOND,
+                (START - timedelta(days=1) - binary.EPOCH)
+                // binary.MILLISECOND,
+                0,
+            ],
+        ),
+    ],
+)
+def test_column_round_trip(code, values, decoded):
+    raw = binary.encode_column(code, values)
+    result = binary.decode_column(code, raw, len(values))
+    if code == "f":
+        assert math.isnan(result[-1])
+        result, decoded = result[:-1], decoded[:-1]
+    assert result == decoded
+
+
+def test_rows_round_trip(tmp_path, metrics_row, unit_rows):
+    path = str(tmp_path / "metrics.bin")
+    rows = [
+        metrics_row("a", START + timedelta(minutes=n), n) for n in range(5)
+    ]
+    file_schema = binary.schema(models.METRICS_FIELD_NAMES)
+    write_file(path, file_schema, rows[:2], [], rows[2:])
+
+    assert binary.read_rows(path) == [row._asdict() for row in rows]
+
+    path = str(tmp_path / "services.bin")
+    rows = unit_rows("a", START, ["ssh", "cron"])
+    write_file(path, binary.schema(models.SYSTEMD_UNITS_FIELD_NAMES), rows)
+
+    assert binary.read_rows(path) == [row._asdict() for row in rows]
+
+
+def test_read_columns_from_offset(tmp_path, metrics_row):
+    path = str(tmp_path / "metrics.bin")
+    file_schema = binary.schema(models.METRICS_FIELD_NAMES)
+    write_file(path, file_schema, [metrics_row("a", START)])
+    _, columns, offset = binary.read_columns(path)
+    with open(path, "ab") as fo:
+        fo.write(
+            binary.encode_segment(
+                file_schema, [metrics_row("b", START), metrics_row("c")]
+            )
+        )
+
+    schema, columns, end = binary.read_columns(path, offset)
+
+    assert schema == file_schema
+    assert columns["server_name"] == ["b", "c"]
+    assert end == (tmp_path / "metrics.bin").stat().st_size
+
+
+def test_recover_cuts_off_incomplete_segment(tmp_path, metrics_row):
+    path = tmp_path / "metrics.bin"
+    file_schema = binary.schema(models.METRICS_FIELD_NAMES)
+    write_file(path, file_schema, [metrics_row("a", START)])
+    complete = path.read_bytes()
+    # A crash interrupted the write of the second segment.
+    segment = binary.encode_segment(file_schema, [metrics_row("b", START)])
+    path.write_bytes(complete + segment[:-5])
+
+    assert binary.recover(str(path)) == file_schema
+
+    assert path.read_bytes() == complete
+    with open(path, "ab") as fo:
+        fo.write(segment)
+    assert [row["server_name"] for row in binary.read_rows(str(path))] == [
+        "a",
+        "b",
+    ]
+
+
+def test_recover_incomplete_header(tmp_path):
+    path = tmp_path / "metrics.bin"
+    path.write_bytes(binary.encode_header([("server_name", "s")])[:-3])
+
+    assert binary.recover(str(path)) is None
+
+    assert path.read_bytes() == b""
+    assert binary.recover(str(tmp_path / "missing.bin")) is None
+    path.write_bytes(b"server_name,timestamp\n")
+    with pytest.raises(ValueError):
+        binary.recover(str(path))
+
+
+def test_convert_csv(tmp_path, monkeypatch):
+    monkeypatch.setattr(binary, "CONVERT_SEGMENT_ROWS", 2)
+    path = tmp_path / "services_2024-01-01.csv"
+    # Written by an agent that predates 'active_state', with a row cut off
+    # by a crash.
+    path.write_text(
+        "server_name,timestamp,unit_name,active\n"
+        "a,2024-01-01 12:00:00,ssh,True\n"
+        "a,2024-01-01 12:00:00,cron,False\n"
+        "a,2024-01-01 12:01:00,ssh,True\n"
+        "a,2024-01-01 12:01:00,cron\n"
+    )
+
+    out_path = binary.convert_csv(str(path), remove=True)
+
+    assert out_path == str(tmp_path / "services_2024-01-01.bin")
+    assert not path.exists()
+    with open(out_path, "rb") as fi:
+        assert binary.read_header(fi) == [
+            ("server_name", "s"),
+            ("timestamp", "t"),
+            ("unit_name", "s"),
+            ("active", "b"),
+        ]
+        assert len(list(binary.iter_segments(fi))) == 2
+    assert binary.read_rows(out_path) == [
+        {
+            "server_name": "a",
+            "timestamp": START + timedelta(minutes=minute),
+            "unit_name": unit_name,
+            "active": active,
+        }
+        for minute, unit_name, active in [
+            (0, "ssh", True),
+            (0, "cron", False),
+            (1, "ssh", True),
+        ]
+    ]
@@ -0,0 +1,139 @@
+import os
+import shutil
+from datetime import datetime
+
+import pytest
+
+from benchmarks import fakes
+from hds_monitoring import cgroups
+
+TIMESTAMP = datetime(2024, 1, 1, 12)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def tree(tmp_path):
+    return fakes.FakeCgroupTree(str(tmp_path), ["web", "db"])
+
+
+@pytest.fixture
+def collector(tree, clock):
+    return cgroups.UnitResourceCollector(
+        ["web", "db.service", "stopped"], root=tree.root, clock=clock
+    )
+
+
+def tick(tree, clock, seconds=1.0):
+    clock.now += seconds
+    tree.advance()
+
+
+def restart(tree, unit_name):
+    """
+    Replace the cgroup of a unit by a new directory, which has another
+    inode, like systemd does when the unit restarts.
+    """
+    directory = tree.unit_dir(unit_name)
+    os.rename(directory, f"{directory}.old")
+    tree.advance()
+    shutil.rmtree(f"{directory}.old")
+
+
+def test_cgroup_name():
+    assert cgroups.cgroup_name("ssh") == "ssh.service"
+    assert cgroups.cgroup_name("ssh.service") == "ssh.service"
+    assert cgroups.cgroup_name("home.mount") == "home.mount"
+
+
+def test_first_collection_has_no_rates(collector):
+    assert collector.collect("server", TIMESTAMP) == []
+
+
+def test_rates(tree, clock, collector):
+    collector.collect("server", TIMESTAMP)
+    tick(tree, clock, seconds=2.0)
+
+    rows = collector.collect("server", TIMESTAMP)
+
+    assert [row.unit_name for row in rows] == ["web", "db.service"]
+    row = rows[0]
+    assert row.server_name == "server"
+    assert row.timestamp == TIMESTAMP
+    # Counters grow by 0.3 s of CPU time per tick, over 2 s.
+    assert row.cpu_percent == pytest.approx(15.0)
+    assert row.cpu_user_percent == pytest.approx(10.0)
+    assert row.cpu_system_percent == pytest.approx(5.0)
+    assert row.io_read_bytes_per_sec == pytest.approx((40960 + 4096) / 2)
+    assert row.io_write_bytes_per_sec == pytest.approx(81920 / 2)
+    assert row.io_read_ops_per_sec == pytest.approx(11 / 2)
+    assert row.io_write_ops_per_sec == pytest.approx(20 / 2)
+    assert row.memory_current == 100 * 1024**2 + 2 * 4096
+    assert row.memory_peak == 200 * 1024**2
+    assert row.pids == 12
+
+
+def test_restarted_unit_starts_over(tree, clock, collector):
+    collector.collect("server", TIMESTAMP)
+    clock.now += 1.0
+    restart(tree, "web")
+    # The counters of the new cgroup start again from 0 after a restart,
+    # rates against the counters of the old one would be negative.
+    with open(os.path.join(tree.unit_dir("web"), "cpu.stat"), "w") as fo:
+        fo.write("usage_usec 1000\nuser_usec 600\nsystem_usec 400\n")
+
+    rows = collector.collect("server", TIMESTAMP)
+
+    assert [row.unit_name for row in rows] == ["db.service"]
+
+    tick(tree, clock)
+    rows = {
+        row.unit_name: row for row in collector.collect("server", TIMESTAMP)
+    }
+
+    assert rows["web"].cpu_percent == pytest.approx((900_000 - 1000) / 10_000)
+    assert rows["db.service"].cpu_percent == pytest.approx(30.0)
+
+
+def test_stopped_unit_is_dropped(tree, clock, collector):
+    collector.collect("server", TIMESTAMP)
+    tick(tree, clock)
+    shutil.rmtree(tree.unit_dir("db"))
+
+    rows = collector.collect("server", TIMESTAMP)
+
+    assert [row.unit_name for row in rows] == ["web"]
+    assert [unit_name for unit_name, _ in collector.counters] == ["web"]
+
+
+def test_missing_optional_files(tree, clock, collector):
+    # Without the io controller or on kernels older than 5.19.
+    for name in ("io.stat", "memory.peak"):
+        os.remove(os.path.join(tree.unit_dir("web"), name))
+    collector.collect("server", TIMESTAMP)
+    clock.now += 1.0
+
+    row = collector.collect("server", TIMESTAMP)[0]
+
+    assert row.unit_name == "web"
+    assert row.io_read_bytes_per_sec == 0
+    assert row.memory_peak == 0
+
+
+def test_read_value_of_limit(tmp_path):
+    path = tmp_path / "memory.max"
+    path.write_text("max\n")
+    assert cgroups.read_value(str(path)) is None
+    path.write_text("1024\n")
+    assert cgroups.read_value(str(path)) == 1024
@@ -0,0 +1,71 @@
+import os
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+import dashboard_data
+from hds_monitoring import models, rollup
+
+HEADER = "server_name,timestamp,unit_name,active\n"
+
+
+def write(path, text):
+    with open(path, "w") as fo:
+        fo.write(text)
+    # Rewrites within the same clock tick keep the modification time.
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def test_unparsable_file_is_skipped(tmp_path):
+    server_dir = tmp_path / "server"
+    server_dir.mkdir()
+    write(
+        server_dir / "services_2024-01-01.csv",
+        HEADER + "server,2024-01-01 00:00:00,ssh,True\n",
+    )
+    corrupted = server_dir / "services_2024-01-02.csv"
+    # Rows of a later layout appended under the header of an older one.
+    write(
+        corrupted,
+        HEADER
+        + "server,2024-01-02 00:00:00,ssh,True\n"
+        + "server,2024-01-02 00:01:00,ssh,True,active,running,\n",
+    )
+    cache = dashboard_data.LogCache(str(tmp_path))
+
+    df = cache.load(["server"], "services")
+
+    assert df["timestamp"].tolist() == [pd.Timestamp("2024-01-01")]
+
+    write(corrupted, HEADER + "server,2024-01-02 00:00:00,ssh,True\n")
+    df = cache.load(["server"], "services")
+
+    assert len(df) == 2
+
+
+def test_duplicate_rollup_buckets_are_merged(metrics_row):
+    start = datetime(2024, 1, 1, 12)
+    # An agent that crashed within a bucket wrote a row for each part of it.
+    rows = [
+        rollup.summarize(
+            "a",
+            start,
+            [metrics_row("a", start + timedelta(minutes=n)) for n in (0, 1)],
+        ),
+        rollup.summarize("a", start, [metrics_row("a", start, 4.0)]),
+        rollup.summarize("b", start, [metrics_row("b", start, 2.0)]),
+    ]
+    frame = pd.DataFrame(rows, columns=models.ROLLUP_FIELD_NAMES)
+
+    merged = dashboard_data.merge_rollup_buckets(frame)
+
+    assert list(merged.columns) == models.ROLLUP_FIELD_NAMES
+    assert merged["server_name"].tolist() == ["a", "b"]
+    assert merged["samples"].tolist() == [3, 1]
+    assert merged["cpu_percent_min"].tolist() == [1.0, 2.0]
+    assert merged["cpu_percent_max"].tolist() == [4.0, 2.0]
+    assert merged["cpu_percent_mean"].tolist() == pytest.approx([2.0, 2.0])
+    assert merged["cpu_percent_p95"].tolist() == [4.0, 2.0]
+    assert dashboard_data.merge_rollup_buckets(merged) is merged
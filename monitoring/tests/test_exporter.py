@@ -0,0 +1,103 @@
+import math
+import re
+import urllib.error
+import urllib.request
+
+import pytest
+
+from hds_monitoring import exporter
+
+SAMPLE_REGEX = re.compile(
+    r"^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)"
+    r"(?:\{(?P<labels>.*)\})? (?P<value>\S+)$"
+)
+LABEL_REGEX = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def parse(text):
+    """
+    Parse an OpenMetrics text exposition made of gauges, return a dictionary
+    mapping metric names to lists of (labels, value) tuples.
+    """
+    lines = text.split("\n")
+    assert lines[-2:] == ["# EOF", ""]
+    families = {}
+    current = None
+    for line in lines[:-2]:
+        if line.startswith("# TYPE "):
+            _, _, current, kind = line.split(" ")
+            assert kind == "gauge"
+            assert current not in families
+            families[current] = []
+        elif line.startswith("# HELP "):
+            assert line.split(" ")[2] == current
+        else:
+            match = SAMPLE_REGEX.match(line)
+            assert match is not None, line
+            assert match["name"] == current
+            labels = dict(LABEL_REGEX.findall(match["labels"] or ""))
+            families[current].append((labels, float(match["value"])))
+    return families
+
+
+@pytest.fixture
+def snapshot():
+    return exporter.Snapshot()
+
+
+@pytest.fixture
+def server(snapshot):
+    server = exporter.MetricsServer(snapshot, port=0)
+    server.start()
+    yield server
+    server.stop()
+
+
+def scrape(server, path=exporter.METRICS_PATH):
+    url = f"http://127.0.0.1:{server.port}{path}"
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return response.headers["Content-Type"], response.read().decode()
+
+
+def test_scrape_before_first_sample(server):
+    content_type, text = scrape(server)
+    assert content_type == exporter.CONTENT_TYPE
+    assert text == "# EOF\n"
+
+
+def test_scrape_latest_sample(server, snapshot, metrics_row, unit_rows):
+    metrics = metrics_row(value=2.5)._replace(cpu_percent=float("nan"))
+    units = unit_rows(unit_names=["ssh", 'we"ird'])
+    snapshot.update(metrics, units)
+
+    _, text = scrape(server)
+    families = parse(text)
+
+    server_labels = {"server_name": "server"}
+    assert families["hds_sample_timestamp_seconds"] == [
+        (server_labels, metrics.timestamp.timestamp())
+    ]
+    assert families["hds_memory_total_bytes"] == [(server_labels, 2.5)]
+    [(_, cpu_percent)] = families["hds_cpu_percent"]
+    assert math.isnan(cpu_percent)
+    assert families["hds_unit_active"] == [
+        ({"server_name": "server", "unit_name": "ssh"}, 1.0),
+        ({"server_name": "server", "unit_name": 'we\\"ird'}, 1.0),
+    ]
+    labels, value = families["hds_unit_state"][0]
+    assert labels["active_state"] == "active"
+    assert labels["sub_state"] == "running"
+    assert value == 1.0
+
+
+def test_scrape_follows_updates(server, snapshot, metrics_row):
+    snapshot.update(metrics_row(value=1.0), [])
+    assert parse(scrape(server)[1])["hds_cpu_load_percent"][0][1] == 1.0
+    snapshot.update(metrics_row(value=3.0), [])
+    assert parse(scrape(server)[1])["hds_cpu_load_percent"][0][1] == 3.0
+
+
+def test_unknown_path(server):
+    with pytest.raises(urllib.error.HTTPError) as info:
+        scrape(server, "/other")
+    assert info.value.code == 404
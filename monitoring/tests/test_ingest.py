@@ -0,0 +1,173 @@
+import socket
+from datetime import datetime, timedelta
+
+import pytest
+
+from hds_monitoring import binary, ingest, models
+
+START = datetime(2024, 1, 1, 12)
+
+
+def to_ms(timestamp):
+    return (timestamp - binary.EPOCH) // binary.MILLISECOND
+
+
+@pytest.fixture
+def store():
+    return ingest.LiveStore(window_sec=600)
+
+
+@pytest.fixture
+def server(store):
+    server = ingest.IngestServer(store, port=0, token="secret")
+    server.start()
+    yield server
+    server.stop()
+
+
+def ingest_url(server):
+    return f"http://127.0.0.1:{server.port}{ingest.INGEST_PATH}"
+
+
+def test_batch_round_trip(metrics_row, unit_rows):
+    metrics = [
+        metrics_row("a", START, 1.0),
+        metrics_row("b", START + timedelta(minutes=1), 2.0),
+    ]
+    units = unit_rows("a", START, ["ssh", "cron"])
+
+    streams = ingest.decode_batch(
+        ingest.encode_batch({"metrics": metrics, "services": units})
+    )
+
+    schema, columns = streams["metrics"]
+    assert [name for name, _ in schema] == models.METRICS_FIELD_NAMES
+    assert columns["server_name"] == ["a", "b"]
+    assert columns["timestamp"] == [to_ms(row.timestamp) for row in metrics]
+    assert columns["cpu_percent"] == [1.0, 2.0]
+    _, columns = streams["services"]
+    assert columns["unit_name"] == ["ssh", "cron"]
+    assert columns["active"] == [True, True]
+    assert columns["state_changed_at"] == [to_ms(START)] * 2
+
+
+def test_empty_streams_are_left_out(metrics_row):
+    streams = ingest.decode_batch(
+        ingest.encode_batch({"metrics": [metrics_row()], "services": []})
+    )
+    assert list(streams) == ["metrics"]
+
+
+@pytest.mark.parametrize("cut", [3, 10, -1])
+def test_truncated_batch_is_rejected(metrics_row, cut):
+    data = ingest.encode_batch({"metrics": [metrics_row()]})
+    with pytest.raises(ValueError):
+        ingest.decode_batch(data[:cut])
+
+
+def test_unknown_stream_is_rejected():
+    name = b"other"
+    data = binary.UINT32.pack(len(name)) + name + binary.UINT32.pack(0)
+    with pytest.raises(ValueError):
+        ingest.decode_batch(data)
+
+
+def test_live_store_keeps_window(store, metrics_row):
+    for minute in (0, 5, 11):
+        _, columns = ingest.decode_batch(
+            ingest.encode_batch(
+                {
+                    "metrics": [
+                        metrics_row("a", START + timedelta(minutes=minute))
+                    ]
+                }
+            )
+        )["metrics"]
+        store.add("metrics", columns)
+
+    columns = store.columns(["a"], "metrics")
+    assert columns["timestamp"] == [
+        to_ms(START + timedelta(minutes=5)),
+        to_ms(START + timedelta(minutes=11)),
+    ]
+    assert store.columns(["b"], "metrics")["timestamp"] == []
+    assert store.server_names() == ["a"]
+
+
+def test_pusher_to_server(server, store, metrics_row, unit_rows):
+    pusher = ingest.Pusher(ingest_url(server), token="secret")
+    pusher.push((metrics_row("a", START), unit_rows("a", START)))
+    pusher.push(
+        (
+            metrics_row("a", START + timedelta(minutes=1)),
+            unit_rows("a", START + timedelta(minutes=1)),
+        )
+    )
+
+    assert (pusher.pushed, pusher.failures) == (2, 0)
+    assert store.server_names() == ["a"]
+    assert store.columns(["a"], "metrics")["timestamp"] == [
+        to_ms(START),
+        to_ms(START + timedelta(minutes=1)),
+    ]
+    assert store.columns(["a"], "services")["unit_name"] == ["ssh", "ssh"]
+
+
+def test_rejected_rows_are_pushed_later(server, store, metrics_row):
+    pusher = ingest.Pusher(ingest_url(server), token="wrong")
+    pusher.push((metrics_row("a", START), []))
+
+    assert (pusher.pushed, pusher.failures) == (0, 1)
+    assert store.server_names() == []
+
+    pusher.headers["Authorization"] = "Bearer secret"
+    pusher.push((metrics_row("a", START + timedelta(minutes=1)), []))
+
+    assert (pusher.pushed, pusher.failures) == (1, 1)
+    assert len(store.columns(["a"], "metrics")["timestamp"]) == 2
+    assert not pusher.pending["metrics"]
+
+
+def test_connection_is_kept_open(server, store, metrics_row):
+    pusher = ingest.Pusher(ingest_url(server), token="secret")
+    pusher.push((metrics_row("a", START), []))
+    connection = pusher.connection
+
+    pusher.push((metrics_row("a", START + timedelta(minutes=1)), []))
+
+    assert pusher.connection is connection
+    # A connection closed since the previous batch is opened again.
+    connection.sock.shutdown(socket.SHUT_RDWR)
+    pusher.push((metrics_row("a", START + timedelta(minutes=2)), []))
+
+    assert (pusher.pushed, pusher.failures) == (3, 0)
+    assert len(store.columns(["a"], "metrics")["timestamp"]) == 3
+
+
+def test_rejected_batch_is_dropped(server, store, metrics_row, monkeypatch):
+    pusher = ingest.Pusher(ingest_url(server), token="secret")
+    monkeypatch.setattr(ingest, "MAX_BATCH_BYTES", 10)
+    pusher.push((metrics_row("a", START), []))
+
+    assert (pusher.pushed, pusher.failures) == (0, 1)
+    assert not pusher.pending["metrics"]
+
+    monkeypatch.undo()
+    pusher.push((metrics_row("a", START + timedelta(minutes=1)), []))
+
+    assert (pusher.pushed, pusher.failures) == (1, 1)
+    assert store.columns(["a"], "metrics")["timestamp"] == [
+        to_ms(START + timedelta(minutes=1))
+    ]
+
+
+def test_unreachable_server_keeps_latest_rows(metrics_row):
+    pusher = ingest.Pusher("http://127.0.0.1:1/ingest", max_pending=2)
+    for minute in range(3):
+        pusher.push((metrics_row("a", START + timedelta(minutes=minute)), []))
+
+    assert pusher.failures == 3
+    assert [row.timestamp for row in pusher.pending["metrics"]] == [
+        START + timedelta(minutes=1),
+        START + timedelta(minutes=2),
+    ]
@@ -0,0 +1,130 @@
+import csv
+from collections import namedtuple
+from datetime import datetime
+
+import pandas as pd
+
+from hds_monitoring import binary, io, models
+
+Row = namedtuple("Row", ["server_name", "timestamp", "value"])
+ROW_TYPES = {"server_name": str, "timestamp": datetime, "value": float}
+
+# Layout of service statuses written by agents that predate 'active_state'.
+OLD_SERVICES_HEADER = "server_name,timestamp,unit_name,active\n"
+
+
+def read_csv_rows(path):
+    with open(path, newline="") as fi:
+        return list(csv.reader(fi))
+
+
+def csv_appender(directory, **kwargs):
+    return io.CsvAppender("test", list(Row._fields), str(directory), **kwargs)
+
+
+def test_partial_row_is_cut_off(tmp_path):
+    path = tmp_path / "test_2024-01-01.csv"
+    # A crash interrupted the write of the last row.
+    path.write_text("server_name,timestamp,value\na,2024-01-01 00:00:00,1")
+    appender = csv_appender(tmp_path)
+
+    appender.append(Row("a", datetime(2024, 1, 1, 1), 2.0))
+    appender.close()
+
+    assert read_csv_rows(path) == [
+        ["server_name", "timestamp", "value"],
+        ["a", "2024-01-01 01:00:00", "2.0"],
+    ]
+
+
+def test_truncate_partial_row_across_blocks(tmp_path):
+    path = tmp_path / "log.csv"
+    complete = "header\n" + "x" * (3 * io.READ_BLOCK_SIZE) + "\n"
+    path.write_text(complete + "y" * (2 * io.READ_BLOCK_SIZE))
+
+    assert io.truncate_partial_row(str(path)) == len(complete)
+    assert path.read_text() == complete
+    assert io.truncate_partial_row(str(tmp_path / "missing.csv")) == 0
+
+
+def test_new_file_at_midnight(tmp_path):
+    appender = csv_appender(tmp_path, flush_rows=10)
+
+    appender.append(
+        Row("a", datetime(2024, 1, 1, 23, 59), 1.0),
+        Row("a", datetime(2024, 1, 2, 0, 0), 2.0),
+    )
+    appender.append(Row("a", datetime(2024, 1, 2, 0, 1), 3.0))
+
+    # Rows of the previous day are flushed when the day changes.
+    assert read_csv_rows(tmp_path / "test_2024-01-01.csv")[1:] == [
+        ["a", "2024-01-01 23:59:00", "1.0"]
+    ]
+    assert appender.path("2024-01-02") == str(tmp_path / "test_2024-01-02.csv")
+    appender.close()
+    assert [
+        row[2] for row in read_csv_rows(tmp_path / "test_2024-01-02.csv")[1:]
+    ] == ["2.0", "3.0"]
+
+
+def test_file_with_old_header_is_moved_aside(tmp_path):
+    old_content = OLD_SERVICES_HEADER + "a,2024-01-01 00:00:00,ssh,True\n"
+    (tmp_path / "services_2024-01-01.csv").write_text(old_content)
+    (tmp_path / "services-old_2024-01-01.csv").write_text(old_content)
+    appender = io.CsvAppender(
+        "services", models.SYSTEMD_UNITS_FIELD_NAMES, str(tmp_path)
+    )
+    timestamp = datetime(2024, 1, 1, 12)
+
+    appender.append(
+        models.SystemdUnit(
+            "a", timestamp, "ssh", True, "active", "running", timestamp
+        )
+    )
+    appender.close()
+
+    assert (tmp_path / "services-old2_2024-01-01.csv").read_text() == (
+        old_content
+    )
+    df = pd.read_csv(tmp_path / "services_2024-01-01.csv")
+    assert list(df.columns) == models.SYSTEMD_UNITS_FIELD_NAMES
+    assert df["active_state"].tolist() == ["active"]
+
+
+def test_binary_round_trip_and_reopen(tmp_path):
+    rows = [
+        Row("a", datetime(2024, 1, 1, 0, minute), float(minute))
+        for minute in range(4)
+    ]
+    for batch in (rows[:2], rows[2:]):
+        appender = io.BinaryAppender(
+            "test", list(Row._fields), str(tmp_path), field_types=ROW_TYPES
+        )
+        appender.append(*batch)
+        appender.close()
+
+    assert list(binary.read_rows(str(tmp_path / "test_2024-01-01.bin"))) == [
+        row._asdict() for row in rows
+    ]
+
+
+def test_binary_file_with_other_schema_is_moved_aside(tmp_path):
+    appender = io.BinaryAppender(
+        "test", list(Row._fields), str(tmp_path), field_types=ROW_TYPES
+    )
+    appender.append(Row("a", datetime(2024, 1, 1), 1.0))
+    appender.close()
+    old_content = (tmp_path / "test_2024-01-01.bin").read_bytes()
+
+    appender = io.BinaryAppender(
+        "test",
+        list(Row._fields),
+        str(tmp_path),
+        field_types={**ROW_TYPES, "value": int},
+    )
+    appender.append(Row("a", datetime(2024, 1, 1, 1), 2))
+    appender.close()
+
+    assert (tmp_path / "test-old_2024-01-01.bin").read_bytes() == old_content
+    [row] = binary.read_rows(str(tmp_path / "test_2024-01-01.bin"))
+    assert row["value"] == 2
@@ -0,0 +1,103 @@
+from datetime import datetime
+
+import pytest
+
+from benchmarks import fakes
+from hds_monitoring import cgroups, models, monitoring, processes
+
+
+@pytest.fixture
+def psu(monkeypatch):
+    psu = fakes.FakePsutil()
+    monkeypatch.setattr(monitoring, "psu", psu)
+    for name, value in (
+        ("LAST_IO_COUNTERS", None),
+        ("LAST_CPU_TIMES", None),
+        ("LAST_DEVICE_COUNTERS", {}),
+    ):
+        monkeypatch.setattr(monitoring, name, value)
+    return psu
+
+
+@pytest.fixture
+def collectors(tmp_path):
+    tree = fakes.FakeCgroupTree(str(tmp_path / "cgroup"), ["web"])
+    unit_resource_collector = cgroups.UnitResourceCollector(
+        ["web"], root=tree.root
+    )
+    unit_resource_collector.sample()
+    process_collector = processes.ProcessCollector(top_n=5)
+    process_collector.counters = {
+        (1, 1000.0): processes.ProcessCounters(10.0, 1.5, 4096, 8192)
+    }
+    return process_collector, unit_resource_collector
+
+
+def test_counters_round_trip(tmp_path, psu, collectors):
+    path = str(tmp_path / "state" / "counters.json")
+    monitoring.LAST_IO_COUNTERS = monitoring.read_io_counters()
+    monitoring.LAST_DEVICE_COUNTERS = monitoring.read_device_counters()
+    monitoring.LAST_CPU_TIMES = psu.cpu_times()._asdict()
+    saved = (
+        monitoring.LAST_IO_COUNTERS,
+        monitoring.LAST_CPU_TIMES,
+        monitoring.LAST_DEVICE_COUNTERS,
+        collectors[0].counters,
+        collectors[1].counters,
+    )
+    monitoring.save_counters(path, *collectors)
+    monitoring.LAST_IO_COUNTERS = None
+    monitoring.LAST_CPU_TIMES = None
+    monitoring.LAST_DEVICE_COUNTERS = {}
+    restored = (
+        processes.ProcessCollector(top_n=5),
+        cgroups.UnitResourceCollector(["web"]),
+    )
+
+    assert monitoring.load_counters(path, *restored)
+
+    assert (
+        monitoring.LAST_IO_COUNTERS,
+        monitoring.LAST_CPU_TIMES,
+        monitoring.LAST_DEVICE_COUNTERS,
+        restored[0].counters,
+        restored[1].counters,
+    ) == saved
+
+
+def test_counters_from_before_boot_are_discarded(tmp_path, psu, collectors):
+    path = str(tmp_path / "counters.json")
+    monitoring.LAST_IO_COUNTERS = monitoring.read_io_counters()
+    monitoring.save_counters(path, *collectors)
+    monitoring.LAST_IO_COUNTERS = None
+    psu.boot += 3600
+    restored = processes.ProcessCollector(top_n=5)
+
+    assert not monitoring.load_counters(path, restored, None)
+
+    assert monitoring.LAST_IO_COUNTERS is None
+    assert restored.counters == {}
+    assert not monitoring.load_counters(str(tmp_path / "missing"), None, None)
+    (tmp_path / "counters.json").write_text("{")
+    assert not monitoring.load_counters(path, None, None)
+
+
+def test_cpu_since_previous_run(psu, metrics_row):
+    metrics = metrics_row(timestamp=datetime(2024, 1, 1), value=90.0)
+
+    # Without CPU times of a previous run, the sampled values are kept.
+    assert monitoring.cpu_since_previous_run(metrics) == metrics
+    metrics = monitoring.cpu_since_previous_run(metrics)
+
+    assert metrics.cpu_percent == pytest.approx(40.0)
+    for stat in models.SUMMARY_STATS:
+        assert getattr(metrics, f"cpu_percent_{stat}") == pytest.approx(40.0)
+    assert metrics.cpu_load_percent == 90.0
+
+
+def test_cpu_percent_between():
+    previous = {"user": 10.0, "system": 5.0, "idle": 80.0, "iowait": 5.0}
+    current = {"user": 30.0, "system": 5.0, "idle": 100.0, "iowait": 45.0}
+
+    assert monitoring.cpu_percent_between(previous, current) == 25.0
+    assert monitoring.cpu_percent_between(current, current) == 0.0
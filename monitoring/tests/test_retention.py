@@ -0,0 +1,168 @@
+import gzip
+import os
+from datetime import date, timedelta
+
+import pytest
+
+from hds_monitoring import retention
+from hds_monitoring.manifest import save_manifest
+
+TODAY = date(2024, 1, 10)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    return data_dir
+
+
+def make_retention(tmp_path, max_age_days=30, max_bytes=None):
+    return retention.Retention(
+        str(tmp_path / "data"),
+        str(tmp_path / "state" / "s3_manifest.json"),
+        "server/",
+        max_age_days,
+        max_bytes,
+    )
+
+
+def write_log(data_dir, name, size=100):
+    path = data_dir / name
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def ship(tmp_path, *paths):
+    """
+    Record the current content of the logs at 'paths' as synced to S3.
+    """
+    manifest = {}
+    for path in paths:
+        stat = os.stat(path)
+        manifest[f"server/{os.path.basename(path)}"] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+        }
+    save_manifest(str(tmp_path / "state" / "s3_manifest.json"), manifest)
+
+
+def test_log_date():
+    assert retention.log_date("metrics_2024-01-09.csv.gz") == date(2024, 1, 9)
+    assert retention.log_date("metrics-5m_2024-01-09.bin") == date(2024, 1, 9)
+    assert retention.log_date("metrics.csv") is None
+    assert retention.log_date("metrics_yesterday.csv") is None
+
+
+def test_only_shipped_logs_are_archived(tmp_path, data_dir):
+    shipped = write_log(data_dir, "metrics_2024-01-09.csv")
+    binary = write_log(data_dir, "services_2024-01-09.bin")
+    modified = write_log(data_dir, "devices_2024-01-09.csv")
+    today = write_log(data_dir, "metrics_2024-01-10.csv")
+    ship(tmp_path, shipped, binary, modified, today)
+    # Rows appended since the sync are not in S3 yet.
+    with open(modified, "ab") as fo:
+        fo.write(b"y")
+    write_log(data_dir, "processes_2024-01-09.csv")
+
+    make_retention(tmp_path).run(today=TODAY)
+
+    assert sorted(os.listdir(data_dir)) == [
+        "archive",
+        "devices_2024-01-09.csv",
+        "metrics_2024-01-10.csv",
+        "processes_2024-01-09.csv",
+    ]
+    assert sorted(os.listdir(data_dir / "archive")) == [
+        "metrics_2024-01-09.csv.gz",
+        "services_2024-01-09.bin",
+    ]
+    with gzip.open(data_dir / "archive" / "metrics_2024-01-09.csv.gz") as fi:
+        assert fi.read() == b"x" * 100
+
+
+def test_old_logs_are_evicted(tmp_path, data_dir):
+    (data_dir / "archive").mkdir()
+    write_log(data_dir / "archive", "metrics_2024-01-06.csv.gz")
+    write_log(data_dir, "services_2024-01-06.csv")
+    write_log(data_dir, "metrics-1h_2024-01-06.csv")
+    write_log(data_dir, "metrics_2024-01-07.csv")
+
+    make_retention(tmp_path, max_age_days=3).run(today=TODAY)
+
+    assert os.listdir(data_dir / "archive") == []
+    assert sorted(os.listdir(data_dir)) == [
+        "archive",
+        "metrics_2024-01-07.csv",
+    ]
+
+
+def test_raw_logs_are_evicted_before_rollups(tmp_path, data_dir):
+    write_log(data_dir, "metrics-1h_2024-01-07.csv")
+    write_log(data_dir, "metrics-5m_2024-01-08.csv")
+    write_log(data_dir, "metrics_2024-01-08.csv")
+    write_log(data_dir, "services_2024-01-09.csv")
+    open_path = write_log(data_dir, "metrics_2024-01-10.csv")
+    policy = make_retention(tmp_path, max_bytes=350)
+
+    policy.run([open_path], today=TODAY)
+
+    assert sorted(os.listdir(data_dir)) == [
+        "metrics-1h_2024-01-07.csv",
+        "metrics-5m_2024-01-08.csv",
+        "metrics_2024-01-10.csv",
+    ]
+    assert policy.closed_bytes == 200
+
+    policy.max_bytes = 200
+    policy.run([open_path], today=TODAY)
+
+    assert sorted(os.listdir(data_dir)) == [
+        "metrics-5m_2024-01-08.csv",
+        "metrics_2024-01-10.csv",
+    ]
+
+
+def test_open_logs_are_never_touched(tmp_path, data_dir):
+    # A log of a past day still being written, by a collection that
+    # started before midnight.
+    open_path = write_log(data_dir, "metrics_2024-01-01.csv")
+    ship(tmp_path, open_path)
+
+    make_retention(tmp_path, max_age_days=3, max_bytes=10).run(
+        [open_path], today=TODAY
+    )
+
+    assert os.listdir(data_dir) == ["metrics_2024-01-01.csv"]
+
+
+def test_maybe_run(tmp_path, data_dir, monkeypatch):
+    policy = make_retention(tmp_path, max_bytes=250)
+    runs = []
+    run = policy.run
+    monkeypatch.setattr(
+        policy, "run", lambda *args: runs.append(args) or run(*args)
+    )
+    write_log(data_dir, "services_2024-01-09.csv")
+    open_path = write_log(data_dir, "metrics_2024-01-10.csv")
+
+    # The first call of a day lists the logs.
+    policy.maybe_run([open_path], today=TODAY)
+    assert len(runs) == 1
+
+    # Under quota, or shortly after the previous run, nothing is listed.
+    policy.last_run_ts -= retention.QUOTA_CHECK_INTERVAL_SEC
+    policy.maybe_run([open_path], today=TODAY)
+    write_log(data_dir, "metrics_2024-01-10.csv", 200)
+    policy.last_run_ts += retention.QUOTA_CHECK_INTERVAL_SEC
+    policy.maybe_run([open_path], today=TODAY)
+    assert len(runs) == 1
+
+    # Over quota, once the interval elapsed.
+    policy.last_run_ts -= retention.QUOTA_CHECK_INTERVAL_SEC
+    policy.maybe_run([open_path], today=TODAY)
+    assert len(runs) == 2
+    assert os.listdir(data_dir) == ["metrics_2024-01-10.csv"]
+
+    policy.maybe_run([], today=TODAY + timedelta(days=1))
+    assert len(runs) == 3
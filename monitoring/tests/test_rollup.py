@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from hds_monitoring import models, rollup
+
+START = datetime(2024, 1, 1, 12)
+
+
+def minute(n):
+    return START + timedelta(minutes=n)
+
+
+def test_percentile():
+    assert rollup.percentile([1.0], 0.95) == 1.0
+    assert rollup.percentile([0.0, 10.0], 0.95) == pytest.approx(9.5)
+
+
+def test_row_is_written_when_bucket_completes(metrics_row):
+    aggregator = rollup.RollupAggregator("5m", 300)
+
+    for n in range(5):
+        assert aggregator.add(metrics_row("a", minute(n), float(n))) == []
+    [row] = aggregator.add(metrics_row("a", minute(5), 5.0))
+
+    assert row.timestamp == START
+    assert row.samples == 5
+    assert row.cpu_percent_min == 0.0
+    assert row.cpu_percent_max == 4.0
+    assert row.cpu_percent_mean == pytest.approx(2.0)
+    assert aggregator.bucket_start == minute(5)
+
+
+def test_bucket_spans_restarts(tmp_path, metrics_row):
+    path = str(tmp_path / "state" / "rollups.json")
+    rows = []
+    # One-shot runs, each with fresh aggregators, like new processes.
+    for n in range(7):
+        aggregators = rollup.make_aggregators()
+        rollup.load_state(path, aggregators)
+        for aggregator in aggregators:
+            rows.extend(aggregator.add(metrics_row("a", minute(n))))
+        rollup.save_state(path, aggregators)
+
+    [row] = rows
+    assert (row.timestamp, row.samples) == (START, 5)
+    aggregators = rollup.make_aggregators()
+    rollup.load_state(path, aggregators)
+    assert [row.timestamp for row in aggregators[0].rows] == [
+        minute(5),
+        minute(6),
+    ]
+    assert aggregators[1].bucket_start == START
+    assert len(aggregators[1].rows) == 7
+
+
+def test_state_of_other_layout_is_ignored(tmp_path, metrics_row):
+    path = str(tmp_path / "rollups.json")
+    aggregators = rollup.make_aggregators()
+    aggregators[0].add(metrics_row("a", START))
+    rollup.save_state(path, aggregators)
+    fields = models.METRICS_FIELD_NAMES
+    models.METRICS_FIELD_NAMES = fields + ["other"]
+    try:
+        aggregators = rollup.make_aggregators()
+        rollup.load_state(path, aggregators)
+    finally:
+        models.METRICS_FIELD_NAMES = fields
+
+    assert aggregators[0].rows == []
+    (tmp_path / "rollups.json").write_text("{")
+    rollup.load_state(path, aggregators)
+    assert aggregators[0].rows == []